@@ -1,18 +1,51 @@
+# Modules only some requests need (smtplib/email, cProfile/pstats, gzip,
+# openpyxl, the SQLite backend) are imported where they're used, to keep
+# import time down for gunicorn boots and the desktop EXE;
+# check_import_time.py holds the line. The admin and analytics routes stay
+# defined here: without those imports they are only function definitions
+# and URL rules, and moving them to blueprints would rename every endpoint
+# the templates' url_for() calls use.
 import os
 import sys
-from flask import Flask, render_template, request, redirect, url_for, send_from_directory, session, flash
-from datetime import datetime
+import csv
+import hashlib
+import hmac
+import io
+import json
+import logging
+import queue
+import random
+import re
+import secrets
+import select
+import stat
+import tempfile
+import threading
+import time
+import traceback
+from flask import Flask, render_template, request, redirect, url_for, send_from_directory, send_file, session, flash, make_response, has_request_context, g
+from flask import before_render_template, template_rendered
+from jinja2 import FileSystemBytecodeCache, Template
+from datetime import datetime, date
+from decimal import Decimal
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-import shutil
+from urllib.parse import urlsplit
+
+# Optional: operational metrics (/ops/metrics); everything still runs without it
+try:
+    import prometheus_client
+    from prometheus_client import Counter, Gauge, Histogram
+except ImportError:
+    prometheus_client = None
 
 # Postgres imports
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT, TRANSACTION_STATUS_IDLE
+from psycopg2.extras import RealDictCursor, execute_values as pg_execute_values
+from psycopg2.errors import QueryCanceled
+from psycopg2.pool import PoolError
 
 # --- Paths / base dirs ---
 if getattr(sys, "frozen", False):
@@ -25,6 +58,21 @@ else:
 # Postgres connection string from Render environment variable
 DATABASE_URL = os.environ.get("DATABASE_URL")
 
+# sqlite:///rma_system.db runs on the embedded SQLite backend instead
+# (offline desktop build, see db_sqlite.py); relative paths are under BASE_DIR
+DB_DIALECT = "sqlite" if (DATABASE_URL or "").startswith("sqlite:") else "postgres"
+SQLITE_PATH = (
+    os.path.join(BASE_DIR, DATABASE_URL[len("sqlite:///"):]) if DB_DIALECT == "sqlite" else None
+)
+
+# LISTEN needs a direct (session) connection; Neon's pooled endpoint drops
+# notifications, so point this at the non-pooler host when they differ.
+DATABASE_LISTEN_URL = os.environ.get("DATABASE_LISTEN_URL") or DATABASE_URL
+
+# Optional read replica (e.g. a Neon read replica endpoint) for the heavy
+# read-only pages; see READ REPLICA ROUTING. Unset = everything on the primary.
+DATABASE_READ_URL = os.environ.get("DATABASE_READ_URL") if DB_DIALECT == "postgres" else None
+
 
 app = Flask(
     __name__,
@@ -32,6 +80,42 @@ app = Flask(
     static_folder=os.path.join(BASE_DIR, "static")
 )
 
+# Changes whenever a template is edited/deployed; part of page ETags
+TEMPLATE_STAMP = str(max(
+    (os.path.getmtime(os.path.join(d, f)) for d, _, files in os.walk(app.template_folder) for f in files),
+    default=0,
+))
+
+# Compiled templates persist across restarts and are shared by all workers
+# (and the desktop EXE), so only the first process after a template change
+# compiles it. Entries are keyed by template source, so stale ones are ignored.
+# The cache holds code the app executes, so it must be private to this user:
+# Jinja's default directory is per-user, 0700 and ownership-checked; a
+# custom RMA_JINJA_CACHE_DIR has to pass the same checks or isn't used.
+JINJA_CACHE_DIR = os.environ.get("RMA_JINJA_CACHE_DIR")
+
+
+def private_cache_dir(path):
+    """True if path is (or could be created as) a directory only this user can write."""
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        st = os.lstat(path)
+    except OSError:
+        return False
+    if not stat.S_ISDIR(st.st_mode):
+        return False
+    if hasattr(os, "getuid"):    # POSIX; Windows temp dirs are per-user already
+        return st.st_uid == os.getuid() and not st.st_mode & 0o077
+    return True
+
+
+if JINJA_CACHE_DIR and not private_cache_dir(JINJA_CACHE_DIR):
+    print(f"RMA_JINJA_CACHE_DIR {JINJA_CACHE_DIR} is not a private (0700, own) directory; using the default")
+    JINJA_CACHE_DIR = None
+app.jinja_env.bytecode_cache = (
+    FileSystemBytecodeCache(JINJA_CACHE_DIR) if JINJA_CACHE_DIR else FileSystemBytecodeCache()
+)
+
 # Use env var in production, fallback for dev
 app.secret_key = os.environ.get("SECRET_KEY", "dev-secret-change-me")
 
@@ -59,6 +143,8 @@ EMAIL_CONFIG = {
 # status flow options
 # Canonical statuses for the whole app
 STATUS_OPTIONS = ['Draft', 'Acknowledged', 'In Progress', 'Disposition', 'Closed', 'Rejected']
+RETURN_TYPE_OPTIONS = ['TBD', 'Credit', 'Replacement', 'Repair and Return']
+DISPOSITION_OPTIONS = ['Scrap', 'Rework', 'Replace', 'Return to Customer', 'No Fault Found', 'Credit']
 
 def ensure_admin_user():
     """
@@ -242,15 +328,1297 @@ def allowed_file(filename: str) -> bool:
     return bool(filename and filename.strip())
 
 
+def parse_int(value):
+    """Blank -> None, otherwise int(). Raises ValueError on junk."""
+    if value is None or str(value).strip() == "":
+        return None
+    return int(str(value).strip())
+
+
+def parse_decimal(value):
+    """Blank -> None, otherwise Decimal. Raises ValueError on junk."""
+    if value is None or str(value).strip() == "":
+        return None
+    try:
+        return Decimal(str(value).strip())
+    except ArithmeticError:
+        raise ValueError(f"invalid number: {value!r}")
+
+
+# ============ REQUEST INSTRUMENTATION ============
+
+# Statements kept per request for the dev panel (all are still counted)
+QUERY_LOG_LIMIT = 200
+
+# Lists the statements behind each page at the bottom of base.html
+DEV_PANEL = os.environ.get("RMA_DEV_PANEL") == "1"
+
+# One JSON line per request: route, status, query count, DB/render/total ms
+request_log = logging.getLogger("rma.requests")
+if not request_log.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    request_log.addHandler(_handler)
+    request_log.setLevel(logging.INFO)
+    request_log.propagate = False
+
+
+def record_query(sql, params, seconds, rowcount):
+    """Add one statement to the current request's totals and the slow query log."""
+    text = sql.decode("utf-8", "replace") if isinstance(sql, bytes) else str(sql)
+    if seconds * 1000 >= SLOW_QUERY_MS:
+        note_slow_query(text, params, seconds, rowcount)
+    DB_QUERY_SECONDS.observe(seconds)
+
+    if not has_request_context() or "db_seconds" not in g:
+        return
+    g.db_count += 1
+    g.db_seconds += seconds
+    if len(g.db_statements) < QUERY_LOG_LIMIT:
+        g.db_statements.append({
+            "sql": " ".join(text.split()),
+            "ms": round(seconds * 1000, 2),
+            "rows": rowcount,
+        })
+    if app.config["N_PLUS_ONE_THRESHOLD"]:
+        check_n_plus_one(text)
+
+
+class TimedCursor(RealDictCursor):
+    """RealDictCursor that times every statement for the request totals."""
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(query, vars, time.perf_counter() - start, self.rowcount)
+
+    def executemany(self, query, vars_list):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            record_query(query, None, time.perf_counter() - start, self.rowcount)
+
+    def copy_expert(self, sql, file, size=8192):
+        start = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            record_query(sql, None, time.perf_counter() - start, self.rowcount)
+
+
+# ============ SLOW QUERY LOG ============
+#
+# Statements slower than SLOW_QUERY_MS are logged (normalized SQL, redacted
+# params, route) and stored in slow_queries by a background thread on its
+# own connection, so the request never waits on it. With
+# SLOW_QUERY_EXPLAIN=1 that thread also re-runs read-only SELECTs under
+# EXPLAIN (ANALYZE, BUFFERS) in a rolled-back transaction, at most once
+# per fingerprint per SLOW_QUERY_EXPLAIN_INTERVAL.
+# Table: see migrate_slow_queries.py. Admin page: /admin/slow-queries.
+
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "500"))
+SLOW_QUERY_EXPLAIN = os.environ.get("SLOW_QUERY_EXPLAIN") == "1"
+SLOW_QUERY_EXPLAIN_INTERVAL = 600    # seconds between plans for one fingerprint
+SLOW_QUERY_EXPLAIN_TIMEOUT_MS = 30000
+SLOW_QUERY_RETENTION_DAYS = 30
+
+slow_query_log = logging.getLogger("rma.slow_queries")
+if not slow_query_log.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    slow_query_log.addHandler(_handler)
+    slow_query_log.setLevel(logging.INFO)
+    slow_query_log.propagate = False
+
+_slow_queue = queue.Queue(maxsize=1000)
+_slow_lock = threading.Lock()
+_slow_worker = None
+_slow_explained = {}
+
+_SQL_NORMALIZERS = [
+    (re.compile(r"'(?:[^']|'')*'"), "?"),  # string literals
+    (re.compile(r"%\(\w+\)s|%s"), "?"),  # placeholders
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),  # numbers
+    (re.compile(r"\s+"), " "),
+    (re.compile(r" ?, ?"), ", "),
+    (re.compile(r"\(\?(?:, \?)*\)(?:, \(\?(?:, \?)*\))+"), "(...), ..."),  # VALUES lists
+    (re.compile(r"\(\?(?:, \?)+\)"), "(?, ...)"),  # IN lists
+]
+# EXPLAIN ANALYZE really runs the statement, so only plain reads qualify
+_SQL_WRITES = re.compile(r"\b(insert|update|delete|merge|truncate|nextval|setval|for update)\b", re.I)
+
+
+def normalize_sql(sql):
+    """SQL with literals and parameters replaced by ?, for grouping."""
+    for pattern, repl in _SQL_NORMALIZERS:
+        sql = pattern.sub(repl, sql)
+    return sql.strip()
+
+
+def redact_value(value):
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, (Decimal, datetime, date)):
+        return str(value)
+    if isinstance(value, (list, tuple)):
+        return f"<{len(value)} items>"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<{len(value)} bytes>"
+    return f"<str len={len(str(value))}>"
+
+
+def redact_params(params):
+    """Keep numbers/dates (ids, filters), hide the contents of strings and lists."""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {k: redact_value(v) for k, v in params.items()}
+    if isinstance(params, (list, tuple)):
+        return [redact_value(v) for v in params]
+    return redact_value(params)
+
+
+def note_slow_query(sql, params, seconds, rowcount):
+    normalized = normalize_sql(sql)
+    entry = {
+        "fingerprint": hashlib.md5(normalized.encode("utf-8")).hexdigest()[:16],
+        "sql": normalized,
+        "params": redact_params(params),
+        "ms": round(seconds * 1000, 1),
+        "rows": rowcount,
+        "route": None,
+        "endpoint": None,
+    }
+    if has_request_context():
+        entry["route"] = request.url_rule.rule if request.url_rule else request.path
+        entry["endpoint"] = request.endpoint
+    slow_query_log.info(json.dumps({"slow_query": entry}, default=str))
+    if DB_DIALECT != "postgres":
+        return    # the table and EXPLAIN capture are Postgres-only; the log line above still goes out
+
+    global _slow_worker
+    with _slow_lock:
+        if _slow_worker is None or not _slow_worker.is_alive():
+            _slow_worker = threading.Thread(target=store_slow_queries, name="slow-query-log", daemon=True)
+            _slow_worker.start()
+    # The raw SQL/params only live in memory until the EXPLAIN runs
+    try:
+        _slow_queue.put_nowait(dict(entry, raw_sql=sql, raw_params=params, captured_at=datetime.now()))
+    except queue.Full:
+        pass
+
+
+def explain_slow_query(conn, entry):
+    """EXPLAIN (ANALYZE, BUFFERS) text for a read-only statement, or None."""
+    sql = entry["raw_sql"]
+    if not SLOW_QUERY_EXPLAIN or not sql.lstrip().lower().startswith(("select", "with")) or _SQL_WRITES.search(sql):
+        return None
+    now = time.monotonic()
+    if now - _slow_explained.get(entry["fingerprint"], -SLOW_QUERY_EXPLAIN_INTERVAL) < SLOW_QUERY_EXPLAIN_INTERVAL:
+        return None
+    _slow_explained[entry["fingerprint"]] = now
+
+    cur = conn.cursor()
+    try:
+        cur.execute(f"SET LOCAL statement_timeout = {SLOW_QUERY_EXPLAIN_TIMEOUT_MS}")
+        cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql, entry["raw_params"])
+        return "\n".join(row[0] for row in cur.fetchall())
+    except Exception as e:
+        return f"EXPLAIN failed: {e}"
+    finally:
+        conn.rollback()
+
+
+def store_slow_queries():
+    """Background writer for the slow_queries table (one per worker)."""
+    conn = None
+    last_prune = 0
+    while True:
+        entry = _slow_queue.get()
+        try:
+            if conn is None or conn.closed:
+                conn = psycopg2.connect(DATABASE_URL)
+            plan = explain_slow_query(conn, entry)
+            cur = conn.cursor()
+            cur.execute(
+                """
+                INSERT INTO slow_queries
+                    (fingerprint, normalized_sql, params, duration_ms, row_count,
+                     route, endpoint, captured_at, plan)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """,
+                (
+                    entry["fingerprint"],
+                    entry["sql"],
+                    json.dumps(entry["params"], default=str),
+                    entry["ms"],
+                    entry["rows"],
+                    entry["route"],
+                    entry["endpoint"],
+                    entry["captured_at"],
+                    plan,
+                ),
+            )
+            if time.monotonic() - last_prune > 3600:
+                cur.execute(
+                    "DELETE FROM slow_queries WHERE captured_at < NOW() - %s * INTERVAL '1 day'",
+                    (SLOW_QUERY_RETENTION_DAYS,),
+                )
+                last_prune = time.monotonic()
+            conn.commit()
+        except Exception as e:
+            print("Slow query log error:", e)
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            conn = None
+
+
+# ============ N+1 DETECTION ============
+#
+# Counts statements per request by normalized SQL. A fingerprint that runs
+# more than N_PLUS_ONE_THRESHOLD times is flagged with the app stack that
+# issued it: logged at the end of the request (with the final count) and
+# listed in the dev panel. With N_PLUS_ONE_RAISE it raises NPlusOneError
+# at the offending execute() instead, so a test client request fails;
+# check_n_plus_one.py runs the key pages that way.
+#
+#   app.config.update(N_PLUS_ONE_THRESHOLD=5, N_PLUS_ONE_RAISE=True)
+
+app.config.setdefault(
+    "N_PLUS_ONE_THRESHOLD",
+    int(os.environ.get("RMA_N_PLUS_ONE_THRESHOLD", "10" if DEV_PANEL else "0")),
+)
+app.config.setdefault("N_PLUS_ONE_RAISE", os.environ.get("RMA_N_PLUS_ONE_RAISE") == "1")
+
+n_plus_one_log = logging.getLogger("rma.n_plus_one")
+if not n_plus_one_log.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    n_plus_one_log.addHandler(_handler)
+    n_plus_one_log.setLevel(logging.INFO)
+    n_plus_one_log.propagate = False
+
+# Instrumentation frames left out of the reported stack
+_N_PLUS_ONE_SKIP = {"check_n_plus_one", "record_query", "execute", "executemany", "copy_expert"}
+
+
+class NPlusOneError(RuntimeError):
+    """The same statement ran too many times in one request."""
+
+
+def app_stack():
+    """Frames from this project's files only, innermost last."""
+    return [
+        f for f in traceback.extract_stack()
+        if f.filename.startswith(BASE_DIR) and f.name not in _N_PLUS_ONE_SKIP
+    ]
+
+
+def check_n_plus_one(sql):
+    threshold = app.config["N_PLUS_ONE_THRESHOLD"]
+    fingerprint = normalize_sql(sql)
+    counts = g.setdefault("db_fingerprints", {})
+    counts[fingerprint] = counts.get(fingerprint, 0) + 1
+    if counts[fingerprint] != threshold + 1:
+        return
+
+    stack = "".join(traceback.format_list(app_stack()))
+    g.setdefault("n_plus_one", []).append({"sql": fingerprint, "stack": stack})
+    if app.config["N_PLUS_ONE_RAISE"]:
+        raise NPlusOneError(
+            f"{request_route()}: statement ran more than {threshold} times\n{fingerprint}\n{stack}"
+        )
+
+
+def report_n_plus_one():
+    """Log each flagged fingerprint once, with its count for the whole request."""
+    for item in g.get("n_plus_one", []):
+        item["count"] = g.db_fingerprints[item["sql"]]
+        n_plus_one_log.warning(json.dumps({"n_plus_one": {
+            "route": request_route(),
+            "endpoint": request.endpoint,
+            "count": item["count"],
+            "sql": item["sql"],
+            "stack": item["stack"],
+        }}))
+
+
+# ============ OPERATIONAL METRICS (PROMETHEUS) ============
+#
+# Exposed at /ops/metrics (the business dashboard owns /metrics). Under
+# gunicorn, startup.sh sets PROMETHEUS_MULTIPROC_DIR so every worker writes
+# to shared files and a scrape sees all of them; gunicorn.conf.py cleans up
+# after dead workers.
+
+OPS_METRICS_TOKEN = os.environ.get("OPS_METRICS_TOKEN", "")
+
+
+class _NoMetric:
+    """Stand-in when prometheus_client isn't installed."""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def observe(self, amount):
+        pass
+
+
+if prometheus_client:
+    HTTP_REQUEST_SECONDS = Histogram(
+        "rma_http_request_duration_seconds", "Request latency by route", ["method", "route"]
+    )
+    HTTP_REQUESTS = Counter(
+        "rma_http_requests_total", "Requests by route and status", ["method", "route", "status"]
+    )
+    HTTP_IN_PROGRESS = Gauge(
+        "rma_http_requests_in_progress", "Requests being handled", multiprocess_mode="livesum"
+    )
+    DB_CONNECTIONS_OPEN = Gauge(
+        "rma_db_connections_open", "Connections opened by get_db() and not yet closed",
+        multiprocess_mode="livesum",
+    )
+    DB_CONNECT_SECONDS = Histogram(
+        "rma_db_connect_seconds", "Time to get a connection from get_db() (pool wait or connect)",
+        buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+    )
+    DB_POOL_IN_USE = Gauge(
+        "rma_db_pool_in_use", "Pooled connections checked out", multiprocess_mode="livesum"
+    )
+    DB_QUERIES = Counter("rma_db_queries_total", "Statements run, by route", ["route"])
+    DB_QUERY_SECONDS = Histogram("rma_db_query_duration_seconds", "Statement latency")
+    EMAIL_SENDS_IN_PROGRESS = Gauge(
+        "rma_email_sends_in_progress", "Notification emails waiting on SMTP", multiprocess_mode="livesum"
+    )
+    EMAIL_SEND_SECONDS = Histogram("rma_email_send_seconds", "SMTP send latency")
+    EMAILS = Counter("rma_emails_total", "Notification emails by result", ["result"])
+    UPLOAD_BYTES = Counter("rma_attachment_upload_bytes_total", "Attachment bytes stored")
+    UPLOAD_SECONDS = Histogram("rma_attachment_upload_seconds", "Time to store one attachment")
+    TEMPLATE_RENDER_SECONDS = Histogram(
+        "rma_template_render_seconds", "Render time per template, including its includes", ["template"]
+    )
+    DB_STATEMENT_TIMEOUTS = Counter(
+        "rma_db_statement_timeouts_total", "Statements cancelled by the route's statement_timeout", ["route"]
+    )
+    REPLICA_LAG = Gauge(
+        "rma_db_replica_lag_seconds", "Last measured read replica lag", multiprocess_mode="livemax"
+    )
+    DB_READ_ROUTING = Counter(
+        "rma_db_read_routing_total", "Read-only requests by database used and why", ["target", "reason"]
+    )
+else:
+    HTTP_REQUEST_SECONDS = HTTP_REQUESTS = HTTP_IN_PROGRESS = _NoMetric()
+    DB_CONNECTIONS_OPEN = DB_CONNECT_SECONDS = DB_POOL_IN_USE = DB_QUERIES = DB_QUERY_SECONDS = _NoMetric()
+    EMAIL_SENDS_IN_PROGRESS = EMAIL_SEND_SECONDS = EMAILS = _NoMetric()
+    UPLOAD_BYTES = UPLOAD_SECONDS = TEMPLATE_RENDER_SECONDS = _NoMetric()
+    REPLICA_LAG = DB_READ_ROUTING = DB_STATEMENT_TIMEOUTS = _NoMetric()
+
+
+class TrackedConnection(psycopg2.extensions.connection):
+    """
+    Connection that keeps rma_db_connections_open accurate, even if leaked.
+    If it came from the pool, close() hands it back instead of closing it.
+    """
+
+    _counted = False
+    pool = None
+    checked_out = False
+    lease = 0    # bumped on every checkout, so a stale holder can't return it
+
+    def track(self):
+        self._counted = True
+        DB_CONNECTIONS_OPEN.inc()
+
+    def _untrack(self):
+        if self._counted:
+            self._counted = False
+            DB_CONNECTIONS_OPEN.dec()
+
+    def close(self):
+        if self.checked_out:
+            self.pool.put(self)
+        else:
+            self.discard()
+
+    def discard(self):
+        """Really close it."""
+        self._untrack()
+        super().close()
+
+    def __del__(self):
+        if self.checked_out:
+            self.pool.lost(self)
+        self._untrack()
+
+
+def request_route():
+    """Route template for labels (keeps unmatched paths out of the label set)."""
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.db_count = 0
+    g.db_seconds = 0.0
+    g.db_statements = []
+    g.render_seconds = 0.0
+    g.template_stack = []
+    g.template_times = {}
+    HTTP_IN_PROGRESS.inc()
+
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    if "request_started" in g:
+        HTTP_IN_PROGRESS.dec()
+    # Routes that raised before conn.close() would otherwise hold a pool slot
+    for conn, lease in g.pop("db_conns", ()):
+        if conn.checked_out and conn.lease == lease:
+            conn.close()
+
+
+def timed_render(name, render_func):
+    """
+    Wrap a template's root render function to time it. Includes and
+    extends go through the same function, so every template/include in a
+    page gets its own entry: [calls, total seconds, self seconds], where
+    self excludes the templates rendered inside it.
+    """
+    def render(context):
+        if not has_request_context() or "template_stack" not in g:
+            yield from render_func(context)
+            return
+        stack = g.template_stack
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield from render_func(context)
+        finally:
+            total = time.perf_counter() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += total
+            times = g.template_times.setdefault(name, [0, 0.0, 0.0])
+            times[0] += 1
+            times[1] += total
+            times[2] += total - children
+            TEMPLATE_RENDER_SECONDS.labels(name).observe(total)
+    return render
+
+
+# _from_namespace is Jinja-internal (every compiled template, includes too,
+# is built through it); Jinja2 is pinned in requirements.txt for this reason.
+class TimedTemplate(Template):
+    @classmethod
+    def _from_namespace(cls, environment, namespace, globals):
+        template = super()._from_namespace(environment, namespace, globals)
+        template.root_render_func = timed_render(template.name, template.root_render_func)
+        return template
+
+
+app.jinja_env.template_class = TimedTemplate
+
+
+def precompile_templates():
+    """Compile every template up front so no request pays for it."""
+    names = app.jinja_env.list_templates(extensions=["html"])
+    for name in names:
+        app.jinja_env.get_template(name)
+    return f"{len(names)} compiled"
+
+
+@before_render_template.connect_via(app)
+def start_render_timer(sender, template, context, **extra):
+    g.render_started = time.perf_counter()
+
+
+@template_rendered.connect_via(app)
+def stop_render_timer(sender, template, context, **extra):
+    if "render_started" in g:
+        g.render_seconds += time.perf_counter() - g.pop("render_started")
+
+
+@app.after_request
+def add_server_timing(response):
+    """Server-Timing header (db, tpl, total) plus the structured request log line."""
+    if "request_started" not in g:
+        return response
+    total_ms = (time.perf_counter() - g.request_started) * 1000
+    db_ms = g.db_seconds * 1000
+    render_ms = g.render_seconds * 1000
+
+    response.headers["Server-Timing"] = (
+        f'db;dur={db_ms:.1f};desc="{g.db_count} queries", '
+        f"tpl;dur={render_ms:.1f}, "
+        f"total;dur={total_ms:.1f}"
+    )
+    route = request_route()
+    HTTP_REQUEST_SECONDS.labels(request.method, route).observe(total_ms / 1000)
+    HTTP_REQUESTS.labels(request.method, route, str(response.status_code)).inc()
+    if g.db_count:
+        DB_QUERIES.labels(route).inc(g.db_count)
+    report_n_plus_one()
+
+    request_log.info(json.dumps({
+        "method": request.method,
+        "route": request.url_rule.rule if request.url_rule else request.path,
+        "endpoint": request.endpoint,
+        "status": response.status_code,
+        "queries": g.db_count,
+        "db_ms": round(db_ms, 1),
+        "render_ms": round(render_ms, 1),
+        "total_ms": round(total_ms, 1),
+        "templates": {name: round(t[1] * 1000, 1) for name, t in g.template_times.items()},
+    }))
+    return response
+
+
+# ============ REQUEST PROFILER ============
+#
+# On demand: an admin adds `X-Profile: 1` (stack sampling) or
+# `X-Profile: cprofile` to a request, or ?_profile=1 / ?_profile=cprofile,
+# and that one request is profiled. At most one per PROFILE_MIN_INTERVAL
+# per worker; the response says X-Profile: captured / rate-limited.
+# Background: RMA_PROFILE_SAMPLE_RATE=0.01 samples 1% of requests, at most
+# one per route per PROFILE_ROUTE_INTERVAL per worker. Off (the default)
+# it costs one header lookup per request.
+# Profiles go to request_profiles (see migrate_request_profiles.py) and
+# are listed on /admin/profiles. Sampled profiles are folded stacks, the
+# input format of flamegraph.pl and speedscope; cProfile runs download as
+# .prof for snakeviz / pstats.
+
+PROFILE_MIN_INTERVAL = 10         # seconds between on-demand profiles
+PROFILE_SAMPLE_RATE = float(os.environ.get("RMA_PROFILE_SAMPLE_RATE", "0"))
+PROFILE_ROUTE_INTERVAL = 300      # background: seconds between profiles of one route
+PROFILE_SAMPLE_INTERVAL = 0.005   # seconds between stack samples
+PROFILE_STATS_LINES = 60
+PROFILE_KEEP = 500                # newest rows kept in request_profiles
+PROFILE_SKIP_ENDPOINTS = {"static", "live_events"}
+
+_profile_lock = threading.Lock()
+_last_on_demand_profile = 0.0
+_last_route_profile = {}
+_worker_profile_busy = False    # gevent: one cProfile at a time per worker
+
+
+class StackSampler:
+    """Samples one thread's stack on a timer; the result is folded stacks."""
+
+    mode = "sample"
+
+    def __init__(self, interval=PROFILE_SAMPLE_INTERVAL):
+        self.thread_id = threading.get_ident()
+        self.interval = interval
+        self.counts = {}
+        self.samples = 0
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                key = ";".join(reversed(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+                self.samples += 1
+
+    def stop(self):
+        self._done.set()
+        self._thread.join()
+
+        # Readable summary for the admin page: where the samples landed
+        leaves = {}
+        for stack, count in self.counts.items():
+            leaf = stack.rsplit(";", 1)[-1]
+            leaves[leaf] = leaves.get(leaf, 0) + count
+        lines = [f"{'samples':>8}  {'%':>6}  function (self time)"]
+        for leaf, count in sorted(leaves.items(), key=lambda kv: -kv[1])[:PROFILE_STATS_LINES]:
+            lines.append(f"{count:>8}  {100 * count / self.samples:>6.1f}  {leaf}")
+
+        return {
+            "samples": self.samples,
+            "folded": "\n".join(f"{stack} {count}" for stack, count in sorted(self.counts.items())),
+            "stats": "\n".join(lines) if self.samples else "No samples (request finished too quickly).",
+            "raw": None,
+        }
+
+
+class RequestCProfile:
+    """
+    cProfile for the current thread, from before_request to after_request.
+    whole_worker: the thread is a gevent worker's, shared by every greenlet,
+    so the profile covers all of them; the stats say so.
+    """
+
+    mode = "cprofile"
+
+    def __init__(self, whole_worker=False):
+        import cProfile
+        self.whole_worker = whole_worker
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def stop(self):
+        import marshal
+        import pstats
+
+        self.profile.disable()
+        if self.whole_worker:
+            release_worker_profile()
+        out = io.StringIO()
+        if self.whole_worker:
+            out.write(
+                "gevent worker: this profile covers every greenlet the worker ran\n"
+                "while the request was in flight, not only this request.\n\n"
+            )
+        pstats.Stats(self.profile, stream=out).sort_stats("cumulative").print_stats(PROFILE_STATS_LINES)
+        self.profile.create_stats()
+        return {
+            "samples": None,
+            "folded": None,
+            "stats": out.getvalue(),
+            # Same bytes as Profile.dump_stats(), so the download opens in snakeviz
+            "raw": marshal.dumps(self.profile.stats),
+        }
+
+
+def claim_on_demand_profile():
+    global _last_on_demand_profile
+    with _profile_lock:
+        now = time.monotonic()
+        if now - _last_on_demand_profile < PROFILE_MIN_INTERVAL:
+            return False
+        _last_on_demand_profile = now
+        return True
+
+
+def claim_worker_profile():
+    global _worker_profile_busy
+    with _profile_lock:
+        if _worker_profile_busy:
+            return False
+        _worker_profile_busy = True
+        return True
+
+
+def release_worker_profile():
+    global _worker_profile_busy
+    with _profile_lock:
+        _worker_profile_busy = False
+
+
+def claim_background_profile(route):
+    with _profile_lock:
+        now = time.monotonic()
+        if now - _last_route_profile.get(route, -PROFILE_ROUTE_INTERVAL) < PROFILE_ROUTE_INTERVAL:
+            return False
+        _last_route_profile[route] = now
+        return True
+
+
+@app.before_request
+def start_profiler():
+    flag = request.headers.get("X-Profile") or request.args.get("_profile")
+    if not flag and not (PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE):
+        return
+    if request.endpoint in PROFILE_SKIP_ENDPOINTS:
+        return
+
+    if flag:
+        user = get_current_user() if "user_id" in session else None
+        if not user or user["role"] != "admin":
+            return
+        if not claim_on_demand_profile():
+            g.profile_status = "rate-limited"
+            return
+        g.profile_trigger = "on_demand"
+        g.profile_user = user["username"]
+        mode = "cprofile" if flag == "cprofile" else "sample"
+    else:
+        if not claim_background_profile(request_route()):
+            return
+        g.profile_trigger = "background"
+        g.profile_user = None
+        mode = "sample"
+
+    # Under gevent every request shares one OS thread: stack sampling would
+    # only ever see the sampler itself, and two cProfiles would replace each
+    # other's hook. So one cProfile at a time, covering the whole worker.
+    if GREEN_DB:
+        if not claim_worker_profile():
+            g.profile_status = "busy"
+            return
+        try:
+            g.profiler = RequestCProfile(whole_worker=True)
+        except ValueError:
+            release_worker_profile()
+            g.profile_status = "busy"
+        return
+    if mode == "cprofile":
+        try:
+            g.profiler = RequestCProfile()
+            return
+        except ValueError:
+            # Another thread's cProfile is running (one per process on 3.12+)
+            pass
+    g.profiler = StackSampler()
+
+
+@app.after_request
+def stop_profiler(response):
+    profiler = g.pop("profiler", None)
+    if profiler is None:
+        if "profile_status" in g:
+            response.headers["X-Profile"] = g.profile_status
+        return response
+
+    entry = profiler.stop()
+    entry.update(
+        mode=profiler.mode,
+        trigger=g.profile_trigger,
+        requested_by=g.profile_user,
+        method=request.method,
+        path=request.full_path.rstrip("?"),
+        route=request_route(),
+        endpoint=request.endpoint,
+        status=response.status_code,
+        duration_ms=(time.perf_counter() - g.request_started) * 1000,
+    )
+    # Written once the response is out, on a plain connection so it isn't
+    # counted in this request's query totals
+    response.call_on_close(lambda: save_profile(entry))
+    response.headers["X-Profile"] = "captured"
+    return response
+
+
+@app.teardown_request
+def discard_profiler(exc):
+    """Stop a profiler whose after_request never ran, so it doesn't keep the worker's claim."""
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.stop()
+
+
+def save_profile(entry):
+    if DB_DIALECT != "postgres":
+        return    # stored on the server database only
+    try:
+        conn = psycopg2.connect(DATABASE_URL)
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO request_profiles (
+                mode, trigger, requested_by, method, path, route, endpoint,
+                status, duration_ms, samples, folded, stats, raw
+            )
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """,
+            (
+                entry["mode"], entry["trigger"], entry["requested_by"], entry["method"],
+                entry["path"], entry["route"], entry["endpoint"], entry["status"],
+                entry["duration_ms"], entry["samples"], entry["folded"], entry["stats"],
+                psycopg2.Binary(entry["raw"]) if entry["raw"] else None,
+            ),
+        )
+        cur.execute(
+            """
+            DELETE FROM request_profiles
+            WHERE profile_id <= (
+                SELECT profile_id FROM request_profiles
+                ORDER BY profile_id DESC
+                OFFSET %s LIMIT 1
+            )
+            """,
+            (PROFILE_KEEP,),
+        )
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        print("Profile save error:", e)
+
+
+# ============ CONNECTION POOL ============
+#
+# get_db() hands out pooled connections; conn.close() returns them, so the
+# routes are unchanged. The pool is per process (re-created after fork) and
+# built on queue/threading, which gevent patches, so waiting for a free
+# connection parks only the waiting greenlet. Size it to what the database
+# allows per worker (Neon's pooled endpoint takes hundreds);
+# RMA_DB_POOL_SIZE=0 goes back to a new connection per get_db(). With
+# DATABASE_READ_URL set, the replica gets a pool of its own (same settings).
+# gevent workers run up to --worker-connections requests at once, so there
+# the default is one connection per greenlet rather than 20.
+
+if os.environ.get("GUNICORN_WORKER_CLASS") == "gevent":
+    _default_pool_size = os.environ.get("GUNICORN_WORKER_CONNECTIONS", "500")    # startup.sh's default
+else:
+    _default_pool_size = "20"
+DB_POOL_SIZE = int(os.environ.get("RMA_DB_POOL_SIZE", _default_pool_size))
+DB_POOL_TIMEOUT = float(os.environ.get("RMA_DB_POOL_TIMEOUT", "10"))
+DB_POOL_MAX_IDLE = 60    # seconds; Neon drops idle connections, so recycle before it does
+
+_db_pools = {}    # dsn -> ConnectionPool
+_db_pool_lock = threading.Lock()
+_abandoned_pools = []    # pools inherited over fork; closing them would kill the parent's sessions
+
+
+class ConnectionPool:
+    def __init__(self, dsn, size, timeout, max_idle):
+        self.dsn = dsn
+        self.size = size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def get(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolError(
+                f"No database connection free after {self.timeout:g}s (pool size {self.size})"
+            )
+        try:
+            while True:
+                try:
+                    conn, idle_since = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                if conn.closed or time.monotonic() - idle_since > self.max_idle:
+                    conn.discard()
+                    continue
+                return self._check_out(conn)
+
+            conn = psycopg2.connect(
+                self.dsn, connection_factory=TrackedConnection, cursor_factory=TimedCursor
+            )
+            conn.track()
+            conn.pool = self
+            return self._check_out(conn)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _check_out(self, conn):
+        conn.checked_out = True
+        conn.lease += 1
+        DB_POOL_IN_USE.inc()
+        return conn
+
+    def put(self, conn):
+        """Back to the pool, rolled back; broken connections are dropped."""
+        conn.checked_out = False
+        DB_POOL_IN_USE.dec()
+        try:
+            if not conn.closed and conn.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            if conn.closed:
+                conn.discard()
+            else:
+                self._idle.put((conn, time.monotonic()))
+        except psycopg2.Error:
+            conn.discard()
+        finally:
+            self._slots.release()
+
+    def lost(self, conn):
+        """A checked-out connection was garbage collected; free its slot."""
+        conn.checked_out = False
+        DB_POOL_IN_USE.dec()
+        self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            conn.discard()
+
+
+def get_db_pool(dsn=None):
+    """This process's pool for dsn (default: the primary, DATABASE_URL)."""
+    dsn = dsn or DATABASE_URL
+    pool = _db_pools.get(dsn)
+    if pool is not None and pool.pid == os.getpid():
+        return pool
+    with _db_pool_lock:
+        pool = _db_pools.get(dsn)
+        if pool is None or pool.pid != os.getpid():
+            if pool is not None:
+                _abandoned_pools.append(pool)
+            pool = _db_pools[dsn] = ConnectionPool(dsn, DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_POOL_MAX_IDLE)
+        return pool
+
+
+def close_db_pool():
+    """Close this process's idle pooled connections (e.g. before forking workers)."""
+    with _db_pool_lock:
+        for pool in _db_pools.values():
+            if pool.pid == os.getpid():
+                pool.close()
+        _db_pools.clear()
+
+
+# ============ GEVENT (COOPERATIVE) MODE ============
+#
+# GUNICORN_WORKER_CLASS=gevent in startup.sh. gunicorn.conf.py calls
+# make_db_green() in each worker after gevent has patched the stdlib, so
+# sockets (SMTP, LISTEN), locks, queues and sleeps already cooperate; this
+# makes psycopg2 cooperate too. run_blocking() covers plain file I/O.
+
+GREEN_DB = False
+
+
+def make_db_green():
+    """psycopg2 waits on its socket through gevent, parking only the current greenlet."""
+    global GREEN_DB
+    from gevent.socket import wait_read, wait_write
+
+    def wait_callback(conn, timeout=None):
+        while True:
+            state = conn.poll()
+            if state == psycopg2.extensions.POLL_OK:
+                return
+            if state == psycopg2.extensions.POLL_READ:
+                wait_read(conn.fileno(), timeout=timeout)
+            elif state == psycopg2.extensions.POLL_WRITE:
+                wait_write(conn.fileno(), timeout=timeout)
+            else:
+                raise psycopg2.OperationalError(f"Bad result from poll: {state!r}")
+
+    psycopg2.extensions.set_wait_callback(wait_callback)
+    GREEN_DB = True
+
+
+def run_blocking(func, *args, **kwargs):
+    """
+    Call func; in gevent mode on gevent's thread pool, so slow disk or SMB
+    share writes don't stall every other request in the worker.
+    """
+    if GREEN_DB:
+        import gevent
+        return gevent.get_hub().threadpool.apply(func, args, kwargs)
+    return func(*args, **kwargs)
+
+
+# ============ READ REPLICA ROUTING ============
+#
+# With DATABASE_READ_URL set, GET requests to views marked @replica_reads
+# (big read-only pages and exports) get their get_db() connection from the
+# replica; everything else stays on the primary. A request goes to the
+# primary anyway when:
+#   - this session wrote something in the last READ_AFTER_WRITE_SECONDS,
+#     so a redirect after a POST shows the change (read-your-writes),
+#   - the replica is more than REPLICA_MAX_LAG seconds behind, or
+#   - the replica couldn't be reached on the last check or connect.
+# Lag is measured at most every REPLICA_LAG_CHECK_INTERVAL seconds per
+# worker and exported as rma_db_replica_lag_seconds.
+
+REPLICA_MAX_LAG = float(os.environ.get("RMA_REPLICA_MAX_LAG", "5"))
+READ_AFTER_WRITE_SECONDS = float(os.environ.get("RMA_READ_AFTER_WRITE_SECONDS", "15"))
+REPLICA_LAG_CHECK_INTERVAL = 5    # seconds
+
+# Zero when the replica has replayed everything it received; otherwise the
+# age of the last replayed transaction (idle primaries would read as lag)
+REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END AS lag
+"""
+
+_replica_lag = {"checked": 0.0, "lag": None}    # lag None = unreachable
+_replica_lag_lock = threading.Lock()
+
+
+def replica_reads(f):
+    """Mark a read-only view as safe to serve from DATABASE_READ_URL."""
+    f.replica_reads = True
+    return f
+
+
+def replica_lag():
+    """Replica lag in seconds (cached), or None when the replica can't be reached."""
+    now = time.monotonic()
+    if now - _replica_lag["checked"] < REPLICA_LAG_CHECK_INTERVAL:
+        return _replica_lag["lag"]
+    with _replica_lag_lock:
+        if now - _replica_lag["checked"] < REPLICA_LAG_CHECK_INTERVAL:
+            return _replica_lag["lag"]
+        _replica_lag["checked"] = now    # claim this check; others use the last value meanwhile
+
+    lag = None
+    conn = None
+    try:
+        if DB_POOL_SIZE > 0:
+            conn = get_db_pool(DATABASE_READ_URL).get()
+        else:
+            conn = psycopg2.connect(DATABASE_READ_URL, connection_factory=TrackedConnection)
+            conn.track()
+        # plain cursor: the check isn't one of the request's queries
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(REPLICA_LAG_SQL)
+            lag = float(cur.fetchone()["lag"])
+        conn.rollback()
+        REPLICA_LAG.set(lag)
+    except (psycopg2.Error, PoolError) as e:
+        print("Read replica check failed:", e)
+    finally:
+        if conn is not None:
+            conn.close()
+    _replica_lag["lag"] = lag
+    return lag
+
+
+def mark_replica_down():
+    _replica_lag["checked"] = time.monotonic()
+    _replica_lag["lag"] = None
+
+
+@app.before_request
+def choose_read_target():
+    """Set g.use_replica for marked read-only GETs when the replica is fit to serve them."""
+    g.use_replica = False
+    if not DATABASE_READ_URL or request.method not in ("GET", "HEAD"):
+        return
+    view = app.view_functions.get(request.endpoint)
+    if not getattr(view, "replica_reads", False):
+        return
+
+    if time.time() - session.get("wrote_at", 0) < READ_AFTER_WRITE_SECONDS:
+        reason = "read_your_writes"
+    else:
+        lag = replica_lag()
+        if lag is None:
+            reason = "replica_down"
+        elif lag > REPLICA_MAX_LAG:
+            reason = "lag"
+        else:
+            reason = "ok"
+            g.use_replica = True
+    DB_READ_ROUTING.labels("replica" if g.use_replica else "primary", reason).inc()
+
+
+@app.after_request
+def remember_write(response):
+    """Stamp the session after a successful write so its next reads stay on the primary."""
+    if DATABASE_READ_URL and request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+        session["wrote_at"] = time.time()
+    return response
+
+
+# ============ STATEMENT TIMEOUTS ============
+#
+# The heavy read pages get a statement_timeout budget, set with SET LOCAL
+# on the connection get_db() hands them, so it ends with the transaction
+# (pooled connections and Neon's transaction pooler never carry it over).
+# A query past its budget is cancelled by Postgres (QueryCanceled) instead
+# of running into gunicorn's worker timeout. list_rmas and metrics degrade
+# in place (a "narrow your filter" state, the last cached figures); on the
+# other pages statement_timed_out() sends the user back with a warning.
+# SQLite has no statement_timeout, so the desktop build runs without one.
+
+STATEMENT_TIMEOUTS = {    # endpoint -> seconds
+    "list_rmas": 10,
+    "list_customers": 10,
+    "metrics": 20,
+    "credit_dashboard": 15,
+    "export_metrics": 60,
+    "export_credit_dashboard": 60,
+}
+
+
+def set_statement_timeout(conn, seconds):
+    # plain cursor: not one of the request's queries
+    with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+        cur.execute("SET LOCAL statement_timeout = %s", (f"{int(seconds * 1000)}ms",))
+
+
+def note_statement_timeout():
+    """Count (and log) a statement cancelled by the current route's budget."""
+    DB_STATEMENT_TIMEOUTS.labels(request_route()).inc()
+    print(f"Statement timeout ({STATEMENT_TIMEOUTS.get(request.endpoint)}s) on {request.full_path}")
+
+
+@app.errorhandler(QueryCanceled)
+def statement_timed_out(e):
+    note_statement_timeout()
+    flash("That page took too long to load. Narrow your filter and try again.", "warning")
+    # back where they came from, unless that's this page (it would just time out again)
+    back = request.referrer
+    if not back or urlsplit(back).path == request.path:
+        back = url_for("index")
+    return redirect(back)
+
+
 def get_db():
     try:
-        conn = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+        start = time.perf_counter()
+        if DB_DIALECT == "sqlite":
+            import db_sqlite
+            conn = db_sqlite.connect(SQLITE_PATH, on_query=record_query)
+        else:
+            conn = None
+            if has_request_context() and g.get("use_replica"):
+                try:
+                    conn = connect_postgres(DATABASE_READ_URL)
+                except (psycopg2.Error, PoolError) as e:
+                    print("Read replica unavailable, using the primary:", e)
+                    mark_replica_down()
+                    g.use_replica = False
+                    DB_READ_ROUTING.labels("primary", "replica_down").inc()
+            if conn is None:
+                conn = connect_postgres(DATABASE_URL)
+            budget = STATEMENT_TIMEOUTS.get(request.endpoint) if has_request_context() else None
+            if budget:
+                set_statement_timeout(conn, budget)
+        DB_CONNECT_SECONDS.observe(time.perf_counter() - start)
         return conn
     except Exception as e:
         print("Database connection error:", e)
         raise
 
 
+def connect_postgres(dsn):
+    """A pooled connection to dsn, or a new one when pooling is off."""
+    if DB_POOL_SIZE > 0:
+        conn = get_db_pool(dsn).get()
+        if has_request_context():
+            g.setdefault("db_conns", []).append((conn, conn.lease))
+    else:
+        conn = psycopg2.connect(dsn, connection_factory=TrackedConnection, cursor_factory=TimedCursor)
+        conn.track()
+    return conn
+
+
+def execute_values(cur, sql, argslist, template=None, page_size=100, fetch=False):
+    """psycopg2.extras.execute_values, or the SQLite cursor's equivalent."""
+    if DB_DIALECT == "sqlite":
+        return cur.execute_values(sql, argslist, template, page_size, fetch)
+    return pg_execute_values(cur, sql, argslist, template=template, page_size=page_size, fetch=fetch)
+
+
+def bump_rma_version(cur, rma_id, kind="updated"):
+    """
+    Mark an RMA as changed. Routes that only touch child tables (lines,
+    dispositions, owners, attachments, history) call this so view_rma's
+    ETag and the API row_version move with them. Also announces the change
+    to open pages (see notify_rma_event).
+    """
+    ids = rma_id if isinstance(rma_id, list) else [rma_id]
+    cur.execute(
+        """
+        UPDATE rmas
+        SET row_version = row_version + 1,
+            updated_at = NOW()
+        WHERE rma_id = ANY(%s)
+        """,
+        (ids,),
+    )
+    notify_rma_event(cur, ids, kind)
+
+
+def bump_customer_rmas(cur, customer_id):
+    """bump_rma_version() on every RMA of a customer whose details changed."""
+    cur.execute("SELECT rma_id FROM rmas WHERE customer_id = %s", (customer_id,))
+    rma_ids = [r["rma_id"] for r in cur.fetchall()]
+    if rma_ids:
+        bump_rma_version(cur, rma_ids, "customer")
+
+
+def bump_user_rmas(cur, user_id):
+    """bump_rma_version() on every RMA whose detail page shows this user's name."""
+    cur.execute(
+        """
+        SELECT rma_id FROM rma_owners WHERE user_id = %(id)s
+        UNION SELECT rma_id FROM rmas WHERE created_by_user_id = %(id)s
+        UNION SELECT rma_id FROM status_history WHERE changed_by = %(id)s
+        UNION SELECT rma_id FROM credit_history WHERE action_by = %(id)s
+        UNION SELECT rma_id FROM attachments WHERE added_by = %(id)s::text
+        UNION SELECT rl.rma_id
+              FROM dispositions d
+              JOIN rma_lines rl ON rl.rma_line_id = d.rma_line_id
+              WHERE d.disposition_by = %(id)s
+        """,
+        {"id": user_id},
+    )
+    rma_ids = [r["rma_id"] for r in cur.fetchall()]
+    if rma_ids:
+        bump_rma_version(cur, rma_ids, "owners")
+
+
+# Channel for live page updates; payload is {"rma_id", "kind", "origin"}
+RMA_EVENTS_CHANNEL = "rma_events"
+
+
+def notify_rma_event(cur, rma_id, kind):
+    """
+    Queue a NOTIFY for each RMA. Postgres only delivers it if the
+    transaction commits, so call this before conn.commit(). `origin` lets
+    the page that made the change skip its own event. rma_id=None sends a
+    single event meaning "many RMAs changed" (bulk import).
+    """
+    if DB_DIALECT != "postgres":
+        return    # no LISTEN/NOTIFY; the desktop build has a single window anyway
+    ids = rma_id if isinstance(rma_id, list) else [rma_id]
+    origin = request.headers.get("X-Client-Id") if has_request_context() else None
+    cur.execute(
+        """
+        SELECT pg_notify(%s, json_build_object('rma_id', id, 'kind', %s, 'origin', %s)::text)
+        FROM unnest(%s::int[]) AS id
+        """,
+        (RMA_EVENTS_CHANNEL, kind, origin, ids),
+    )
+
+
+def wants_fragment():
+    """True when the detail page posted via fetch/HTMX and will swap fragments in place."""
+    return (
+        request.headers.get("HX-Request") == "true"
+        or request.headers.get("X-Requested-With") in ("fetch", "XMLHttpRequest")
+    )
+
+
+def fragment_response(templates, message=None, category="success", status=200, **context):
+    """
+    Render partial templates back to back for a fetch/HTMX caller. Every
+    fragment's root element carries an id, which the page uses to swap it.
+    The message goes out in an HX-Trigger header rather than flash(), so it
+    doesn't show up again on the next full page load.
+    """
+    html = "".join(render_template(name, **context) for name in templates)
+    resp = make_response(html, status)
+    resp.headers["Cache-Control"] = "no-store"
+    if message:
+        resp.headers["HX-Trigger"] = json.dumps({
+            "rmaFlash": {
+                "message": message,
+                "category": category,
+                "undo": bool(session.get("last_undo")),
+            }
+        })
+    return resp
+
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -296,9 +1664,14 @@ def get_current_user():
 
 def send_rma_notification(owner_email, owner_name, rma_id, rma_code, customer_name, return_type, complaint, created_by):
     if not EMAIL_CONFIG['enabled']:
+        EMAILS.labels("disabled").inc()
         print(f"[EMAIL DISABLED] Would send to {owner_email}: New RMA {rma_code}")
         return False
     
+    import smtplib
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+
     try:
         msg = MIMEMultipart('alternative')
         msg['Subject'] = f"New RMA Assigned: {rma_code} - {customer_name}"
@@ -334,15 +1707,23 @@ def send_rma_notification(owner_email, owner_name, rma_id, rma_code, customer_na
         part = MIMEText(html_content, 'html')
         msg.attach(part)
         
-        with smtplib.SMTP(EMAIL_CONFIG['smtp_server'], EMAIL_CONFIG['smtp_port']) as server:
-            server.starttls()
-            server.login(EMAIL_CONFIG['sender_email'], EMAIL_CONFIG['sender_password'])
-            server.send_message(msg)
+        EMAIL_SENDS_IN_PROGRESS.inc()
+        start = time.perf_counter()
+        try:
+            with smtplib.SMTP(EMAIL_CONFIG['smtp_server'], EMAIL_CONFIG['smtp_port']) as server:
+                server.starttls()
+                server.login(EMAIL_CONFIG['sender_email'], EMAIL_CONFIG['sender_password'])
+                server.send_message(msg)
+        finally:
+            EMAIL_SENDS_IN_PROGRESS.dec()
+            EMAIL_SEND_SECONDS.observe(time.perf_counter() - start)
         
+        EMAILS.labels("sent").inc()
         print(f"✅ email sent to {owner_email}: {rma_code}")
         return True
         
     except Exception as e:
+        EMAILS.labels("failed").inc()
         print(f"❌ email error: {e}")
         return False
 
@@ -531,6 +1912,9 @@ def profile():
                 WHERE user_id = %s
             """, (full_name, email, user['user_id']))
             flash("Profile updated successfully.", "success")
+
+        if full_name != user['full_name']:
+            bump_user_rmas(cur, user['user_id'])    # RMA pages show the name, not the email
         
         conn.commit()
         conn.close()
@@ -611,6 +1995,10 @@ def index():
     }
     
     conn.close()
+
+    # Live-update refresh from the dashboard script: just the stats + list
+    if wants_fragment():
+        return fragment_response(["_dashboard_live.html"], my_rmas=my_rmas, stats=stats)
     
     return render_template(
         "dashboard.html",
@@ -690,41 +2078,41 @@ def new_rma():
 
         # 🔹 Assign owners (if any selected)
         if owner_ids:
-            for owner_id in owner_ids:
-                cur.execute(
-                    """
-                    INSERT INTO rma_owners (rma_id, user_id, is_primary, assigned_on, assigned_by)
-                    VALUES (%s, %s, 0, %s, %s)
-                    """,
-                    (rma_id, owner_id, now, created_by_user_id),
-                )
+            execute_values(
+                cur,
+                """
+                INSERT INTO rma_owners (rma_id, user_id, is_primary, assigned_on, assigned_by)
+                VALUES %s
+                """,
+                [(rma_id, owner_id, 0, now, created_by_user_id) for owner_id in owner_ids],
+            )
 
             # 🔹 Send email notifications to each owner
-            for owner_id in owner_ids:
-                cur.execute(
-                    "SELECT full_name, email FROM users WHERE user_id = %s",
-                    (owner_id,),
+            cur.execute(
+                "SELECT full_name, email FROM users WHERE user_id = ANY(%s::int[])",
+                (owner_ids,),
+            )
+            owners = cur.fetchall()
+
+            cur.execute(
+                "SELECT customer_name FROM customers WHERE customer_id = %s",
+                (customer_id,),
+            )
+            customer = cur.fetchone()
+
+            for owner in owners:
+                send_rma_notification(
+                    owner_email=owner["email"],
+                    owner_name=owner["full_name"],
+                    rma_id=rma_id,
+                    rma_code=f"RMA{rma_id:04d}",
+                    customer_name=customer["customer_name"] if customer else "Unknown",
+                    return_type=return_type,
+                    complaint=complaint,
+                    created_by=session.get("full_name", "System"),
                 )
-                owner = cur.fetchone()
-
-                if owner:
-                    cur.execute(
-                        "SELECT customer_name FROM customers WHERE customer_id = %s",
-                        (customer_id,),
-                    )
-                    customer = cur.fetchone()
-
-                    send_rma_notification(
-                        owner_email=owner["email"],
-                        owner_name=owner["full_name"],
-                        rma_id=rma_id,
-                        rma_code=f"RMA{rma_id:04d}",
-                        customer_name=customer["customer_name"] if customer else "Unknown",
-                        return_type=return_type,
-                        complaint=complaint,
-                        created_by=session.get("full_name", "System"),
-                    )
 
+        notify_rma_event(cur, rma_id, "created")
         conn.commit()
         conn.close()
 
@@ -748,53 +2136,28 @@ def new_rma():
 
 
 
-@app.route("/rmas")
-@login_required
-def list_rmas():
-    conn = get_db()
-    cur = conn.cursor()
-
-    # Get filter parameters
-    search_query = request.args.get("search", "").strip()
-    status_filter = request.args.get("status", "")
-    return_type_filter = request.args.get("return_type", "")
-    customer_filter = request.args.get("customer_id", "")
-    owner_filter = request.args.get("owner_id", "")
-    from_date = request.args.get("from_date", "")
-    to_date = request.args.get("to_date", "")
-    credit_approved_filter = request.args.get("credit_approved", "")
-    disposition_status_filter = request.args.get("disposition_status", "")
-
-# Build query
-    query = """
-        SELECT 
-            r.rma_id,
-            r.status,
-            r.date_opened,
-            r.date_closed,
-            r.customer_complaint_desc AS complaint,
-            r.return_type,
-            r.credit_approved,
-            r.credit_rejected,
-            r.credit_memo_number,
-            c.customer_name,
-            COALESCE(string_agg(DISTINCT u.full_name, ', '), '') AS owners,
-            (
-                SELECT MAX(d.date_dispositioned)
-                FROM rma_lines rl
-                JOIN dispositions d ON rl.rma_line_id = d.rma_line_id
-                WHERE rl.rma_id = r.rma_id
-            ) AS last_dispo_date
-        FROM rmas r
-        LEFT JOIN customers c ON r.customer_id = c.customer_id
-        LEFT JOIN rma_owners ro ON r.rma_id = ro.rma_id
-        LEFT JOIN users u ON ro.user_id = u.user_id
-        WHERE 1=1
-    """
-    params = []
+def rma_filters(args):
+    """
+    Turn the /rmas filter query args into a SQL fragment.
+    The query must alias rmas as r and customers as c. Shared by
+    list_rmas and the JSON API so both filter the same way.
+    Returns (sql, params, current_filters).
+    """
+    search_query = args.get("search", "").strip()
+    status_filter = args.get("status", "")
+    return_type_filter = args.get("return_type", "")
+    customer_filter = args.get("customer_id", "")
+    owner_filter = args.get("owner_id", "")
+    from_date = args.get("from_date", "")
+    to_date = args.get("to_date", "")
+    credit_approved_filter = args.get("credit_approved", "")
+    disposition_status_filter = args.get("disposition_status", "")
+
+    sql = ""
+    params = []
 
     if search_query:
-        query += """
+        sql += """
             AND (
                 CAST(r.rma_id AS TEXT) ILIKE %s
                 OR c.customer_name ILIKE %s
@@ -805,47 +2168,103 @@ def list_rmas():
         params.extend([search_pattern, search_pattern, search_pattern])
 
     if status_filter:
-        query += " AND r.status = %s"
+        sql += " AND r.status = %s"
         params.append(status_filter)
 
     if return_type_filter:
-        query += " AND r.return_type = %s"
+        sql += " AND r.return_type = %s"
         params.append(return_type_filter)
 
     if customer_filter:
-        query += " AND r.customer_id = %s"
+        sql += " AND r.customer_id = %s"
         params.append(customer_filter)
 
     if owner_filter:
-        query += " AND ro.user_id = %s"
+        # EXISTS rather than a join filter so callers needn't join rma_owners
+        sql += """
+            AND EXISTS (
+                SELECT 1 FROM rma_owners fo
+                WHERE fo.rma_id = r.rma_id AND fo.user_id = %s
+            )
+        """
         params.append(owner_filter)
 
     if from_date:
-        query += " AND DATE(r.date_opened) >= %s"
+        sql += " AND DATE(r.date_opened) >= %s"
         params.append(from_date)
 
     if to_date:
-        query += " AND DATE(r.date_opened) <= %s"
+        sql += " AND DATE(r.date_opened) <= %s"
         params.append(to_date)
 
     if credit_approved_filter == "pending":
-        query += """
+        sql += """
             AND r.return_type = 'Credit'
             AND (r.credit_approved IS NULL OR r.credit_approved = 0)
             AND (r.credit_rejected IS NULL OR r.credit_rejected = 0)
         """
     elif credit_approved_filter == "approved":
-        query += " AND r.credit_approved = 1"
+        sql += " AND r.credit_approved = 1"
     elif credit_approved_filter == "rejected":
-        query += " AND r.credit_rejected = 1"
+        sql += " AND r.credit_rejected = 1"
 
     # NOTE: dispositionstatus column does not exist in the new schema,
     # so we temporarily ignore disposition_status_filter in the SQL.
     # We still pass it through current_filters so the UI keeps the value.
     # if disposition_status_filter:
-    #     query += " AND r.dispositionstatus = %s"
+    #     sql += " AND r.dispositionstatus = %s"
     #     params.append(disposition_status_filter)
 
+    current_filters = {
+        'search': search_query,
+        'status': status_filter,
+        'return_type': return_type_filter,
+        'customer_id': customer_filter,
+        'owner_id': owner_filter,
+        'from_date': from_date,
+        'to_date': to_date,
+        'credit_approved': credit_approved_filter,
+        'disposition_status': disposition_status_filter
+    }
+    return sql, params, current_filters
+
+
+@app.route("/rmas")
+@replica_reads
+@login_required
+def list_rmas():
+    conn = get_db()
+    cur = conn.cursor()
+
+# Build query
+    query = """
+        SELECT 
+            r.rma_id,
+            r.status,
+            r.date_opened,
+            r.date_closed,
+            r.customer_complaint_desc AS complaint,
+            r.return_type,
+            r.credit_approved,
+            r.credit_rejected,
+            r.credit_memo_number,
+            c.customer_name,
+            COALESCE(string_agg(DISTINCT u.full_name, ', '), '') AS owners,
+            (
+                SELECT MAX(d.date_dispositioned)
+                FROM rma_lines rl
+                JOIN dispositions d ON rl.rma_line_id = d.rma_line_id
+                WHERE rl.rma_id = r.rma_id
+            ) AS last_dispo_date
+        FROM rmas r
+        LEFT JOIN customers c ON r.customer_id = c.customer_id
+        LEFT JOIN rma_owners ro ON r.rma_id = ro.rma_id
+        LEFT JOIN users u ON ro.user_id = u.user_id
+        WHERE 1=1
+    """
+    filter_sql, params, current_filters = rma_filters(request.args)
+    query += filter_sql
+
     query += """
         GROUP BY
             r.rma_id,
@@ -861,9 +2280,19 @@ def list_rmas():
         ORDER BY r.date_opened DESC
     """
 
-    # 🔹 Run query and fetch rows
-    cur.execute(query, params)
-    rmas = cur.fetchall()
+    # 🔹 Run query and fetch rows; past the route's statement_timeout,
+    # show the "narrow your filter" state instead of a partial list
+    results_too_large = False
+    try:
+        cur.execute(query, params)
+        rmas = cur.fetchall()
+    except QueryCanceled:
+        note_statement_timeout()
+        conn.rollback()
+        # the rollback ended the SET LOCAL too; the filter option queries keep a budget
+        set_statement_timeout(conn, STATEMENT_TIMEOUTS["list_rmas"])
+        rmas = []
+        results_too_large = True
 
     # Get filter options
     cur.execute("SELECT * FROM customers ORDER BY customer_name")
@@ -880,26 +2309,13 @@ def list_rmas():
         customers=customers,
         owners=owners,
         status_options=STATUS_OPTIONS,
-        current_filters={
-            'search': search_query,
-            'status': status_filter,
-            'return_type': return_type_filter,
-            'customer_id': customer_filter,
-            'owner_id': owner_filter,
-            'from_date': from_date,
-            'to_date': to_date,
-            'credit_approved': credit_approved_filter,
-            'disposition_status': disposition_status_filter
-        }
+        current_filters=current_filters,
+        results_too_large=results_too_large,
     )
 
 
-@app.route("/rmas/<int:rma_id>")
-@login_required
-def view_rma(rma_id):
-    conn = get_db()
-    cur = conn.cursor()
-
+def fetch_rma(cur, rma_id):
+    """The RMA row with customer and creator names, as the detail page shows it."""
     cur.execute(
         """
         SELECT 
@@ -915,17 +2331,14 @@ def view_rma(rma_id):
         """,
         (rma_id,),
     )
-
-    rma = cur.fetchone()
- 
+    return cur.fetchone()
 
 
-    if not rma:
-        conn.close()
-        flash("RMA not found.", "error")
-        return redirect(url_for("list_rmas"))
+def fetch_rma_lines(cur, rma_id, line_id=None):
+    """Line items for an RMA joined with their disposition (if any).
 
-# Get line items + dispositions
+    Pass line_id to fetch a single line (used for partial updates).
+    """
     cur.execute("""
         SELECT 
             rl.rma_line_id      AS rma_line_id,
@@ -956,10 +2369,13 @@ def view_rma(rma_id):
         LEFT JOIN users u
             ON d.disposition_by = u.user_id
         WHERE rl.rma_id = %s
+          AND (%s IS NULL OR rl.rma_line_id = %s)
         ORDER BY rl.rma_line_id
-    """, (rma_id,))
-    lines = cur.fetchall()
+    """, (rma_id, line_id, line_id))
+    return cur.fetchall()
 
+
+def fetch_assigned_owners(cur, rma_id):
     cur.execute("""
         SELECT 
             ro.is_primary,
@@ -970,21 +2386,10 @@ def view_rma(rma_id):
         WHERE ro.rma_id = %s
         ORDER BY ro.is_primary DESC, u.full_name
     """, (rma_id,))
-    assigned_owners = cur.fetchall()
-
-    # Get all users for owner dropdown
-    cur.execute("""
-        SELECT 
-            user_id   AS "UserID",
-            full_name AS "FullName"
-        FROM users
-        ORDER BY full_name
-    """)
-
-    all_owners = cur.fetchall()
+    return cur.fetchall()
 
 
-    # Get status history
+def fetch_status_history(cur, rma_id):
     cur.execute("""
         SELECT 
             sh.status_hist_id,
@@ -999,17 +2404,10 @@ def view_rma(rma_id):
         WHERE sh.rma_id = %s
         ORDER BY sh.changed_on DESC
     """, (rma_id,))
-    statuses = cur.fetchall()
+    return cur.fetchall()
 
-    # Get notes history
-    cur.execute("""
-        SELECT * FROM notes_history
-        WHERE rma_id = %s
-        ORDER BY modified_on DESC
-    """, (rma_id,))
-    notes_history = cur.fetchall()
 
-    # Get attachments
+def fetch_attachments(cur, rma_id):
     cur.execute("""
         SELECT 
             a.*,
@@ -1019,16 +2417,95 @@ def view_rma(rma_id):
         WHERE a.rma_id = %s
         ORDER BY a.date_added DESC
     """, (rma_id,))
-    attachments = cur.fetchall()
+    return cur.fetchall()
+
+
+def count_notes_history(cur, rma_id):
+    cur.execute("SELECT COUNT(*) AS n FROM notes_history WHERE rma_id = %s", (rma_id,))
+    return cur.fetchone()["n"]
+
+
+def rma_page_etag(rma_id, row_version, users):
+    """
+    Weak ETag for the RMA detail page: RMA version + viewer + query args,
+    plus the current hour (time_active text) and the template stamp.
+    `users` is the owner picker's list; it also carries every role, so an
+    added/renamed user or the viewer's role change (admin nav) shows up too.
+    """
+    raw = "|".join(str(p) for p in (
+        rma_id,
+        row_version,
+        session.get("user_id"),
+        session.get("full_name"),
+        [(u["user_id"], u["full_name"], u["role"]) for u in users],
+        datetime.now().strftime("%Y%m%d%H"),
+        TEMPLATE_STAMP,
+        request.query_string.decode("latin-1"),
+    ))
+    return hashlib.md5(raw.encode("utf-8")).hexdigest()
+
+
+@app.route("/rmas/<int:rma_id>")
+@login_required
+def view_rma(rma_id):
+    conn = get_db()
+    cur = conn.cursor()
+
+    # Pending flash messages are part of the page, so never cache those renders
+    has_flashes = bool(session.get("_flashes"))
+
+    # Edit mode lists every customer, which no version covers; never cache it
+    edit_mode = request.args.get('edit') == '1'
+
+    # Two cheap lookups decide whether the browser's copy is still current
+    cur.execute("SELECT row_version FROM rmas WHERE rma_id = %s", (rma_id,))
+    version_row = cur.fetchone()
+    # All users for the owner picker (also used for the render below)
+    cur.execute("SELECT user_id, full_name, role FROM users ORDER BY full_name")
+    all_owners = cur.fetchall()
+    etag = None
+    if version_row and not has_flashes and not edit_mode:
+        etag = rma_page_etag(rma_id, version_row["row_version"], all_owners)
+        if request.if_none_match.contains_weak(etag):
+            conn.close()
+            resp = app.response_class(status=304)
+            resp.set_etag(etag, weak=True)
+            resp.headers["Cache-Control"] = "private, no-cache"
+            return resp
+
+    rma = fetch_rma(cur, rma_id)
+ 
+
+
+    if not rma:
+        conn.close()
+        flash("RMA not found.", "error")
+        return redirect(url_for("list_rmas"))
+
+# Get line items + dispositions
+    lines = fetch_rma_lines(cur, rma_id)
+
+    assigned_owners = fetch_assigned_owners(cur, rma_id)
+
+
+    # Get status history
+    statuses = fetch_status_history(cur, rma_id)
+
+    # Get notes history
+    cur.execute("""
+        SELECT * FROM notes_history
+        WHERE rma_id = %s
+        ORDER BY modified_on DESC
+    """, (rma_id,))
+    notes_history = cur.fetchall()
+
+    # Get attachments
+    attachments = fetch_attachments(cur, rma_id)
 
     # Get all customers for reassignment dropdown
     cur.execute("SELECT * FROM customers ORDER BY customer_name")
     customers = cur.fetchall()
 
-    # Get all users for owner assignment
-    cur.execute("SELECT user_id, full_name FROM users ORDER BY full_name")
-    all_owners = cur.fetchall()
-
     # Get credit history
     cur.execute("""
         SELECT 
@@ -1043,13 +2520,12 @@ def view_rma(rma_id):
 
     conn.close()
 
-    # Check for edit mode and other query parameters
-    edit_mode = request.args.get('edit') == '1'
+    # Check for other query parameters
     edit_line = request.args.get('edit_line')
     show_notes_history = request.args.get('notes_history') == '1'
     edit_dispositions = request.args.get('edit_dispositions') == '1'
 
-    return render_template(
+    resp = make_response(render_template(
         "rma_detail.html",
         rma=rma,
         lines=lines,                  # 👈 matches template {% if lines %}
@@ -1065,7 +2541,14 @@ def view_rma(rma_id):
         edit_line=edit_line,
         show_notes_history=show_notes_history,
         edit_dispositions=edit_dispositions,
-    )
+    ))
+
+    if etag:
+        resp.set_etag(etag, weak=True)
+        resp.headers["Cache-Control"] = "private, no-cache"
+    else:
+        resp.headers["Cache-Control"] = "no-store"
+    return resp
 
 @app.route("/rmas/<int:rma_id>/owners/<int:owner_id>/remove", methods=["POST"])
 @login_required
@@ -1079,6 +2562,7 @@ def remove_rma_owner(rma_id, owner_id):
         WHERE rma_id = %s AND user_id = %s
     """, (rma_id, owner_id))
     
+    bump_rma_version(cur, rma_id, "owners")
     conn.commit()
     conn.close()
     
@@ -1116,85 +2600,316 @@ def add_disposition(rma_id, line_id):
     user_id = session.get("user_id")
     now = datetime.now()
 
-    # Check if a disposition already exists for this line
-    cur.execute(
-        "SELECT disposition_id FROM dispositions WHERE rma_line_id = %s",
-        (line_id,),
+    # One round trip: insert, or update the line's existing disposition
+    execute_values(
+        cur,
+        DISPOSITION_UPSERT_SQL,
+        [(
+            line_id,
+            disposition,
+            failure_code,
+            failure_desc,
+            root_cause,
+            corrective_action,
+            qty_scrap,
+            qty_rework,
+            qty_replace,
+            now,
+            user_id,
+        )],
     )
-    existing = cur.fetchone()
 
-    if existing:
-        # UPDATE existing disposition
-        cur.execute(
+    bump_rma_version(cur, rma_id, "dispositions")
+    conn.commit()
+
+    if wants_fragment():
+        lines = fetch_rma_lines(cur, rma_id, line_id)
+        conn.close()
+        if not lines:
+            return fragment_response([], "Line item not found.", "error", status=404)
+        return fragment_response(
+            ["_rma_line_row.html", "_rma_disposition_block.html"],
+            "Disposition saved.",
+            rma={"rma_id": rma_id},
+            line=lines[0],
+        )
+
+    conn.close()
+
+    flash("Disposition saved.", "success")
+    return redirect(url_for("view_rma", rma_id=rma_id))
+
+# ============ LINE / DISPOSITION GRID EDITOR ============
+
+# Relies on the uq_dispositions_line constraint (see migrate_disposition_unique.py).
+# Unchanged dispositions are left alone so date_dispositioned isn't bumped.
+DISPOSITION_UPSERT_SQL = """
+    INSERT INTO dispositions (
+        rma_line_id,
+        disposition,
+        failure_code,
+        failure_description,
+        root_cause,
+        corrective_action,
+        qty_scrap,
+        qty_rework,
+        qty_replace,
+        date_dispositioned,
+        disposition_by
+    )
+    VALUES %s
+    ON CONFLICT (rma_line_id) DO UPDATE
+    SET
+        disposition         = EXCLUDED.disposition,
+        failure_code        = EXCLUDED.failure_code,
+        failure_description = EXCLUDED.failure_description,
+        root_cause          = EXCLUDED.root_cause,
+        corrective_action   = EXCLUDED.corrective_action,
+        qty_scrap           = EXCLUDED.qty_scrap,
+        qty_rework          = EXCLUDED.qty_rework,
+        qty_replace         = EXCLUDED.qty_replace,
+        date_dispositioned  = EXCLUDED.date_dispositioned,
+        disposition_by      = EXCLUDED.disposition_by
+    WHERE (
+        dispositions.disposition,
+        dispositions.failure_code,
+        dispositions.failure_description,
+        dispositions.root_cause,
+        dispositions.corrective_action,
+        dispositions.qty_scrap,
+        dispositions.qty_rework,
+        dispositions.qty_replace
+    ) IS DISTINCT FROM (
+        EXCLUDED.disposition,
+        EXCLUDED.failure_code,
+        EXCLUDED.failure_description,
+        EXCLUDED.root_cause,
+        EXCLUDED.corrective_action,
+        EXCLUDED.qty_scrap,
+        EXCLUDED.qty_rework,
+        EXCLUDED.qty_replace
+    )
+"""
+
+GRID_LINE_FIELDS = ["part_number", "tool_number", "item_description", "qty_affected", "po_lot_number", "total_cost"]
+GRID_DISPOSITION_FIELDS = [
+    "disposition",
+    "failure_code",
+    "failure_description",
+    "root_cause",
+    "corrective_action",
+    "qty_scrap",
+    "qty_rework",
+    "qty_replace",
+]
+
+# Empty rows offered for new lines on the grid page
+GRID_BLANK_ROWS = 10
+
+
+def read_grid_rows():
+    """
+    Collect grid rows from either a JSON body ({"lines": [...]}) or the
+    grid form, whose inputs are parallel lists (one entry per row).
+    Returns a list of dicts with rma_line_id plus every line/disposition
+    field, or None when a JSON body isn't shaped like that.
+    """
+    fields = ["rma_line_id"] + GRID_LINE_FIELDS + GRID_DISPOSITION_FIELDS
+
+    if request.is_json:
+        payload = request.get_json(silent=True)
+        lines = payload.get("lines") if isinstance(payload, dict) else None
+        if not isinstance(lines, list) or not all(isinstance(row, dict) for row in lines):
+            return None
+        return [{f: row.get(f) for f in fields} for row in lines]
+
+    columns = {f: request.form.getlist(f) for f in fields}
+    row_count = max((len(v) for v in columns.values()), default=0)
+    return [
+        {f: (columns[f][i] if i < len(columns[f]) else None) for f in fields}
+        for i in range(row_count)
+    ]
+
+
+def clean_text(value):
+    """Strip a text cell; blank -> None."""
+    if value is None:
+        return None
+    return str(value).strip() or None
+
+
+@app.route("/rmas/<int:rma_id>/lines/grid", methods=["GET", "POST"])
+@login_required
+def edit_lines_grid(rma_id):
+    """
+    Edit many line items and their dispositions in one request.
+    Line updates/inserts and the disposition upsert are each a single
+    execute_values() call inside one transaction.
+    """
+    conn = get_db()
+    cur = conn.cursor()
+
+    cur.execute("SELECT rma_id FROM rmas WHERE rma_id = %s", (rma_id,))
+    if not cur.fetchone():
+        conn.close()
+        flash("RMA not found.", "error")
+        return redirect(url_for("list_rmas"))
+
+    if request.method == "GET":
+        lines = fetch_rma_lines(cur, rma_id)
+        conn.close()
+        return render_template(
+            "rma_lines_grid.html",
+            rma_id=rma_id,
+            lines=lines,
+            blank_rows=GRID_BLANK_ROWS,
+            disposition_options=DISPOSITION_OPTIONS,
+        )
+
+    cur.execute("SELECT rma_line_id FROM rma_lines WHERE rma_id = %s", (rma_id,))
+    own_line_ids = {r["rma_line_id"] for r in cur.fetchall()}
+
+    updates, inserts, insert_dispos, dispos = [], [], [], []
+    errors = []
+    seen_line_ids = set()    # the upsert can't touch one row twice in a statement
+
+    rows = read_grid_rows()
+    if rows is None:
+        conn.close()
+        return {"ok": False, "errors": ['Expected a JSON object like {"lines": [{...}, ...]}.']}, 400
+
+    for n, row in enumerate(rows, start=1):
+        try:
+            line_id = parse_int(row["rma_line_id"])
+            line = (
+                clean_text(row["part_number"]),
+                clean_text(row["tool_number"]),
+                clean_text(row["item_description"]),
+                parse_int(row["qty_affected"]),
+                clean_text(row["po_lot_number"]),
+                parse_decimal(row["total_cost"]),
+            )
+            dispo = (
+                clean_text(row["disposition"]),
+                clean_text(row["failure_code"]),
+                clean_text(row["failure_description"]),
+                clean_text(row["root_cause"]),
+                clean_text(row["corrective_action"]),
+                parse_int(row["qty_scrap"]),
+                parse_int(row["qty_rework"]),
+                parse_int(row["qty_replace"]),
+            )
+        except ValueError:
+            errors.append(f"Row {n}: quantities must be whole numbers and cost a number.")
+            continue
+
+        has_line = any(v is not None for v in line)
+        has_dispo = any(v is not None for v in dispo)
+
+        if line_id is None:
+            if not has_line:
+                continue  # untouched blank row
+            inserts.append((rma_id,) + line)
+            insert_dispos.append(dispo if has_dispo else None)
+        elif line_id in seen_line_ids:
+            errors.append(f"Row {n}: line {line_id} appears more than once.")
+        elif line_id in own_line_ids:
+            seen_line_ids.add(line_id)
+            updates.append((line_id, rma_id) + line)
+            if has_dispo:
+                dispos.append((line_id,) + dispo)
+        else:
+            errors.append(f"Row {n}: line {line_id} does not belong to this RMA.")
+
+    if errors:
+        conn.close()
+        if request.is_json:
+            return {"ok": False, "errors": errors}, 400
+        for e in errors:
+            flash(e, "error")
+        return redirect(url_for("edit_lines_grid", rma_id=rma_id))
+
+    now = datetime.now()
+    user_id = session.get("user_id")
+
+    if updates:
+        execute_values(
+            cur,
             """
-            UPDATE dispositions
-            SET
-                disposition         = %s,
-                failure_code        = %s,
-                failure_description = %s,
-                root_cause          = %s,
-                corrective_action   = %s,
-                qty_scrap           = %s,
-                qty_rework          = %s,
-                qty_replace         = %s,
-                date_dispositioned  = %s,
-                disposition_by      = %s
-            WHERE rma_line_id = %s
+            UPDATE rma_lines rl
+            SET part_number      = v.part_number,
+                tool_number      = v.tool_number,
+                item_description = v.item_description,
+                qty_affected     = v.qty_affected,
+                po_lot_number    = v.po_lot_number,
+                total_cost       = v.total_cost
+            FROM (VALUES %s) AS v(
+                rma_line_id, rma_id, part_number, tool_number,
+                item_description, qty_affected, po_lot_number, total_cost
+            )
+            WHERE rl.rma_line_id = v.rma_line_id
+              AND rl.rma_id = v.rma_id
             """,
-            (
-                disposition,
-                failure_code,
-                failure_desc,
-                root_cause,
-                corrective_action,
-                qty_scrap,
-                qty_rework,
-                qty_replace,
-                now,
-                user_id,
-                line_id,
-            ),
+            updates,
+            template="(%s::integer, %s::integer, %s, %s, %s, %s::integer, %s, %s::numeric)",
         )
-    else:
-        # INSERT new disposition
-        cur.execute(
+
+    if inserts:
+        # RETURNING order isn't guaranteed, but rows are inserted in ORDER BY
+        # ord, so their serial ids ascend in grid order: sorted ids pair
+        # with the grid rows (and their dispositions) by position
+        new_ids = execute_values(
+            cur,
             """
-            INSERT INTO dispositions (
-                rma_line_id,
-                disposition,
-                failure_code,
-                failure_description,
-                root_cause,
-                corrective_action,
-                qty_scrap,
-                qty_rework,
-                qty_replace,
-                date_dispositioned,
-                disposition_by
+            INSERT INTO rma_lines (
+                rma_id,
+                part_number,
+                tool_number,
+                item_description,
+                qty_affected,
+                po_lot_number,
+                total_cost
             )
-            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+            SELECT v.rma_id, v.part_number, v.tool_number, v.item_description,
+                   v.qty_affected, v.po_lot_number, v.total_cost
+            FROM (VALUES %s) AS v(
+                ord, rma_id, part_number, tool_number,
+                item_description, qty_affected, po_lot_number, total_cost
+            )
+            ORDER BY v.ord
+            RETURNING rma_line_id
             """,
-            (
-                line_id,
-                disposition,
-                failure_code,
-                failure_desc,
-                root_cause,
-                corrective_action,
-                qty_scrap,
-                qty_rework,
-                qty_replace,
-                now,
-                user_id,
-            ),
+            [(ord,) + line for ord, line in enumerate(inserts)],
+            template="(%s, %s::integer, %s, %s, %s, %s::integer, %s, %s::numeric)",
+            page_size=len(inserts),
+            fetch=True,
+        )
+        line_ids = sorted(r["rma_line_id"] for r in new_ids)
+        for line_id, dispo in zip(line_ids, insert_dispos):
+            if dispo:
+                dispos.append((line_id,) + dispo)
+
+    if dispos:
+        execute_values(
+            cur,
+            DISPOSITION_UPSERT_SQL,
+            [d + (now, user_id) for d in dispos],
         )
 
+    bump_rma_version(cur, rma_id, "lines")
     conn.commit()
     conn.close()
 
-    flash("Disposition saved.", "success")
+    if request.is_json:
+        return {"ok": True, "updated": len(updates), "inserted": len(inserts), "dispositions": len(dispos)}
+
+    flash(
+        f"Saved {len(updates) + len(inserts)} line(s) and {len(dispos)} disposition(s).",
+        "success",
+    )
     return redirect(url_for("view_rma", rma_id=rma_id))
 
+
 # ============================================
 # CREDIT PAGE VIEW ROUTE
 # ============================================
@@ -1263,9 +2978,12 @@ def approve_credit(rma_id):
             credit_rejected = 0,
             credit_rejected_on = NULL,
             credit_rejected_by = NULL,
-            credit_rejection_reason = NULL
+            credit_rejection_reason = NULL,
+            row_version = row_version + 1,
+            updated_at = NOW()
         WHERE rma_id = %s
     """, (datetime.now(), session['user_id'], credit_amount, credit_memo_number, rma_id))
+    notify_rma_event(cur, rma_id, "credit")
     
     conn.commit()
     cur.close()
@@ -1300,9 +3018,12 @@ def reject_credit(rma_id):
             credit_approved = 0,
             credit_approved_on = NULL,
             credit_approved_by = NULL,
-            credit_amount = NULL
+            credit_amount = NULL,
+            row_version = row_version + 1,
+            updated_at = NOW()
         WHERE rma_id = %s
     """, (datetime.now(), session['user_id'], rejection_reason, rma_id))
+    notify_rma_event(cur, rma_id, "credit")
     
     conn.commit()
     cur.close()
@@ -1341,9 +3062,12 @@ def mark_credit_issued(rma_id):
     cur.execute("""
         UPDATE rmas
         SET credit_issued_on = %s,
-            credit_memo_number = %s
+            credit_memo_number = %s,
+            row_version = row_version + 1,
+            updated_at = NOW()
         WHERE rma_id = %s
     """, (datetime.now(), credit_memo_number, rma_id))
+    notify_rma_event(cur, rma_id, "credit")
     
     conn.commit()
     cur.close()
@@ -1368,9 +3092,12 @@ def reopen_credit(rma_id):
         SET credit_rejected = 0,
             credit_rejected_on = NULL,
             credit_rejected_by = NULL,
-            credit_rejection_reason = NULL
+            credit_rejection_reason = NULL,
+            row_version = row_version + 1,
+            updated_at = NOW()
         WHERE rma_id = %s
     """, (rma_id,))
+    notify_rma_event(cur, rma_id, "credit")
     
     conn.commit()
     cur.close()
@@ -1412,7 +3139,9 @@ def acknowledge_rma(rma_id):
             status = CASE 
                         WHEN status = 'Draft' THEN 'Acknowledged'
                         ELSE status
-                     END
+                     END,
+            row_version = row_version + 1,
+            updated_at = NOW()
         WHERE rma_id = %s
         """,
         (now, user["user_id"], rma_id),
@@ -1426,6 +3155,7 @@ def acknowledge_rma(rma_id):
         """,
         (rma_id, "Acknowledged", user["user_id"], now, "Marked as acknowledged"),
     )
+    notify_rma_event(cur, rma_id, "status")
 
     conn.commit()
     conn.close()
@@ -1448,6 +3178,9 @@ def edit_rma_inline(rma_id):
     credit_memo = request.form.get("credit_memo", "").strip()
     
     if not customer_id:
+        conn.close()
+        if wants_fragment():
+            return fragment_response([], "Customer is required.", "error", status=400)
         flash("Customer is required.", "error")
         return redirect(url_for("view_rma", rma_id=rma_id, edit='1'))
     
@@ -1466,7 +3199,9 @@ def edit_rma_inline(rma_id):
             internal_notes = %s,
             credit_memo_number = %s,
             notes_last_modified = %s,
-            notes_modified_by = %s
+            notes_modified_by = %s,
+            row_version = row_version + 1,
+            updated_at = NOW()
         WHERE rma_id = %s
         """,
         (
@@ -1490,8 +3225,26 @@ def edit_rma_inline(rma_id):
             """,
             (rma_id, internal_notes, session.get('username'), datetime.now())
         )
-    
+
+    notify_rma_event(cur, rma_id, "info")
     conn.commit()
+
+    if wants_fragment():
+        rma = fetch_rma(cur, rma_id)
+        assigned_owners = fetch_assigned_owners(cur, rma_id)
+        notes_count = count_notes_history(cur, rma_id)
+        cur.execute("SELECT user_id, full_name FROM users ORDER BY full_name")
+        owners = cur.fetchall()
+        conn.close()
+        return fragment_response(
+            ["_rma_header.html", "_rma_age_strip.html", "_rma_info_card.html"],
+            "RMA updated successfully.",
+            rma=rma,
+            assigned_owners=assigned_owners,
+            owners=owners,
+            notes_count=notes_count,
+        )
+
     conn.close()
     
     flash("RMA updated successfully.", "success")
@@ -1530,11 +3283,14 @@ def edit_rma(rma_id):
             """
             UPDATE rmas
             SET customer_id = %s, return_type = %s, Complaint = %s,
-                root_cause = %s, corrective_action = %s
+                root_cause = %s, corrective_action = %s,
+                row_version = row_version + 1,
+                updated_at = NOW()
             WHERE rma_id = %s
             """,
             (customer_id, return_type, complaint, root_cause, corrective_action, rma_id),
         )
+        notify_rma_event(cur, rma_id, "info")
 
         conn.commit()
         conn.close()
@@ -1632,6 +3388,7 @@ def delete_rma(rma_id):
     cur.execute("DELETE FROM attachments WHERE rma_id = %s", (rma_id,))
     cur.execute("DELETE FROM credit_history WHERE rma_id = %s", (rma_id,))
     cur.execute("DELETE FROM rmas WHERE rma_id = %s", (rma_id,))
+    notify_rma_event(cur, rma_id, "deleted")
 
     conn.commit()
     conn.close()
@@ -1678,7 +3435,20 @@ def add_line_item(rma_id):
         (rma_id, part_number, tool_number, item_description, qty_affected, po_lot_number, total_cost),
     )
 
+    bump_rma_version(cur, rma_id, "lines")
     conn.commit()
+
+    if wants_fragment():
+        # A new line shows up in both the table and the dispositions cards
+        lines = fetch_rma_lines(cur, rma_id)
+        conn.close()
+        return fragment_response(
+            ["_rma_lines_card.html", "_rma_dispositions.html"],
+            "Line item added.",
+            rma={"rma_id": rma_id},
+            lines=lines,
+        )
+
     conn.close()
 
     flash("Line item added.", "success")
@@ -1702,6 +3472,7 @@ def delete_line_item(rma_id, rma_line_id):
         (rma_line_id, rma_id),
     )
 
+    bump_rma_version(cur, rma_id, "lines")
     conn.commit()
     conn.close()
 
@@ -1727,19 +3498,17 @@ def update_owners(rma_id):
     cur = conn.cursor()
     
     # Add new owners (skip if already assigned)
-    for owner_id in owner_ids:
-        # Check if already assigned
-        cur.execute("""
-            SELECT 1 FROM rma_owners 
-            WHERE rma_id = %s AND user_id = %s
-        """, (rma_id, owner_id))
-        
-        if not cur.fetchone():
-            cur.execute("""
-                INSERT INTO rma_owners (rma_id, user_id, is_primary)
-                VALUES (%s, %s, 0)
-            """, (rma_id, owner_id))
+    cur.execute("""
+        INSERT INTO rma_owners (rma_id, user_id, is_primary)
+        SELECT DISTINCT %s, new.user_id, 0
+        FROM unnest(%s::int[]) AS new(user_id)
+        WHERE NOT EXISTS (
+            SELECT 1 FROM rma_owners ro
+            WHERE ro.rma_id = %s AND ro.user_id = new.user_id
+        )
+    """, (rma_id, owner_ids, rma_id))
     
+    bump_rma_version(cur, rma_id, "owners")
     conn.commit()
     conn.close()
     
@@ -1756,6 +3525,8 @@ def change_status(rma_id):
     comment = request.form.get("comment", "").strip()
 
     if not new_status or new_status not in STATUS_OPTIONS:
+        if wants_fragment():
+            return fragment_response([], "Invalid status.", "error", status=400)
         flash("Invalid status.", "error")
         return redirect(url_for("view_rma", rma_id=rma_id))
 
@@ -1769,6 +3540,8 @@ def change_status(rma_id):
     row = cur.fetchone()
     if not row:
         conn.close()
+        if wants_fragment():
+            return fragment_response([], "RMA not found.", "error", status=404)
         flash("RMA not found.", "error")
         return redirect(url_for("list_rmas"))
 
@@ -1787,12 +3560,12 @@ def change_status(rma_id):
     # Update RMA status
     if new_status in ['Closed', 'Rejected']:
         cur.execute(
-            "UPDATE rmas SET status = %s, date_closed = %s WHERE rma_id = %s",
+            "UPDATE rmas SET status = %s, date_closed = %s, row_version = row_version + 1, updated_at = NOW() WHERE rma_id = %s",
             (new_status, now, rma_id),
         )
     else:
         cur.execute(
-            "UPDATE rmas SET status = %s, date_closed = NULL WHERE rma_id = %s",
+            "UPDATE rmas SET status = %s, date_closed = NULL, row_version = row_version + 1, updated_at = NOW() WHERE rma_id = %s",
             (new_status, rma_id),
         )
 
@@ -1804,22 +3577,210 @@ def change_status(rma_id):
         """,
         (rma_id, new_status, session["user_id"], now, comment),
     )
+    notify_rma_event(cur, rma_id, "status")
 
     conn.commit()
+
+    if wants_fragment():
+        rma = fetch_rma(cur, rma_id)
+        statuses = fetch_status_history(cur, rma_id)
+        conn.close()
+        return fragment_response(
+            ["_rma_header.html", "_rma_status_card.html", "_rma_age_strip.html", "_rma_status_history.html"],
+            f"status changed to '{new_status}'.",
+            rma=rma,
+            statuses=statuses,
+            status_options=STATUS_OPTIONS,
+        )
+
     conn.close()
 
     flash(f"status changed to '{new_status}'.", "success")
     return redirect(url_for("view_rma", rma_id=rma_id))
 
 
-# ============ NOTES / INTERNAL NOTES ============
+# ============ BULK ACTIONS (RMA LIST) ============
 
-@app.route("/rmas/<int:rma_id>/notes", methods=["POST"])
-@login_required
-def update_notes(rma_id):
-    """Update Internal Notes on an RMA and log to notes_history."""
-    new_notes = (request.form.get("internal_notes") or "").strip()
-    now = datetime.now()
+# Cap per batch
+BULK_ACTION_LIMIT = 500
+
+
+def save_batch_undo(cur, action, data):
+    """
+    Keep a bulk action's undo data in undo_actions and only a token in the
+    session: hundreds of ids would push the signed session cookie past the
+    browser's 4 KB limit, and the undo would be silently dropped. Each user
+    keeps just their latest entry. Call before the action's commit.
+    """
+    token = secrets.token_urlsafe(16)
+    cur.execute("DELETE FROM undo_actions WHERE user_id = %s", (session["user_id"],))
+    cur.execute(
+        "INSERT INTO undo_actions (token, user_id, action, data) VALUES (%s, %s, %s, %s)",
+        (token, session["user_id"], action, json.dumps(data)),
+    )
+    session["last_undo"] = {"action": action, "token": token}
+
+
+def parse_id_list(values):
+    """Turn a list of form values into unique ints, preserving order."""
+    ids = []
+    for v in values:
+        try:
+            i = int(v)
+        except (TypeError, ValueError):
+            continue
+        if i not in ids:
+            ids.append(i)
+    return ids
+
+
+@app.route("/rmas/bulk/status", methods=["POST"])
+@login_required
+def bulk_change_status():
+    """Change the status of many RMAs in one transaction."""
+    rma_ids = parse_id_list(request.form.getlist("rma_ids"))
+    new_status = request.form.get("status")
+    comment = request.form.get("comment", "").strip()
+    back = request.referrer or url_for("list_rmas")
+
+    if not rma_ids:
+        flash("Select at least one RMA.", "error")
+        return redirect(back)
+    if len(rma_ids) > BULK_ACTION_LIMIT:
+        flash(f"Select at most {BULK_ACTION_LIMIT} RMAs per bulk action.", "error")
+        return redirect(back)
+    if not new_status or new_status not in STATUS_OPTIONS:
+        flash("Invalid status.", "error")
+        return redirect(back)
+
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    conn = get_db()
+    cur = conn.cursor()
+
+    # Lock the rows and capture current values for undo
+    cur.execute(
+        """
+        SELECT rma_id, status, date_closed
+        FROM rmas
+        WHERE rma_id = ANY(%s)
+        ORDER BY rma_id
+        FOR UPDATE
+        """,
+        (rma_ids,),
+    )
+    rows = cur.fetchall()
+    if not rows:
+        conn.close()
+        flash("No matching RMAs found.", "error")
+        return redirect(back)
+
+    found_ids = [r["rma_id"] for r in rows]
+
+    cur.execute(
+        """
+        UPDATE rmas r
+        SET status = %s,
+            date_closed = CASE WHEN %s THEN %s::timestamp ELSE NULL END,
+            row_version = r.row_version + 1,
+            updated_at = NOW()
+        FROM unnest(%s::integer[]) AS t(rma_id)
+        WHERE r.rma_id = t.rma_id
+        """,
+        (new_status, new_status in ("Closed", "Rejected"), now, found_ids),
+    )
+
+    cur.execute(
+        """
+        INSERT INTO status_history (rma_id, status, changed_by, changed_on, comment)
+        SELECT t.rma_id, %s, %s, %s, %s
+        FROM unnest(%s::integer[]) AS t(rma_id)
+        """,
+        (new_status, session["user_id"], now, comment, found_ids),
+    )
+    notify_rma_event(cur, found_ids, "status")
+
+    # Undo data, grouped by previous (status, date_closed)
+    groups = {}
+    for r in rows:
+        closed = r["date_closed"].isoformat(sep=" ") if r["date_closed"] else None
+        groups.setdefault((r["status"], closed), []).append(r["rma_id"])
+    save_batch_undo(cur, "restore_status_batch", {
+        "groups": [[status, closed, ids] for (status, closed), ids in groups.items()],
+    })
+
+    conn.commit()
+    conn.close()
+
+    flash(f"status changed to '{new_status}' on {len(found_ids)} RMA(s).", "success")
+    return redirect(back)
+
+
+@app.route("/rmas/bulk/owners", methods=["POST"])
+@login_required
+def bulk_update_owners():
+    """Add the selected owners to many RMAs in one transaction."""
+    rma_ids = parse_id_list(request.form.getlist("rma_ids"))
+    owner_ids = parse_id_list(request.form.getlist("owner_ids"))
+    back = request.referrer or url_for("list_rmas")
+
+    if not rma_ids:
+        flash("Select at least one RMA.", "error")
+        return redirect(back)
+    if len(rma_ids) > BULK_ACTION_LIMIT:
+        flash(f"Select at most {BULK_ACTION_LIMIT} RMAs per bulk action.", "error")
+        return redirect(back)
+    if not owner_ids:
+        flash("Please select at least one owner.", "error")
+        return redirect(back)
+
+    now = datetime.now()
+
+    conn = get_db()
+    cur = conn.cursor()
+
+    # Add every (rma, owner) pair that isn't already assigned
+    cur.execute(
+        """
+        INSERT INTO rma_owners (rma_id, user_id, is_primary, assigned_on, assigned_by)
+        SELECT r.rma_id, u.user_id, 0, %s, %s
+        FROM rmas r
+        JOIN unnest(%s::integer[]) AS t(rma_id) ON t.rma_id = r.rma_id
+        CROSS JOIN users u
+        WHERE u.user_id = ANY(%s)
+          AND NOT EXISTS (
+              SELECT 1 FROM rma_owners ro
+              WHERE ro.rma_id = r.rma_id AND ro.user_id = u.user_id
+          )
+        """,
+        (now, session["user_id"], rma_ids, owner_ids),
+    )
+    added = cur.rowcount
+
+    bump_rma_version(cur, rma_ids, "owners")
+
+    # assigned_on + assigned_by identify exactly the rows this batch added
+    save_batch_undo(cur, "remove_owner_batch", {
+        "rma_ids": rma_ids,
+        "owner_ids": owner_ids,
+        "assigned_on": now.isoformat(sep=" "),
+    })
+
+    conn.commit()
+    conn.close()
+
+    flash(f"Added {added} owner assignment(s) across {len(rma_ids)} RMA(s).", "success")
+    return redirect(back)
+
+
+# ============ NOTES / INTERNAL NOTES ============
+
+@app.route("/rmas/<int:rma_id>/notes", methods=["POST"])
+@login_required
+def update_notes(rma_id):
+    """Update Internal Notes on an RMA and log to notes_history."""
+    new_notes = (request.form.get("internal_notes") or "").strip()
+    now = datetime.now()
 
     conn = get_db()
     cur = conn.cursor()
@@ -1856,13 +3817,28 @@ def update_notes(rma_id):
         UPDATE rmas
         SET internal_notes = %s,
             notes_last_modified = %s,
-            notes_modified_by = %s
+            notes_modified_by = %s,
+            row_version = row_version + 1,
+            updated_at = NOW()
         WHERE rma_id = %s
         """,
         (new_notes, now, session.get("full_name"), rma_id),
     )
+    notify_rma_event(cur, rma_id, "notes")
 
     conn.commit()
+
+    if wants_fragment():
+        rma = fetch_rma(cur, rma_id)
+        notes_count = count_notes_history(cur, rma_id)
+        conn.close()
+        return fragment_response(
+            ["_rma_notes_panel.html"],
+            "Notes updated.",
+            rma=rma,
+            notes_count=notes_count,
+        )
+
     conn.close()
 
     flash("Notes updated.", "success")
@@ -1872,42 +3848,69 @@ def update_notes(rma_id):
 
 # ============ ATTACHMENTS ============
 
+def attachment_result(rma_id, message, category="success"):
+    """
+    Finish an attachment route: the attachments card for fetch/HTMX callers
+    (just the message on errors), otherwise flash + redirect as before.
+    """
+    if not wants_fragment():
+        flash(message, category)
+        return redirect(url_for("view_rma", rma_id=rma_id))
+
+    if category == "error":
+        return fragment_response([], message, category, status=400)
+
+    conn = get_db()
+    cur = conn.cursor()
+    attachments = fetch_attachments(cur, rma_id)
+    conn.close()
+    return fragment_response(
+        ["_rma_attachments.html"],
+        message,
+        category,
+        rma={"rma_id": rma_id},
+        attachments=attachments,
+    )
+
+
 @app.route("/rmas/<int:rma_id>/attachments/add", methods=["POST"])
 @login_required
 def add_attachment(rma_id):
     if "file" not in request.files:
-        flash("No file part in request.", "error")
-        return redirect(url_for("view_rma", rma_id=rma_id))
+        return attachment_result(rma_id, "No file part in request.", "error")
 
     file = request.files["file"]
     if file.filename == "":
-        flash("No file selected.", "error")
-        return redirect(url_for("view_rma", rma_id=rma_id))
+        return attachment_result(rma_id, "No file selected.", "error")
 
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
         
         # Format RMA number as RMA-XXXX
         rma_folder_name = f"RMA-{rma_id:04d}"
+        upload_started = time.perf_counter()
         
         # Try to save to network location first
         try:
             network_dir = os.path.join(app.config["NETWORK_UPLOAD_PATH"], rma_folder_name)
-            os.makedirs(network_dir, exist_ok=True)
+            run_blocking(os.makedirs, network_dir, exist_ok=True)
             full_path = os.path.join(network_dir, filename)
-            file.save(full_path)
+            run_blocking(file.save, full_path)
             
             # Store the network path in database
             stored_path = full_path
-            flash("Attachment uploaded to network location.", "success")
+            message, category = "Attachment uploaded to network location.", "success"
         except Exception as e:
             # Fallback to local storage if network is unavailable
             upload_dir = os.path.join(app.config["UPLOAD_FOLDER"], rma_folder_name)
             os.makedirs(upload_dir, exist_ok=True)
             full_path = os.path.join(upload_dir, filename)
-            file.save(full_path)
+            run_blocking(file.save, full_path)
             stored_path = full_path
-            flash(f"Attachment uploaded to local storage (network unavailable: {str(e)})", "warning")
+            message, category = f"Attachment uploaded to local storage (network unavailable: {str(e)})", "warning"
+
+        UPLOAD_SECONDS.observe(time.perf_counter() - upload_started)
+        UPLOAD_BYTES.inc(os.path.getsize(stored_path))
 
         conn = get_db()
         cur = conn.cursor()
@@ -1918,13 +3921,13 @@ def add_attachment(rma_id):
             """,
             (rma_id, "File", stored_path, filename, session["user_id"], datetime.now()),
         )
+        bump_rma_version(cur, rma_id, "attachments")
         conn.commit()
         conn.close()
 
-        return redirect(url_for("view_rma", rma_id=rma_id))
+        return attachment_result(rma_id, message, category)
     else:
-        flash("File type not allowed.", "error")
-        return redirect(url_for("view_rma", rma_id=rma_id))
+        return attachment_result(rma_id, "File type not allowed.", "error")
 
 
 
@@ -1944,13 +3947,14 @@ def delete_attachment(rma_id, attachment_id):
             os.remove(filepath)
 
         cur.execute("DELETE FROM attachments WHERE attachment_id = %s", (attachment_id,))
+        bump_rma_version(cur, rma_id, "attachments")
         conn.commit()
-        flash("Attachment deleted.", "success")
+        message, category = "Attachment deleted.", "success"
     else:
-        flash("Attachment not found.", "error")
+        message, category = "Attachment not found.", "error"
 
     conn.close()
-    return redirect(url_for("view_rma", rma_id=rma_id))
+    return attachment_result(rma_id, message, category)
 
 
 @app.route("/rmas/<int:rma_id>/status_history/<int:history_id>/delete", methods=["POST"])
@@ -1969,6 +3973,7 @@ def delete_status_history(rma_id, history_id):
     
     if row:
         cur.execute("DELETE FROM status_history WHERE status_hist_id = %s", (history_id,))
+        bump_rma_version(cur, rma_id, "status")
         conn.commit()
         flash("Status history entry deleted.", "success")
     else:
@@ -2037,6 +4042,7 @@ def open_specific_attachment(rma_id, attachment_id):
 # ============ CUSTOMERS ============
 
 @app.route("/customers")
+@replica_reads
 @login_required
 def list_customers():
     conn = get_db()
@@ -2113,6 +4119,7 @@ def edit_customer(customer_id):
                 contact_email = %s
             WHERE customer_id = %s
         """, (name, contact_name, contact_email, customer_id))
+        bump_customer_rmas(cur, customer_id)    # their RMA pages show the name/contact
         conn.commit()
         conn.close()
 
@@ -2181,25 +4188,93 @@ def undo_last():
         return redirect(request.referrer or url_for("index"))
 
     action = undo_info["action"]
-    data = undo_info["data"]
 
     conn = get_db()
     cur = conn.cursor()
 
+    if "token" in undo_info:
+        # Bulk action: the data is in undo_actions (see save_batch_undo)
+        cur.execute(
+            "DELETE FROM undo_actions WHERE token = %s AND user_id = %s RETURNING data",
+            (undo_info["token"], session["user_id"]),
+        )
+        row = cur.fetchone()
+        if row is None:
+            conn.commit()
+            conn.close()
+            session.pop("last_undo", None)
+            flash("That action can no longer be undone.", "info")
+            return redirect(request.referrer or url_for("index"))
+        data = json.loads(row["data"])
+    else:
+        data = undo_info["data"]
+
     if action == "restore_status":
         cur.execute(
-            "UPDATE rmas SET status = %s WHERE rma_id = %s",
+            "UPDATE rmas SET status = %s, row_version = row_version + 1, updated_at = NOW() WHERE rma_id = %s",
             (data["Oldstatus"], data["rma_id"]),
         )
+        notify_rma_event(cur, data["rma_id"], "status")
         flash(f"status reverted to '{data['Oldstatus']}'.", "info")
 
+    elif action == "restore_status_batch":
+        rma_ids, statuses, closed = [], [], []
+        for status, date_closed, ids in data["groups"]:
+            rma_ids.extend(ids)
+            statuses.extend([status] * len(ids))
+            closed.extend([date_closed] * len(ids))
+        if DB_DIALECT == "sqlite":
+            cur.executemany(
+                """
+                UPDATE rmas
+                SET status = %s,
+                    date_closed = %s,
+                    row_version = row_version + 1,
+                    updated_at = NOW()
+                WHERE rma_id = %s
+                """,
+                list(zip(statuses, closed, rma_ids)),
+            )
+        else:
+            cur.execute(
+                """
+                UPDATE rmas r
+                SET status = u.status,
+                    date_closed = u.date_closed,
+                    row_version = r.row_version + 1,
+                    updated_at = NOW()
+                FROM unnest(%s::integer[], %s::text[], %s::timestamp[])
+                     AS u(rma_id, status, date_closed)
+                WHERE r.rma_id = u.rma_id
+                """,
+                (rma_ids, statuses, closed),
+            )
+        notify_rma_event(cur, rma_ids, "status")
+        flash(f"status reverted on {len(rma_ids)} RMA(s).", "info")
+
+    elif action == "remove_owner_batch":
+        cur.execute(
+            """
+            DELETE FROM rma_owners
+            WHERE rma_id = ANY(%s)
+              AND user_id = ANY(%s)
+              AND assigned_on = %s
+              AND assigned_by = %s
+            """,
+            (data["rma_ids"], data["owner_ids"], data["assigned_on"], session["user_id"]),
+        )
+        flash(f"Removed {cur.rowcount} owner assignment(s).", "info")
+        bump_rma_version(cur, data["rma_ids"], "owners")
+
     elif action == "restore_credit_approval":
         cur.execute(
             """
             UPDATE rmas
             SET credit_approved = %s,
                 credit_approvedOn = %s,
-                credit_approvedBy = %s
+                credit_approvedBy = %s,
+                row_version = row_version + 1,
+                updated_at = NOW()
             WHERE rma_id = %s
             """,
             (
@@ -2209,6 +4284,7 @@ def undo_last():
                 data["rma_id"],
             ),
         )
+        notify_rma_event(cur, data["rma_id"], "credit")
         flash("Credit approval reverted.", "info")
 
     conn.commit()
@@ -2222,15 +4298,15 @@ def undo_last():
 
 # ============ METRICS / ANALYTICS ============
 
-@app.route("/metrics")
-@login_required
-def metrics():
-    conn = get_db()
-    cur = conn.cursor()
-    
-    # Get week filter parameter
-    week = request.args.get('week', 'all')
-    
+# ?week= options; anything else means all time
+METRICS_WEEKS = ("all", "this_week", "last_week", "last_4_weeks")
+
+def load_metrics(cur, week):
+    """
+    Run every metrics query for the given week option and return the
+    results keyed the way metrics.html expects them.
+    Shared by the HTML page and the XLSX export.
+    """
     # Determine date range and label
     from datetime import datetime, timedelta
     today = datetime.now().date()
@@ -2358,15 +4434,12 @@ def metrics():
     owner_workload = cur.fetchall()
 
     # Average time to close (for closed RMAs)
+    if DB_DIALECT == "sqlite":
+        days_to_close = "julianday(date_closed) - julianday(date_opened)"
+    else:
+        days_to_close = "EXTRACT(EPOCH FROM (date_closed::timestamp - date_opened::timestamp)) / 86400.0"
     cur.execute(f"""
-        SELECT 
-            AVG(
-                EXTRACT(
-                    EPOCH FROM (
-                        date_closed::timestamp - date_opened::timestamp
-                    )
-                ) / 86400.0
-            ) AS avg_days
+        SELECT AVG({days_to_close}) AS avg_days
         FROM rmas
         {date_filter}
         {'AND' if date_filter else 'WHERE'} status = 'Closed' AND date_closed IS NOT NULL
@@ -2378,10 +4451,7 @@ def metrics():
         else None
     )
 
-    conn.close()
-
-    return render_template(
-        "metrics.html",
+    return dict(
         week=week,
         week_label=week_label,
         total_rmas=total_rmas,
@@ -2397,17 +4467,49 @@ def metrics():
         avg_days_to_close=avg_days_to_close
     )
 
-# ============ CREDIT MANAGEMENT ============
 
-@app.route("/credits/dashboard")
+# Last figures computed per week option, served (marked stale) when a
+# fresh load hits the statement timeout. Per worker process.
+_metrics_cache = {}
+
+
+@app.route("/metrics")
+@replica_reads
 @login_required
-def credit_dashboard():
-    """Dashboard for credit-type RMAs"""
+def metrics():
     conn = get_db()
     cur = conn.cursor()
-    
-    # Pending credits
-    cur.execute("""
+
+    # Get week filter parameter (normalised: it keys _metrics_cache)
+    week = request.args.get('week', 'all')
+    if week not in METRICS_WEEKS:
+        week = 'all'
+
+    try:
+        data = load_metrics(cur, week)
+    except QueryCanceled:
+        conn.close()
+        cached = _metrics_cache.get(week)
+        if cached is None and week == 'this_week':
+            raise    # nothing narrower to offer; statement_timed_out() handles it
+        note_statement_timeout()
+        if cached is None:
+            flash("Those metrics took too long to calculate; showing this week instead.", "warning")
+            return redirect(url_for('metrics', week='this_week'))
+        data, computed_at = cached
+        return render_template("metrics.html", stale_as_of=computed_at, **data)
+
+    conn.close()
+    _metrics_cache[week] = (data, datetime.now())
+
+    return render_template("metrics.html", **data)
+
+# ============ CREDIT MANAGEMENT ============
+
+# Credit list queries, shared by the dashboard and the XLSX export.
+# The dashboard caps approved/rejected at 20 rows; the export streams them all.
+CREDIT_LIST_QUERIES = {
+    "pending": """
         SELECT 
             r.rma_id,
             r.date_opened,
@@ -2427,11 +4529,8 @@ def credit_dashboard():
             r.customer_complaint_desc,
             c.customer_name
         ORDER BY r.date_opened
-    """)
-    pending_credits = cur.fetchall()
-    
-    # Approved credits
-    cur.execute("""
+    """,
+    "approved": """
         SELECT 
             r.rma_id,
             r.date_opened,
@@ -2443,12 +4542,8 @@ def credit_dashboard():
         LEFT JOIN customers c ON r.customer_id = c.customer_id
         WHERE r.credit_approved = 1
         ORDER BY r.credit_approved_on DESC
-        LIMIT 20
-    """)
-    approved_credits = cur.fetchall()
-    
-    # Rejected credits
-    cur.execute("""
+    """,
+    "rejected": """
         SELECT 
             r.rma_id,
             r.date_opened,
@@ -2458,11 +4553,14 @@ def credit_dashboard():
         LEFT JOIN customers c ON r.customer_id = c.customer_id
         WHERE r.credit_rejected = 1
         ORDER BY r.credit_rejected_on DESC
-        LIMIT 20
-    """)
-    rejected_credits = cur.fetchall()
-    
-    # Summary stats
+    """,
+}
+
+CREDIT_DASHBOARD_LIMIT = 20
+
+
+def load_credit_stats(cur):
+    """Summary counts/amounts for credit-type RMAs."""
     cur.execute("""
         SELECT 
             COUNT(*) AS total_credit_rmas,
@@ -2484,7 +4582,31 @@ def credit_dashboard():
         FROM rmas
         WHERE return_type = 'Credit'
     """)
-    stats = cur.fetchone()
+    return cur.fetchone()
+
+
+@app.route("/credits/dashboard")
+@replica_reads
+@login_required
+def credit_dashboard():
+    """Dashboard for credit-type RMAs"""
+    conn = get_db()
+    cur = conn.cursor()
+    
+    # Pending credits
+    cur.execute(CREDIT_LIST_QUERIES["pending"])
+    pending_credits = cur.fetchall()
+    
+    # Approved credits
+    cur.execute(CREDIT_LIST_QUERIES["approved"] + " LIMIT %s", (CREDIT_DASHBOARD_LIMIT,))
+    approved_credits = cur.fetchall()
+    
+    # Rejected credits
+    cur.execute(CREDIT_LIST_QUERIES["rejected"] + " LIMIT %s", (CREDIT_DASHBOARD_LIMIT,))
+    rejected_credits = cur.fetchall()
+    
+    # Summary stats
+    stats = load_credit_stats(cur)
     
     conn.close()
     
@@ -2497,6 +4619,140 @@ def credit_dashboard():
     )
 
 
+# ============ EXCEL EXPORTS ============
+
+# Rows fetched per round trip when streaming a list into a worksheet
+EXPORT_FETCH_SIZE = 2000
+
+
+def xlsx_cell(value):
+    """Convert a DB value into something openpyxl can write."""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (dict, list)):
+        return str(value)
+    return value
+
+
+def write_xlsx_sheet(wb, title, columns, rows):
+    """
+    Append one worksheet to a write-only workbook.
+    `rows` can be any iterable of dict rows (including a server-side cursor),
+    so nothing beyond the current row is kept in memory.
+    """
+    ws = wb.create_sheet(title=title[:31])
+    ws.append([c.replace("_", " ").title() for c in columns])
+    for row in rows:
+        ws.append([xlsx_cell(row.get(c)) for c in columns])
+
+
+def stream_query(conn, sql, params=None):
+    """
+    Iterate a query through a named (server-side) cursor so large
+    result sets are pulled in EXPORT_FETCH_SIZE batches.
+    """
+    cur = conn.cursor(name=f"export_{os.getpid()}_{id(sql)}")
+    cur.itersize = EXPORT_FETCH_SIZE
+    cur.execute(sql, params)
+    try:
+        for row in cur:
+            yield row
+    finally:
+        cur.close()
+
+
+def send_workbook(wb, download_name):
+    """Save a write-only workbook to a temp file and send it."""
+    tmp = tempfile.TemporaryFile()
+    wb.save(tmp)
+    tmp.seek(0)
+    return send_file(
+        tmp,
+        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        as_attachment=True,
+        download_name=download_name,
+    )
+
+
+@app.route("/metrics/export.xlsx")
+@replica_reads
+@login_required
+def export_metrics():
+    """Download every metrics breakdown for the selected week as XLSX."""
+    from openpyxl import Workbook
+
+    week = request.args.get('week', 'all')
+    if week not in METRICS_WEEKS:
+        week = 'all'
+
+    conn = get_db()
+    cur = conn.cursor()
+    data = load_metrics(cur, week)
+    conn.close()
+
+    wb = Workbook(write_only=True)
+
+    summary = [
+        {"metric": "Period", "value": data["week_label"]},
+        {"metric": "Total RMAs", "value": data["total_rmas"]},
+        {"metric": "Avg Days to Close", "value": data["avg_days_to_close"]},
+        {"metric": "Credits Approved", "value": data["credit_approved_count"]},
+        {"metric": "Credits Requested", "value": data["credit_requested_count"]},
+        {"metric": "RMAs With Dispositions", "value": data["rmas_with_dispositions"]},
+        {"metric": "RMAs Without Dispositions", "value": data["rmas_without_dispositions"]},
+    ]
+    write_xlsx_sheet(wb, "Summary", ["metric", "value"], summary)
+    write_xlsx_sheet(wb, "Status", ["status", "count"], data["status_breakdown"])
+    write_xlsx_sheet(wb, "Return Type", ["return_type", "count"], data["return_type_breakdown"])
+    write_xlsx_sheet(wb, "Disposition", ["disposition", "count"], data["disposition_breakdown"])
+    write_xlsx_sheet(wb, "Top Customers", ["customer_id", "customer_name", "rma_count"], data["top_customers"])
+    write_xlsx_sheet(wb, "Owner Workload", ["OwnerID", "OwnerName", "active", "total"], data["owner_workload"])
+
+    return send_workbook(wb, f"rma_metrics_{week}_{datetime.now():%Y%m%d}.xlsx")
+
+
+@app.route("/credits/dashboard/export.xlsx")
+@replica_reads
+@login_required
+def export_credit_dashboard():
+    """Download the full (unpaginated) pending/approved/rejected credit lists as XLSX."""
+    from openpyxl import Workbook
+
+    conn = get_db()
+    cur = conn.cursor()
+    stats = load_credit_stats(cur)
+    cur.close()
+
+    wb = Workbook(write_only=True)
+    write_xlsx_sheet(
+        wb,
+        "Summary",
+        ["total_credit_rmas", "pending_count", "approved_count", "rejected_count", "total_approved_amount"],
+        [stats] if stats else [],
+    )
+    write_xlsx_sheet(
+        wb,
+        "Pending",
+        ["rma_id", "date_opened", "customer_name", "owners", "complaint"],
+        stream_query(conn, CREDIT_LIST_QUERIES["pending"]),
+    )
+    write_xlsx_sheet(
+        wb,
+        "Approved",
+        ["rma_id", "date_opened", "credit_approved_on", "credit_amount", "credit_memo_number", "customer_name"],
+        stream_query(conn, CREDIT_LIST_QUERIES["approved"]),
+    )
+    write_xlsx_sheet(
+        wb,
+        "Rejected",
+        ["rma_id", "date_opened", "credit_rejected_on", "customer_name"],
+        stream_query(conn, CREDIT_LIST_QUERIES["rejected"]),
+    )
+    conn.close()
+
+    return send_workbook(wb, f"rma_credits_{datetime.now():%Y%m%d}.xlsx")
+
+
 @app.route("/rmas/<int:rma_id>/approve_credit", methods=["POST"])
 @login_required
 def toggle_credit_approval(rma_id):
@@ -2542,7 +4798,9 @@ def toggle_credit_approval(rma_id):
             UPDATE rmas
             SET credit_approved = 1,
                 credit_approved_on = %s,
-                credit_approved_by = %s
+                credit_approved_by = %s,
+                row_version = row_version + 1,
+                updated_at = NOW()
             WHERE rma_id = %s
         """, (now, session["user_id"], rma_id))
         flash("Credit approved.", "success")
@@ -2551,11 +4809,14 @@ def toggle_credit_approval(rma_id):
             UPDATE rmas
             SET credit_approved = 0,
                 credit_approved_on = NULL,
-                credit_approved_by = NULL
+                credit_approved_by = NULL,
+                row_version = row_version + 1,
+                updated_at = NOW()
             WHERE rma_id = %s
         """, (rma_id,))
         flash("Credit approval removed.", "info")
-    
+
+    notify_rma_event(cur, rma_id, "credit")
     conn.commit()
     conn.close()
     
@@ -2682,28 +4943,375 @@ def admin_send_reminders():
     return redirect(url_for('index'))
 
 
-# ============ ADMIN - USER MANAGEMENT ============
-
-@app.route("/admin/users")
-@admin_required
-def admin_users():
-    """List all users (admin only)"""
-    conn = get_db()
-    cur = conn.cursor()
-    
+# ============ ADMIN - BULK RMA IMPORT ============
+
+# Columns accepted in an import CSV. One row per line item; rows sharing an
+# import_ref become one RMA, with the header fields taken from its first row.
+IMPORT_COLUMNS = [
+    "import_ref",
+    "customer_name",
+    "return_type",
+    "customer_date_opened",
+    "complaint",
+    "internal_notes",
+    "owners",
+    "part_number",
+    "tool_number",
+    "item_description",
+    "qty_affected",
+    "po_lot_number",
+    "total_cost",
+]
+IMPORT_HEADER_COLUMNS = IMPORT_COLUMNS[:7]
+IMPORT_LINE_COLUMNS = IMPORT_COLUMNS[7:]
+
+# Most errors listed on the results page
+IMPORT_ERROR_LIMIT = 500
+
+
+def read_import_header(stream):
+    """
+    Read and normalise the CSV header line.
+    Returns (columns, error_message).
+    """
+    first_line = stream.readline()
+    header = next(csv.reader([first_line]), [])
+    columns = [h.strip().lower().replace(" ", "_") for h in header]
+
+    unknown = [c for c in columns if c not in IMPORT_COLUMNS]
+    if unknown:
+        return None, f"Unknown column(s): {', '.join(unknown)}"
+    if len(set(columns)) != len(columns):
+        return None, "Duplicate column names in header."
+    for required in ("import_ref", "customer_name"):
+        if required not in columns:
+            return None, f"Missing required column: {required}"
+    return columns, None
+
+
+def stage_rma_import(cur, stream, columns):
+    """COPY the CSV body into a temp staging table and build per-RMA headers."""
     cur.execute("""
-        SELECT user_id, username, full_name, email, role, created_on, last_login
-        FROM users
-        ORDER BY created_on DESC
+        CREATE TEMP TABLE rma_import_staging (
+            row_num              SERIAL,
+            import_ref           TEXT,
+            customer_name        TEXT,
+            return_type          TEXT,
+            customer_date_opened TEXT,
+            complaint            TEXT,
+            internal_notes       TEXT,
+            owners               TEXT,
+            part_number          TEXT,
+            tool_number          TEXT,
+            item_description     TEXT,
+            qty_affected         TEXT,
+            po_lot_number        TEXT,
+            total_cost           TEXT
+        ) ON COMMIT DROP
     """)
-    users = cur.fetchall()
-    conn.close()
-    
-    return render_template("admin_users.html", users=users)
 
+    # Column names are whitelisted by read_import_header()
+    if GREEN_DB:
+        # psycopg2 refuses COPY while a wait callback is installed
+        insert_sql = f"INSERT INTO rma_import_staging ({', '.join(columns)}) VALUES %s"
+        batch = []
+        for row in csv.reader(stream):
+            if row:
+                batch.append(row)
+            if len(batch) >= 1000:
+                execute_values(cur, insert_sql, batch, page_size=1000)
+                batch = []
+        if batch:
+            execute_values(cur, insert_sql, batch, page_size=1000)
+    else:
+        cur.copy_expert(
+            f"COPY rma_import_staging ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+            stream,
+        )
 
-@app.route("/admin/users/<int:user_id>/role", methods=["POST"])
-@admin_required
+    # Blank cells -> NULL so the checks below only see real values
+    cur.execute(
+        "UPDATE rma_import_staging SET "
+        + ", ".join(f"{c} = NULLIF(trim({c}), '')" for c in IMPORT_COLUMNS)
+    )
+
+    # First row of each import_ref carries the RMA header
+    cur.execute(f"""
+        CREATE TEMP TABLE rma_import_headers ON COMMIT DROP AS
+        SELECT DISTINCT ON (import_ref)
+            import_ref,
+            row_num,
+            {', '.join(IMPORT_HEADER_COLUMNS[1:])},
+            NULL::INTEGER AS customer_id,
+            NULL::INTEGER AS rma_id
+        FROM rma_import_staging
+        WHERE import_ref IS NOT NULL
+        ORDER BY import_ref, row_num
+    """)
+
+    cur.execute("""
+        UPDATE rma_import_headers h
+        SET customer_id = c.customer_id
+        FROM (
+            SELECT lower(customer_name) AS name_key, MIN(customer_id) AS customer_id
+            FROM customers
+            GROUP BY lower(customer_name)
+        ) c
+        WHERE c.name_key = lower(h.customer_name)
+    """)
+
+
+def validate_rma_import(cur):
+    """
+    Return (error_count, errors) where errors is a list of {row_num, error} rows.
+    Every value insert_rma_import() casts is checked here first, so a bad
+    row is reported by number instead of aborting the import at the cast.
+    """
+    cur.execute(r"""
+        CREATE TEMP TABLE rma_import_errors ON COMMIT DROP AS
+        SELECT row_num, 'import_ref is required' AS error
+        FROM rma_import_staging
+        WHERE import_ref IS NULL
+
+        UNION ALL
+        SELECT row_num, 'customer_name is required'
+        FROM rma_import_headers
+        WHERE customer_name IS NULL
+
+        UNION ALL
+        SELECT row_num, 'Unknown customer: ' || customer_name
+        FROM rma_import_headers
+        WHERE customer_name IS NOT NULL AND customer_id IS NULL
+
+        UNION ALL
+        SELECT row_num, 'Invalid return_type: ' || return_type
+        FROM rma_import_headers
+        WHERE return_type IS NOT NULL AND return_type <> ALL(%s)
+
+        UNION ALL
+        SELECT row_num, 'customer_date_opened must be a valid YYYY-MM-DD date'
+        FROM rma_import_headers
+        WHERE customer_date_opened IS NOT NULL
+          AND CASE
+                WHEN customer_date_opened !~ '^\d{4}-(0[1-9]|1[0-2])-(0[1-9]|[12]\d|3[01])$' THEN true
+                WHEN left(customer_date_opened, 4)::int = 0 THEN true
+                -- day past the end of its month (2024-02-30, 2023-02-29, ...)
+                ELSE right(customer_date_opened, 2)::int > EXTRACT(DAY FROM
+                    make_date(left(customer_date_opened, 4)::int, substr(customer_date_opened, 6, 2)::int, 1)
+                    + INTERVAL '1 month' - INTERVAL '1 day')
+              END
+
+        UNION ALL
+        SELECT h.row_num, 'Unknown owner: ' || trim(o.name)
+        FROM rma_import_headers h
+        CROSS JOIN LATERAL unnest(string_to_array(h.owners, ';')) AS o(name)
+        WHERE trim(o.name) <> ''
+          AND NOT EXISTS (
+              SELECT 1 FROM users u
+              WHERE lower(u.username) = lower(trim(o.name))
+                 OR lower(u.email) = lower(trim(o.name))
+          )
+
+        UNION ALL
+        SELECT s.row_num, 'Header fields differ from the first row of ' || s.import_ref
+        FROM rma_import_staging s
+        JOIN rma_import_headers h ON h.import_ref = s.import_ref
+        WHERE s.row_num <> h.row_num
+          AND (
+                (s.customer_name IS NOT NULL AND s.customer_name IS DISTINCT FROM h.customer_name)
+             OR (s.return_type IS NOT NULL AND s.return_type IS DISTINCT FROM h.return_type)
+             OR (s.customer_date_opened IS NOT NULL AND s.customer_date_opened IS DISTINCT FROM h.customer_date_opened)
+          )
+
+        UNION ALL
+        SELECT row_num, 'qty_affected must be a whole number'
+        FROM rma_import_staging
+        WHERE qty_affected IS NOT NULL AND qty_affected !~ '^-?\d{1,9}$'
+
+        UNION ALL
+        SELECT row_num, 'total_cost must be a number (at most 10 digits before the point)'
+        FROM rma_import_staging
+        WHERE total_cost IS NOT NULL AND total_cost !~ '^-?\d{1,10}(\.\d+)?$'
+    """, (RETURN_TYPE_OPTIONS,))
+
+    cur.execute("SELECT COUNT(*) AS count FROM rma_import_errors")
+    error_count = cur.fetchone()["count"]
+
+    cur.execute(
+        "SELECT row_num, error FROM rma_import_errors ORDER BY row_num, error LIMIT %s",
+        (IMPORT_ERROR_LIMIT,),
+    )
+    return error_count, cur.fetchall()
+
+
+def insert_rma_import(cur, user_id, now):
+    """Set-based insert of rmas, rma_lines, rma_owners and status_history from staging."""
+    # Reserve rma_ids up front (in file order) so lines/owners can join on them
+    cur.execute("""
+        WITH ordered AS (
+            SELECT import_ref, nextval(pg_get_serial_sequence('rmas', 'rma_id')) AS rma_id
+            FROM (SELECT import_ref FROM rma_import_headers ORDER BY row_num) x
+        )
+        UPDATE rma_import_headers h
+        SET rma_id = ordered.rma_id
+        FROM ordered
+        WHERE ordered.import_ref = h.import_ref
+    """)
+
+    cur.execute("""
+        INSERT INTO rmas (
+            rma_id,
+            customer_id,
+            status,
+            date_opened,
+            customer_date_opened,
+            return_type,
+            customer_complaint_desc,
+            internal_notes,
+            created_by_user_id
+        )
+        SELECT
+            rma_id,
+            customer_id,
+            'Draft',
+            %s,
+            customer_date_opened::date,
+            COALESCE(return_type, 'TBD'),
+            complaint,
+            internal_notes,
+            %s
+        FROM rma_import_headers
+        ORDER BY rma_id
+    """, (now, user_id))
+    rma_count = cur.rowcount
+
+    cur.execute("""
+        INSERT INTO rma_lines (
+            rma_id,
+            part_number,
+            tool_number,
+            item_description,
+            qty_affected,
+            po_lot_number,
+            total_cost
+        )
+        SELECT
+            h.rma_id,
+            s.part_number,
+            s.tool_number,
+            s.item_description,
+            s.qty_affected::integer,
+            s.po_lot_number,
+            s.total_cost::numeric
+        FROM rma_import_staging s
+        JOIN rma_import_headers h ON h.import_ref = s.import_ref
+        WHERE COALESCE(s.part_number, s.tool_number, s.item_description,
+                       s.qty_affected, s.po_lot_number, s.total_cost) IS NOT NULL
+        ORDER BY s.row_num
+    """)
+    line_count = cur.rowcount
+
+    cur.execute("""
+        INSERT INTO rma_owners (rma_id, user_id, is_primary, assigned_on, assigned_by)
+        SELECT DISTINCT h.rma_id, u.user_id, 0, %s::timestamp, %s::integer
+        FROM rma_import_headers h
+        CROSS JOIN LATERAL unnest(string_to_array(h.owners, ';')) AS o(name)
+        JOIN users u
+          ON lower(u.username) = lower(trim(o.name))
+          OR lower(u.email) = lower(trim(o.name))
+    """, (now, user_id))
+
+    cur.execute("""
+        INSERT INTO status_history (rma_id, status, changed_by, changed_on, comment)
+        SELECT rma_id, 'Draft', %s, %s, 'RMA imported (' || import_ref || ')'
+        FROM rma_import_headers
+    """, (user_id, now))
+
+    notify_rma_event(cur, None, "created")
+
+    return rma_count, line_count
+
+
+@app.route("/admin/rmas/import", methods=["GET", "POST"])
+@admin_required
+def import_rmas():
+    """
+    Admin-only: bulk-create RMAs from a CSV of headers + lines.
+    The whole file is staged with COPY and validated set-based; nothing is
+    written unless every row passes.
+    """
+    if request.method == "GET":
+        return render_template("admin_rma_import.html", columns=IMPORT_COLUMNS)
+    if DB_DIALECT != "postgres":
+        # Staging and validation lean on Postgres (COPY, DISTINCT ON, LATERAL)
+        flash("Bulk import needs the Postgres server; it isn't available in the desktop build.", "error")
+        return redirect(url_for("import_rmas"))
+
+    file = request.files.get("file")
+    if not file or file.filename == "":
+        flash("No file selected.", "error")
+        return redirect(url_for("import_rmas"))
+
+    stream = io.TextIOWrapper(file.stream, encoding="utf-8-sig", newline="")
+    columns, header_error = read_import_header(stream)
+    if header_error:
+        flash(header_error, "error")
+        return redirect(url_for("import_rmas"))
+
+    conn = get_db()
+    cur = conn.cursor()
+
+    try:
+        stage_rma_import(cur, stream, columns)
+        error_count, errors = validate_rma_import(cur)
+
+        if error_count:
+            conn.rollback()
+            conn.close()
+            flash(f"Import rejected: {error_count} error(s). Nothing was imported.", "error")
+            return render_template(
+                "admin_rma_import.html",
+                columns=IMPORT_COLUMNS,
+                errors=errors,
+                error_count=error_count,
+            )
+
+        rma_count, line_count = insert_rma_import(cur, session["user_id"], datetime.now())
+        conn.commit()
+    except psycopg2.Error as e:
+        conn.rollback()
+        conn.close()
+        flash(f"Import failed: {e.pgerror or e}", "error")
+        return redirect(url_for("import_rmas"))
+
+    conn.close()
+
+    flash(f"Imported {rma_count} RMA(s) with {line_count} line item(s).", "success")
+    return redirect(url_for("list_rmas"))
+
+
+# ============ ADMIN - USER MANAGEMENT ============
+
+@app.route("/admin/users")
+@admin_required
+def admin_users():
+    """List all users (admin only)"""
+    conn = get_db()
+    cur = conn.cursor()
+    
+    cur.execute("""
+        SELECT user_id, username, full_name, email, role, created_on, last_login
+        FROM users
+        ORDER BY created_on DESC
+    """)
+    users = cur.fetchall()
+    conn.close()
+    
+    return render_template("admin_users.html", users=users)
+
+
+@app.route("/admin/users/<int:user_id>/role", methods=["POST"])
+@admin_required
 def change_user_role(user_id):
     """Change a user's role (admin only)"""
     current_user = get_current_user()
@@ -2866,6 +5474,9 @@ def edit_user(user_id):
                 SET full_name = %s, email = %s
                 WHERE user_id = %s
             """, (full_name, email, user_id))
+
+        if full_name != user['full_name']:
+            bump_user_rmas(cur, user_id)    # RMA pages show the name, not the email
         
         conn.commit()
         conn.close()
@@ -2881,16 +5492,991 @@ def edit_user(user_id):
     return render_template("edit_user.html", user=user, is_self=(user_id == current_user['user_id']))
 
 
+# ============ OPS METRICS ENDPOINT ============
+
+@app.route("/ops/metrics")
+def ops_metrics():
+    """
+    Prometheus scrape endpoint. Needs `Authorization: Bearer $OPS_METRICS_TOKEN`,
+    or a logged-in admin when browsing.
+    """
+    auth = request.headers.get("Authorization", "")
+    token_ok = bool(OPS_METRICS_TOKEN) and auth.startswith("Bearer ") and hmac.compare_digest(
+        auth[len("Bearer "):].strip(), OPS_METRICS_TOKEN
+    )
+    if not token_ok:
+        user = get_current_user() if "user_id" in session else None
+        if not user or user["role"] != "admin":
+            return make_response("Forbidden", 403)
+
+    if not prometheus_client:
+        return make_response("prometheus_client is not installed", 501)
+
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import CollectorRegistry, multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+
+    resp = make_response(prometheus_client.generate_latest(registry))
+    resp.headers["Content-Type"] = prometheus_client.CONTENT_TYPE_LATEST
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
+
+
+# ============ ADMIN - SLOW QUERIES ============
+
+SLOW_QUERY_SORTS = {
+    "total": "total_ms DESC",
+    "max": "max_ms DESC",
+    "p95": "p95_ms DESC",
+    "calls": "calls DESC",
+    "recent": "last_seen DESC",
+}
+
+
+@app.route("/admin/slow-queries")
+@admin_required
+def admin_slow_queries():
+    """Slow statements grouped by fingerprint; ?fingerprint= shows recent samples."""
+    days = request.args.get("days", 7, type=int)
+    sort = request.args.get("sort", "total")
+    fingerprint = request.args.get("fingerprint")
+
+    if DB_DIALECT != "postgres":
+        # Only logged (JSON lines) on SQLite; see note_slow_query()
+        return render_template(
+            "admin_slow_queries.html", ranked=[], samples=[], fingerprint=None, days=days,
+            sort=sort, sorts=list(SLOW_QUERY_SORTS), threshold_ms=SLOW_QUERY_MS,
+            explain_enabled=False,
+        )
+
+    conn = get_db()
+    cur = conn.cursor()
+
+    cur.execute(
+        f"""
+        SELECT
+            fingerprint,
+            MIN(normalized_sql)                                          AS normalized_sql,
+            COUNT(*)                                                     AS calls,
+            ROUND(SUM(duration_ms)::numeric, 1)                          AS total_ms,
+            ROUND(AVG(duration_ms)::numeric, 1)                          AS avg_ms,
+            ROUND((percentile_cont(0.95) WITHIN GROUP (ORDER BY duration_ms))::numeric, 1) AS p95_ms,
+            ROUND(MAX(duration_ms)::numeric, 1)                          AS max_ms,
+            MAX(captured_at)                                             AS last_seen,
+            string_agg(DISTINCT route, ', ')                             AS routes,
+            bool_or(plan IS NOT NULL)                                    AS has_plan
+        FROM slow_queries
+        WHERE captured_at >= NOW() - %s * INTERVAL '1 day'
+        GROUP BY fingerprint
+        ORDER BY {SLOW_QUERY_SORTS.get(sort, SLOW_QUERY_SORTS["total"])}
+        LIMIT 100
+        """,
+        (days,),
+    )
+    ranked = cur.fetchall()
+
+    samples = []
+    if fingerprint:
+        cur.execute(
+            """
+            SELECT captured_at, duration_ms, row_count, route, params, plan
+            FROM slow_queries
+            WHERE fingerprint = %s
+            ORDER BY captured_at DESC
+            LIMIT 20
+            """,
+            (fingerprint,),
+        )
+        samples = cur.fetchall()
+    conn.close()
+
+    return render_template(
+        "admin_slow_queries.html",
+        ranked=ranked,
+        samples=samples,
+        fingerprint=fingerprint,
+        days=days,
+        sort=sort,
+        sorts=list(SLOW_QUERY_SORTS),
+        threshold_ms=SLOW_QUERY_MS,
+        explain_enabled=SLOW_QUERY_EXPLAIN,
+    )
+
+
+@app.route("/admin/slow-queries/clear", methods=["POST"])
+@admin_required
+def clear_slow_queries():
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM slow_queries")
+    conn.commit()
+    conn.close()
+
+    flash("Slow query log cleared.", "success")
+    return redirect(url_for("admin_slow_queries"))
+
+
+# ============ ADMIN - PROFILES ============
+
+@app.route("/admin/profiles")
+@admin_required
+def admin_profiles():
+    """Captured request profiles; ?id= shows one."""
+    profile_id = request.args.get("id", type=int)
+
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT profile_id, captured_at, mode, trigger, requested_by, method, path,
+               route, status, duration_ms, samples
+        FROM request_profiles
+        ORDER BY captured_at DESC
+        LIMIT 100
+        """
+    )
+    profiles = cur.fetchall()
+
+    profile = None
+    if profile_id:
+        cur.execute(
+            """
+            SELECT profile_id, captured_at, mode, trigger, requested_by, method, path,
+                   route, status, duration_ms, samples, stats
+            FROM request_profiles
+            WHERE profile_id = %s
+            """,
+            (profile_id,),
+        )
+        profile = cur.fetchone()
+    conn.close()
+
+    return render_template(
+        "admin_profiles.html",
+        profiles=profiles,
+        profile=profile,
+        sample_rate=PROFILE_SAMPLE_RATE,
+        min_interval=PROFILE_MIN_INTERVAL,
+    )
+
+
+@app.route("/admin/profiles/<int:profile_id>/download")
+@admin_required
+def download_profile(profile_id):
+    """Folded stacks (.folded) for sampled profiles, pstats data (.prof) for cProfile."""
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute("SELECT mode, route, folded, raw FROM request_profiles WHERE profile_id = %s", (profile_id,))
+    row = cur.fetchone()
+    conn.close()
+    if not row:
+        flash("Profile not found.", "error")
+        return redirect(url_for("admin_profiles"))
+
+    if row["mode"] == "cprofile":
+        data, ext, mimetype = bytes(row["raw"]), "prof", "application/octet-stream"
+    else:
+        data, ext, mimetype = (row["folded"] or "").encode("utf-8"), "folded", "text/plain"
+    return send_file(
+        io.BytesIO(data),
+        mimetype=mimetype,
+        as_attachment=True,
+        download_name=f"profile-{profile_id}.{ext}",
+    )
+
+
+@app.route("/admin/profiles/clear", methods=["POST"])
+@admin_required
+def clear_profiles():
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM request_profiles")
+    conn.commit()
+    conn.close()
+
+    flash("Profiles cleared.", "success")
+    return redirect(url_for("admin_profiles"))
+
+
+# ============ LIVE UPDATES (LISTEN/NOTIFY + SSE) ============
+#
+# Mutating routes call notify_rma_event(); each worker keeps ONE listening
+# connection and fans events out to its open /events streams. Streams run
+# on gthread worker threads (see startup.sh), are capped per worker, and
+# end after LIVE_STREAM_SECONDS so EventSource reconnects and threads
+# recycle. Under gunicorn gthread the cap defaults to half of --threads and
+# must stay below it (enforced in gunicorn.conf.py); 20 is for the rest.
+
+LIVE_MAX_CLIENTS = int(os.environ.get("LIVE_MAX_CLIENTS", "20"))
+LIVE_HEARTBEAT_SECONDS = 20
+LIVE_STREAM_SECONDS = 300
+
+_live_lock = threading.Lock()
+_live_clients = set()
+_live_listener = None
+
+# Which detail-page partials each event kind can change
+LIVE_FRAGMENTS = {
+    "status": ["_rma_header.html", "_rma_status_card.html", "_rma_age_strip.html",
+               "_rma_info_card.html", "_rma_status_history.html"],
+    "notes": ["_rma_notes_panel.html"],
+    "info": ["_rma_header.html", "_rma_age_strip.html", "_rma_info_card.html"],
+    "owners": ["_rma_info_card.html"],
+    "credit": ["_rma_info_card.html"],
+    "lines": ["_rma_lines_card.html", "_rma_dispositions.html"],
+    "dispositions": ["_rma_lines_card.html", "_rma_dispositions.html"],
+    "attachments": ["_rma_attachments.html"],
+}
+LIVE_ALL_FRAGMENTS = list(dict.fromkeys(t for ts in LIVE_FRAGMENTS.values() for t in ts))
+
+
+def publish_rma_event(event):
+    with _live_lock:
+        clients = list(_live_clients)
+    for q in clients:
+        try:
+            q.put_nowait(event)
+        except queue.Full:
+            pass  # stalled client; it resyncs when it reconnects
+
+
+def listen_for_rma_events():
+    """
+    Worker-wide LISTEN loop (daemon thread). Notifications sent while the
+    connection was down are lost, so after a reconnect pages get a
+    "resync" event and refresh everything.
+    """
+    backoff = 1
+    reconnecting = False
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(DATABASE_LISTEN_URL)
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            cur = conn.cursor()
+            cur.execute(f"LISTEN {RMA_EVENTS_CHANNEL}")
+            if reconnecting:
+                publish_rma_event({"rma_id": None, "kind": "resync", "origin": None})
+            reconnecting = True
+            backoff = 1
+
+            while True:
+                if not select.select([conn], [], [], 60)[0]:
+                    cur.execute("SELECT 1")  # idle: make sure the socket is still alive
+                conn.poll()
+                while conn.notifies:
+                    note = conn.notifies.pop(0)
+                    try:
+                        publish_rma_event(json.loads(note.payload))
+                    except ValueError:
+                        pass
+        except Exception as e:
+            print("Live update listener error:", e)
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 60)
+        finally:
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+
+
+def subscribe_rma_events():
+    """A queue of events for one stream, or None if this worker is at its cap."""
+    global _live_listener
+    with _live_lock:
+        if len(_live_clients) >= LIVE_MAX_CLIENTS:
+            return None
+        # Started lazily so it runs in the worker process, not a forking parent
+        if DB_DIALECT == "postgres" and (_live_listener is None or not _live_listener.is_alive()):
+            _live_listener = threading.Thread(
+                target=listen_for_rma_events, name="rma-live-listener", daemon=True
+            )
+            _live_listener.start()
+        q = queue.Queue(maxsize=100)
+        _live_clients.add(q)
+        return q
+
+
+def unsubscribe_rma_events(q):
+    with _live_lock:
+        _live_clients.discard(q)
+
+
+@app.route("/events")
+@login_required
+def live_events():
+    """Server-Sent Events stream of RMA changes; ?rma_id=N limits it to one RMA."""
+    rma_id = request.args.get("rma_id", type=int)
+    q = subscribe_rma_events()
+    if q is None:
+        resp = make_response("Too many live connections on this worker.", 503)
+        resp.headers["Retry-After"] = "60"
+        return resp
+
+    def stream():
+        try:
+            yield "retry: 5000\n\n"
+            deadline = time.monotonic() + LIVE_STREAM_SECONDS
+            while time.monotonic() < deadline:
+                try:
+                    event = q.get(timeout=LIVE_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                # rma_id None means "many RMAs" (e.g. bulk import / resync)
+                if rma_id and event.get("rma_id") not in (rma_id, None):
+                    continue
+                yield f"data: {json.dumps(event)}\n\n"
+        finally:
+            unsubscribe_rma_events(q)
+
+    return app.response_class(
+        stream(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/rmas/<int:rma_id>/fragments")
+@login_required
+def rma_fragments(rma_id):
+    """
+    Detail-page partials for the live-update script. ?kind=status,lines
+    picks what to render; an unknown kind (resync, updated) renders all.
+    """
+    templates = []
+    for kind in request.args.get("kind", "").split(","):
+        for name in LIVE_FRAGMENTS.get(kind, LIVE_ALL_FRAGMENTS):
+            if name not in templates:
+                templates.append(name)
+
+    conn = get_db()
+    cur = conn.cursor()
+
+    rma = fetch_rma(cur, rma_id)
+    if not rma:
+        conn.close()
+        return fragment_response([], status=404)
+
+    context = {"rma": rma, "status_options": STATUS_OPTIONS}
+    if "_rma_info_card.html" in templates or "_rma_notes_panel.html" in templates:
+        context["notes_count"] = count_notes_history(cur, rma_id)
+    if "_rma_info_card.html" in templates:
+        context["assigned_owners"] = fetch_assigned_owners(cur, rma_id)
+        cur.execute("SELECT user_id, full_name FROM users ORDER BY full_name")
+        context["owners"] = cur.fetchall()
+    if "_rma_status_history.html" in templates:
+        context["statuses"] = fetch_status_history(cur, rma_id)
+    if "_rma_lines_card.html" in templates or "_rma_dispositions.html" in templates:
+        context["lines"] = fetch_rma_lines(cur, rma_id)
+    if "_rma_attachments.html" in templates:
+        context["attachments"] = fetch_attachments(cur, rma_id)
+    conn.close()
+
+    return fragment_response(templates, **context)
+
+
+# ============ JSON API (v1) ============
+
+# Comma-separated bearer tokens for machine clients (MES/ERP); a logged-in
+# browser session is accepted too.
+API_TOKENS = {t.strip() for t in os.environ.get("API_TOKENS", "").split(",") if t.strip()}
+
+API_DEFAULT_LIMIT = 50
+API_MAX_LIMIT = 500
+
+# Responses smaller than this aren't worth compressing
+API_GZIP_MIN_BYTES = 1024
+
+# Selectable RMA fields (?fields=a,b,c) -> SQL expression (rmas r, customers c)
+API_RMA_FIELDS = {
+    "rma_id": "r.rma_id",
+    "status": "r.status",
+    "date_opened": "r.date_opened",
+    "customer_date_opened": "r.customer_date_opened",
+    "date_closed": "r.date_closed",
+    "return_type": "r.return_type",
+    "customer_id": "r.customer_id",
+    "customer_name": "c.customer_name",
+    "complaint": "r.customer_complaint_desc",
+    "internal_notes": "r.internal_notes",
+    "created_by_user_id": "r.created_by_user_id",
+    "acknowledged": "r.acknowledged",
+    "acknowledged_on": "r.acknowledged_on",
+    "credit_amount": "r.credit_amount",
+    "credit_memo_number": "r.credit_memo_number",
+    "credit_approved": "r.credit_approved",
+    "credit_approved_on": "r.credit_approved_on",
+    "credit_rejected": "r.credit_rejected",
+    "credit_rejected_on": "r.credit_rejected_on",
+    "credit_rejection_reason": "r.credit_rejection_reason",
+    "credit_issued_on": "r.credit_issued_on",
+    "owners": """(
+        SELECT COALESCE(
+            json_agg(
+                json_build_object('user_id', u.user_id, 'full_name', u.full_name, 'is_primary', ro.is_primary)
+                ORDER BY ro.is_primary DESC, u.full_name
+            ),
+            '[]'::json
+        )
+        FROM rma_owners ro
+        JOIN users u ON ro.user_id = u.user_id
+        WHERE ro.rma_id = r.rma_id
+    )""" if DB_DIALECT == "postgres" else """(
+        SELECT json_group_array(json_object('user_id', user_id, 'full_name', full_name, 'is_primary', is_primary))
+        FROM (
+            SELECT u.user_id, u.full_name, ro.is_primary
+            FROM rma_owners ro
+            JOIN users u ON ro.user_id = u.user_id
+            WHERE ro.rma_id = r.rma_id
+            ORDER BY ro.is_primary DESC, u.full_name
+        )
+    )""",
+    "row_version": "r.row_version",
+}
+
+API_CUSTOMER_FIELDS = {
+    "customer_id": "c.customer_id",
+    "customer_name": "c.customer_name",
+    "contact_name": "c.contact_name",
+    "contact_email": "c.contact_email",
+    "contact_address": "c.contact_address",
+}
+
+
+def api_auth_required(f):
+    """Like login_required, but answers 401 JSON and also accepts a bearer token."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if "user_id" in session:
+            return f(*args, **kwargs)
+
+        auth = request.headers.get("Authorization", "")
+        if auth.startswith("Bearer "):
+            token = auth[len("Bearer "):].strip()
+            if any(hmac.compare_digest(token, t) for t in API_TOKENS):
+                return f(*args, **kwargs)
+
+        return api_error("authentication required", 401)
+    return decorated_function
+
+
+def api_default(value):
+    """json.dumps fallback for DB types."""
+    if hasattr(value, "isoformat"):  # datetime, date, time
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def api_error(message, status):
+    return app.response_class(
+        json.dumps({"error": message}), status=status, mimetype="application/json"
+    )
+
+
+def api_response(payload, etag=None):
+    """
+    Serialize payload and attach a weak ETag (given, or a hash of the body).
+    make_conditional() turns a matching If-None-Match into a 304.
+    """
+    body = json.dumps(payload, default=api_default, separators=(",", ":"))
+    resp = app.response_class(body, mimetype="application/json")
+    resp.set_etag(etag or hashlib.md5(body.encode("utf-8")).hexdigest(), weak=True)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp.make_conditional(request)
+
+
+def api_not_modified(etag):
+    """304 response if the client already holds this version, else None."""
+    if request.if_none_match.contains_weak(etag):
+        resp = app.response_class(status=304)
+        resp.set_etag(etag, weak=True)
+        resp.headers["Cache-Control"] = "private, no-cache"
+        return resp
+    return None
+
+
+def api_version_etag(*parts):
+    """ETag from row versions plus the query string (fields, filters, cursor)."""
+    raw = "|".join(str(p) for p in parts) + "|" + request.query_string.decode("latin-1")
+    return hashlib.md5(raw.encode("utf-8")).hexdigest()
+
+
+def api_fields(allowed, key):
+    """Parse ?fields= against the allowed map. Returns (names, error)."""
+    raw = request.args.get("fields", "").strip()
+    if not raw:
+        return list(allowed), None
+    names = [f.strip() for f in raw.split(",") if f.strip()]
+    unknown = [f for f in names if f not in allowed]
+    if unknown:
+        return None, f"unknown field(s): {', '.join(unknown)}"
+    if key not in names:
+        names.insert(0, key)
+    return names, None
+
+
+def api_page_args():
+    """Parse ?limit= and ?cursor= (last id of the previous page). Returns (limit, cursor, error)."""
+    try:
+        limit = min(max(int(request.args.get("limit", API_DEFAULT_LIMIT)), 1), API_MAX_LIMIT)
+        cursor = parse_int(request.args.get("cursor"))
+    except ValueError:
+        return None, None, "limit and cursor must be integers"
+    return limit, cursor, None
+
+
+def api_select(fields, allowed):
+    return ", ".join(f"{allowed[name]} AS {name}" for name in fields)
+
+
+@app.after_request
+def gzip_api_response(response):
+    """gzip JSON API responses for clients that accept it."""
+    if not request.path.startswith("/api/"):
+        return response
+    response.vary.add("Accept-Encoding")
+    if (
+        response.status_code == 200
+        and not response.direct_passthrough
+        and "Content-Encoding" not in response.headers
+        and "gzip" in request.headers.get("Accept-Encoding", "")
+    ):
+        data = response.get_data()
+        if len(data) >= API_GZIP_MIN_BYTES:
+            import gzip
+            response.set_data(gzip.compress(data, compresslevel=6))
+            response.headers["Content-Encoding"] = "gzip"
+    return response
+
+
+@app.route("/api/v1/rmas")
+@api_auth_required
+def api_list_rmas():
+    """
+    RMAs newest first, keyset-paginated on rma_id.
+    Accepts the same filters as /rmas plus fields=, limit= and cursor=.
+    """
+    fields, error = api_fields(API_RMA_FIELDS, "rma_id")
+    if error:
+        return api_error(error, 400)
+    limit, cursor, error = api_page_args()
+    if error:
+        return api_error(error, 400)
+
+    filter_sql, params, _ = rma_filters(request.args)
+    if cursor is not None:
+        filter_sql += " AND r.rma_id < %s"
+        params.append(cursor)
+
+    conn = get_db()
+    cur = conn.cursor()
+
+    # 1) Cheap key query: matching ids + row versions for this page
+    cur.execute(
+        f"""
+        SELECT r.rma_id, r.row_version
+        FROM rmas r
+        LEFT JOIN customers c ON r.customer_id = c.customer_id
+        WHERE 1=1 {filter_sql}
+        ORDER BY r.rma_id DESC
+        LIMIT %s
+        """,
+        params + [limit + 1],
+    )
+    keys = cur.fetchall()
+    has_more = len(keys) > limit
+    keys = keys[:limit]
+
+    etag = api_version_etag(*(f"{k['rma_id']}:{k['row_version']}" for k in keys), has_more)
+    not_modified = api_not_modified(etag)
+    if not_modified:
+        conn.close()
+        return not_modified
+
+    # 2) Hydrate only the requested fields for those ids
+    ids = [k["rma_id"] for k in keys]
+    rows = []
+    if ids:
+        cur.execute(
+            f"""
+            SELECT {api_select(fields, API_RMA_FIELDS)}
+            FROM rmas r
+            LEFT JOIN customers c ON r.customer_id = c.customer_id
+            WHERE r.rma_id = ANY(%s)
+            ORDER BY r.rma_id DESC
+            """,
+            (ids,),
+        )
+        rows = api_decode_owners(cur.fetchall())
+    conn.close()
+
+    return api_response(
+        {"data": rows, "next_cursor": ids[-1] if has_more else None},
+        etag=etag,
+    )
+
+
+def api_decode_owners(rows):
+    """SQLite hands json_group_array() back as text; psycopg2 parses json itself."""
+    if DB_DIALECT == "sqlite":
+        for row in rows:
+            if row and isinstance(row.get("owners"), str):
+                row["owners"] = json.loads(row["owners"])
+    return rows
+
+
+def api_rma_version(cur, rma_id):
+    """Row version for one RMA, or None if it doesn't exist."""
+    cur.execute("SELECT row_version FROM rmas WHERE rma_id = %s", (rma_id,))
+    row = cur.fetchone()
+    return row["row_version"] if row else None
+
+
+@app.route("/api/v1/rmas/<int:rma_id>")
+@api_auth_required
+def api_get_rma(rma_id):
+    fields, error = api_fields(API_RMA_FIELDS, "rma_id")
+    if error:
+        return api_error(error, 400)
+
+    conn = get_db()
+    cur = conn.cursor()
+
+    version = api_rma_version(cur, rma_id)
+    if version is None:
+        conn.close()
+        return api_error("RMA not found", 404)
+
+    etag = api_version_etag(rma_id, version)
+    not_modified = api_not_modified(etag)
+    if not_modified:
+        conn.close()
+        return not_modified
+
+    cur.execute(
+        f"""
+        SELECT {api_select(fields, API_RMA_FIELDS)}
+        FROM rmas r
+        LEFT JOIN customers c ON r.customer_id = c.customer_id
+        WHERE r.rma_id = %s
+        """,
+        (rma_id,),
+    )
+    rma = api_decode_owners([cur.fetchone()])[0]
+    conn.close()
+
+    return api_response({"data": rma}, etag=etag)
+
+
+def api_rma_children(rma_id, fetch):
+    """
+    Shared body for the per-RMA sub-resources. Child changes bump the
+    parent's row_version, so the ETag comes from that one lookup and
+    fetch(cur) only runs when the client's copy is stale.
+    """
+    conn = get_db()
+    cur = conn.cursor()
+
+    version = api_rma_version(cur, rma_id)
+    if version is None:
+        conn.close()
+        return api_error("RMA not found", 404)
+
+    etag = api_version_etag(request.path, version)
+    not_modified = api_not_modified(etag)
+    if not_modified:
+        conn.close()
+        return not_modified
+
+    data = fetch(cur)
+    conn.close()
+    return api_response({"data": data}, etag=etag)
+
+
+@app.route("/api/v1/rmas/<int:rma_id>/lines")
+@api_auth_required
+def api_rma_lines(rma_id):
+    """Line items, each with its disposition embedded (or null)."""
+    def fetch(cur):
+        lines = []
+        for row in fetch_rma_lines(cur, rma_id):
+            line = {k: row[k] for k in ["rma_line_id", "rma_id"] + GRID_LINE_FIELDS}
+            line["disposition"] = (
+                {k: row[k] for k in GRID_DISPOSITION_FIELDS + ["date_dispositioned", "disposition_by"]}
+                if row["date_dispositioned"] or row["disposition"]
+                else None
+            )
+            lines.append(line)
+        return lines
+    return api_rma_children(rma_id, fetch)
+
+
+@app.route("/api/v1/rmas/<int:rma_id>/dispositions")
+@api_auth_required
+def api_rma_dispositions(rma_id):
+    def fetch(cur):
+        cur.execute("""
+            SELECT d.*
+            FROM dispositions d
+            JOIN rma_lines rl ON d.rma_line_id = rl.rma_line_id
+            WHERE rl.rma_id = %s
+            ORDER BY d.rma_line_id
+        """, (rma_id,))
+        return cur.fetchall()
+    return api_rma_children(rma_id, fetch)
+
+
+@app.route("/api/v1/rmas/<int:rma_id>/owners")
+@api_auth_required
+def api_rma_owners(rma_id):
+    def fetch(cur):
+        cur.execute("""
+            SELECT 
+                u.user_id,
+                u.full_name,
+                u.email,
+                ro.is_primary,
+                ro.assigned_on,
+                ro.assigned_by
+            FROM rma_owners ro
+            JOIN users u ON ro.user_id = u.user_id
+            WHERE ro.rma_id = %s
+            ORDER BY ro.is_primary DESC, u.full_name
+        """, (rma_id,))
+        return cur.fetchall()
+    return api_rma_children(rma_id, fetch)
+
+
+@app.route("/api/v1/rmas/<int:rma_id>/history")
+@api_auth_required
+def api_rma_history(rma_id):
+    """Status, notes and credit history, newest first."""
+    def fetch(cur):
+        cur.execute("""
+            SELECT 
+                sh.status_hist_id,
+                sh.status,
+                sh.changed_by,
+                u.full_name AS changed_by_name,
+                sh.changed_on,
+                sh.comment
+            FROM status_history sh
+            LEFT JOIN users u ON sh.changed_by = u.user_id
+            WHERE sh.rma_id = %s
+            ORDER BY sh.changed_on DESC
+        """, (rma_id,))
+        status = cur.fetchall()
+
+        cur.execute("""
+            SELECT note_hist_id, notes_content, modified_by, modified_on
+            FROM notes_history
+            WHERE rma_id = %s
+            ORDER BY modified_on DESC
+        """, (rma_id,))
+        notes = cur.fetchall()
+
+        cur.execute("""
+            SELECT credit_hist_id, action, amount, memo_number, action_by, action_on, comment
+            FROM credit_history
+            WHERE rma_id = %s
+            ORDER BY action_on DESC
+        """, (rma_id,))
+        credit = cur.fetchall()
+
+        return {"status": status, "notes": notes, "credit": credit}
+    return api_rma_children(rma_id, fetch)
+
+
+@app.route("/api/v1/customers")
+@api_auth_required
+def api_list_customers():
+    """Customers by customer_id, keyset-paginated; supports fields=, limit=, cursor=."""
+    fields, error = api_fields(API_CUSTOMER_FIELDS, "customer_id")
+    if error:
+        return api_error(error, 400)
+    limit, cursor, error = api_page_args()
+    if error:
+        return api_error(error, 400)
+
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute(
+        f"""
+        SELECT {api_select(fields, API_CUSTOMER_FIELDS)}
+        FROM customers c
+        WHERE c.customer_id > %s
+        ORDER BY c.customer_id
+        LIMIT %s
+        """,
+        (cursor or 0, limit + 1),
+    )
+    rows = cur.fetchall()
+    conn.close()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return api_response({
+        "data": rows,
+        "next_cursor": rows[-1]["customer_id"] if has_more else None,
+    })
+
+
+@app.route("/api/v1/customers/<int:customer_id>")
+@api_auth_required
+def api_get_customer(customer_id):
+    fields, error = api_fields(API_CUSTOMER_FIELDS, "customer_id")
+    if error:
+        return api_error(error, 400)
+
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute(
+        f"SELECT {api_select(fields, API_CUSTOMER_FIELDS)} FROM customers c WHERE c.customer_id = %s",
+        (customer_id,),
+    )
+    customer = cur.fetchone()
+    conn.close()
+
+    if not customer:
+        return api_error("customer not found", 404)
+    return api_response({"data": customer})
+
+
 # ============ CONTEXT PROCESSOR ============
 
 @app.context_processor
 def inject_user():
     return dict(current_user=get_current_user())
 
-ensure_admin_user()
+
+@app.context_processor
+def inject_dev_panel():
+    """Statements run so far in this request, for the dev panel in base.html."""
+    if not (DEV_PANEL or app.debug) or "db_statements" not in g:
+        return dict(dev_queries=None)
+    return dict(
+        dev_queries=g.db_statements,
+        dev_query_count=g.db_count,
+        dev_db_ms=g.db_seconds * 1000,
+        dev_n_plus_one=g.get("n_plus_one", []),
+        # Filled in as the page renders; the outer templates are still open
+        # when the panel is drawn, so only finished includes show up
+        dev_templates=g.template_times,
+    )
+
+
+# ============ STARTUP ============
+#
+# One-time work, kept out of import so it isn't repeated by every gunicorn
+# worker and every frozen-EXE launch. gunicorn.conf.py preloads the app
+# and runs this once in the master before it forks the workers;
+# `flask --app app startup`, python app.py and run_app.py call it directly.
+
+# Columns added by migrate_*.py after the original schema. A missing one
+# means that migration hasn't been run against this database.
+REQUIRED_COLUMNS = {
+    ("rmas", "customer_date_opened"): "migrate_notifications_and_date.py",
+    ("notification_preferences", "notification_time"): "migrate_notifications_and_date.py",
+    ("rmas", "row_version"): "migrate_rma_row_version.py",
+    ("slow_queries", "fingerprint"): "migrate_slow_queries.py",
+    ("request_profiles", "profile_id"): "migrate_request_profiles.py",
+    ("undo_actions", "token"): "migrate_undo_actions.py",
+}
+
+_startup_done = False
+
+
+def check_schema():
+    """Report the Postgres version and any migration the database is missing."""
+    conn = get_db()
+    cur = conn.cursor()
+    if DB_DIALECT == "sqlite":
+        cur.execute("SELECT sqlite_version() AS version")
+        version = f"SQLite {cur.fetchone()['version']}"
+        found = set()
+        for table in {t for t, _ in REQUIRED_COLUMNS}:
+            cur.execute(f"PRAGMA table_info({table})")
+            found.update((table, r["name"]) for r in cur.fetchall())
+    else:
+        cur.execute("SHOW server_version")
+        version = f"Postgres {cur.fetchone()['server_version']}"
+        cur.execute(
+            """
+            SELECT table_name, column_name
+            FROM information_schema.columns
+            WHERE table_schema = current_schema()
+              AND (table_name, column_name) IN %s
+            """,
+            (tuple(REQUIRED_COLUMNS),),
+        )
+        found = {(r["table_name"], r["column_name"]) for r in cur.fetchall()}
+    conn.close()
+
+    missing = sorted({script for col, script in REQUIRED_COLUMNS.items() if col not in found})
+    if missing:
+        print(f"⚠️ Database schema is behind; run: {', '.join(missing)}")
+    return version + (f", {len(missing)} migration(s) missing" if missing else "")
+
+
+def create_sqlite_schema():
+    """Desktop build: create the tables from schema.sql in a new SQLite file."""
+    import db_sqlite
+    db_sqlite.init_schema(get_db(), os.path.join(BASE_DIR, "schema.sql"))
+    return SQLITE_PATH
+
+
+def run_startup_tasks():
+    """
+    Seed the admin user, check the schema and compile the templates, then
+    print how long each took. Runs at most once per process. Failures are
+    reported, not raised, so a database that is still waking up doesn't
+    stop the server from starting.
+    """
+    global _startup_done
+    if _startup_done:
+        return
+    _startup_done = True
+
+    tasks = [
+        ("admin user", ensure_admin_user),
+        ("schema check", check_schema),
+        ("templates", precompile_templates),
+    ]
+    if DB_DIALECT == "sqlite":
+        tasks.insert(0, ("sqlite schema", create_sqlite_schema))
+
+    report = []
+    started = time.perf_counter()
+    for name, task in tasks:
+        t0 = time.perf_counter()
+        try:
+            detail = task() or "ok"
+        except Exception as e:
+            detail = f"FAILED: {e}"
+        report.append((name, (time.perf_counter() - t0) * 1000, detail))
+
+    # Connections opened here must not be inherited by forked workers
+    close_db_pool()
+
+    print(f"Startup tasks done in {(time.perf_counter() - started) * 1000:.0f} ms (pid {os.getpid()})")
+    for name, ms, detail in report:
+        print(f"  {name:<14}{ms:>8.0f} ms  {detail}")
+
+
+@app.cli.command("startup")
+def startup_command():
+    """Run the one-time startup tasks (admin seeding, schema check, warmup)."""
+    run_startup_tasks()
 
 
 if __name__ == "__main__":
-    # Optional: only seed admin locally, Render calls it at import time
-    ensure_admin_user()
+    run_startup_tasks()
     app.run(host="0.0.0.0", port=10000, debug=False)
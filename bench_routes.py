@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Route benchmarks
+
+Runs the hot pages through Flask's test client against a seeded local
+Postgres (see seed_synthetic_data.py) and records, per route:
+  - latency percentiles over --iterations requests (after --warmup)
+  - statements per request, read from the Server-Timing header
+  - Python allocations per request (tracemalloc, in a separate pass so
+    tracing doesn't skew the timings)
+
+Results are written as JSON. With --baseline the run is compared against
+an earlier result: any route whose p95 grows by more than --threshold, or
+that runs more statements than before, is a regression and the script
+exits 1. --save-baseline writes this run as the new baseline.
+
+RMAs created by the new_rma POST case are deleted again at the end.
+
+Usage:
+    DATABASE_URL=postgresql://localhost/rma_bench python bench_routes.py
+    python bench_routes.py --baseline bench_baseline.json [--threshold 0.2]
+    python bench_routes.py --only list_rmas --iterations 200
+"""
+
+import argparse
+import json
+import math
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from app import app, get_db, EMAIL_CONFIG
+
+DEFAULT_RESULTS = "bench_results.json"
+QUERY_COUNT = re.compile(r'desc="(\d+) queries"')
+
+
+def pick_fixtures(cur):
+    """Ids the cases need, chosen from whatever data is loaded."""
+    cur.execute("SELECT user_id FROM users WHERE role = 'admin' ORDER BY user_id LIMIT 1")
+    admin = cur.fetchone()
+    cur.execute("SELECT COUNT(*) AS count FROM rmas")
+    rma_count = cur.fetchone()["count"]
+    if not admin or not rma_count:
+        sys.exit("Need an admin user and some RMAs; run seed_synthetic_data.py first.")
+
+    # A typical detail page: median-sized RMA with lines and history
+    cur.execute("""
+        SELECT r.rma_id
+        FROM rmas r
+        JOIN rma_lines rl ON rl.rma_id = r.rma_id
+        GROUP BY r.rma_id
+        HAVING COUNT(*) BETWEEN 2 AND 3
+        ORDER BY r.rma_id
+        LIMIT 1 OFFSET %s
+    """, (rma_count // 4,))
+    rma = cur.fetchone()
+    cur.execute("SELECT customer_id FROM rmas GROUP BY customer_id ORDER BY COUNT(*) DESC LIMIT 1")
+    customer = cur.fetchone()
+    cur.execute("SELECT user_id FROM rma_owners GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1")
+    owner = cur.fetchone()
+
+    return {
+        "admin_id": admin["user_id"],
+        "rma_id": rma["rma_id"] if rma else 1,
+        "customer_id": customer["customer_id"],
+        "owner_id": owner["user_id"] if owner else admin["user_id"],
+        "rma_count": rma_count,
+    }
+
+
+def build_cases(fx):
+    """(name, method, path, form data) for every benchmarked request."""
+    today = datetime.now().date()
+    month_ago = (today - timedelta(days=30)).isoformat()
+    list_filters = {
+        "none": "",
+        "search": "?search=crack",
+        "status": "?status=In+Progress",
+        "return_type": "?return_type=Credit",
+        "customer": f"?customer_id={fx['customer_id']}",
+        "owner": f"?owner_id={fx['owner_id']}",
+        "date_range": f"?from_date={month_ago}&to_date={today.isoformat()}",
+        "credit_pending": "?credit_approved=pending",
+        "credit_approved": "?credit_approved=approved",
+        "credit_rejected": "?credit_approved=rejected",
+    }
+
+    cases = [("index", "GET", "/", None)]
+    cases += [(f"list_rmas[{name}]", "GET", f"/rmas{qs}", None) for name, qs in list_filters.items()]
+    cases.append(("view_rma", "GET", f"/rmas/{fx['rma_id']}", None))
+    cases += [
+        (f"metrics[{week}]", "GET", f"/metrics?week={week}", None)
+        for week in ("all", "this_week", "last_week", "last_4_weeks")
+    ]
+    cases.append(("credit_dashboard", "GET", "/credits/dashboard", None))
+    cases.append(("list_customers", "GET", "/customers", None))
+    cases.append(("new_rma[POST]", "POST", "/rmas/new", {
+        "customer_id": str(fx["customer_id"]),
+        "return_type": "Credit",
+        "complaint": "Benchmark RMA",
+        "owner_ids": [str(fx["owner_id"])],
+    }))
+    return cases
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    k = math.ceil(pct / 100 * len(sorted_values)) - 1
+    return sorted_values[max(0, min(k, len(sorted_values) - 1))]
+
+
+def send(client, method, path, data, created):
+    resp = client.open(path, method=method, data=data)
+    if resp.status_code >= 400:
+        raise RuntimeError(f"{method} {path} returned {resp.status_code}")
+    if method == "POST":
+        match = re.search(r"/rmas/(\d+)", resp.headers.get("Location", ""))
+        if match:
+            created.append(int(match.group(1)))
+    header = resp.headers.get("Server-Timing", "")
+    match = QUERY_COUNT.search(header)
+    return int(match.group(1)) if match else None
+
+
+def run_case(client, case, warmup, iterations, alloc_iterations, created):
+    name, method, path, data = case
+    for _ in range(warmup):
+        send(client, method, path, data, created)
+
+    timings = []
+    queries = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        count = send(client, method, path, data, created)
+        timings.append((time.perf_counter() - start) * 1000)
+        queries.append(count)
+
+    peaks = []
+    allocated = []
+    tracemalloc.start()
+    try:
+        for _ in range(alloc_iterations):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            send(client, method, path, data, created)
+            current, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+            allocated.append(current - before)
+    finally:
+        tracemalloc.stop()
+
+    timings.sort()
+    return {
+        "method": method,
+        "path": path,
+        "iterations": iterations,
+        "mean_ms": round(statistics.fmean(timings), 2),
+        "p50_ms": round(percentile(timings, 50), 2),
+        "p90_ms": round(percentile(timings, 90), 2),
+        "p95_ms": round(percentile(timings, 95), 2),
+        "p99_ms": round(percentile(timings, 99), 2),
+        "max_ms": round(timings[-1], 2),
+        "queries": max((q for q in queries if q is not None), default=None),
+        "alloc_peak_kb": round(statistics.median(peaks) / 1024, 1) if peaks else None,
+        "alloc_retained_kb": round(statistics.median(allocated) / 1024, 1) if allocated else None,
+    }
+
+
+def compare(results, baseline, threshold):
+    """Print a diff against the baseline; return the names that regressed."""
+    regressions = []
+    print(f"\n{'route':<28}{'p95 base':>10}{'p95 now':>10}{'change':>9}{'queries':>12}")
+    for name, now in results["routes"].items():
+        base = baseline["routes"].get(name)
+        if not base:
+            print(f"{name:<28}{'-':>10}{now['p95_ms']:>10}{'new':>9}")
+            continue
+        change = (now["p95_ms"] - base["p95_ms"]) / base["p95_ms"] if base["p95_ms"] else 0
+        queries = f"{base['queries']}->{now['queries']}"
+        slower = change > threshold
+        more_queries = (now["queries"] or 0) > (base["queries"] or 0)
+        flag = "  REGRESSION" if slower or more_queries else ""
+        print(f"{name:<28}{base['p95_ms']:>10}{now['p95_ms']:>10}{change:>+9.0%}{queries:>12}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the hot RMA routes.")
+    parser.add_argument("--iterations", type=int, default=50, help="timed requests per route")
+    parser.add_argument("--warmup", type=int, default=5, help="untimed requests per route first")
+    parser.add_argument("--alloc-iterations", type=int, default=5, help="requests traced for allocations")
+    parser.add_argument("--only", help="run only routes whose name contains this")
+    parser.add_argument("--output", default=DEFAULT_RESULTS, help="where to write this run's JSON")
+    parser.add_argument("--baseline", help="JSON from an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed p95 growth (0.2 = 20%%)")
+    parser.add_argument("--save-baseline", metavar="PATH", help="also write this run as the baseline")
+    args = parser.parse_args()
+
+    # Never email real owners from a benchmark
+    EMAIL_CONFIG["enabled"] = False
+
+    conn = get_db()
+    fx = pick_fixtures(conn.cursor())
+    conn.close()
+
+    cases = build_cases(fx)
+    if args.only:
+        cases = [c for c in cases if args.only in c[0]]
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["user_id"] = fx["admin_id"]
+        sess["username"] = "bench"
+        sess["full_name"] = "Benchmark"
+
+    print(f"Benchmarking {len(cases)} routes against {fx['rma_count']:,} RMAs "
+          f"({args.iterations} iterations, {args.warmup} warmup)\n")
+    print(f"{'route':<28}{'p50':>9}{'p95':>9}{'p99':>9}{'queries':>9}{'alloc KB':>10}")
+
+    created = []
+    routes = {}
+    try:
+        for case in cases:
+            r = run_case(client, case, args.warmup, args.iterations, args.alloc_iterations, created)
+            routes[case[0]] = r
+            print(f"{case[0]:<28}{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}"
+                  f"{r['queries'] if r['queries'] is not None else '-':>9}{r['alloc_peak_kb']:>10}")
+    finally:
+        if created:
+            conn = get_db()
+            cur = conn.cursor()
+            cur.execute("DELETE FROM rmas WHERE rma_id = ANY(%s)", (created,))
+            conn.commit()
+            conn.close()
+            print(f"\nDeleted {len(created)} benchmark RMAs")
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "run_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "rma_count": fx["rma_count"],
+            "iterations": args.iterations,
+        },
+        "routes": routes,
+    }
+    for path in filter(None, [args.output, args.save_baseline]):
+        with open(path, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {path}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            sys.exit(f"\n❌ {len(regressions)} route(s) regressed: {', '.join(regressions)}")
+        print("\n✅ No regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Serving mode benchmark
+
+Starts gunicorn once per worker class (sync, gthread, gevent) on a local
+port, waits until it answers, runs load_test.py against it with the same
+settings each time, stops it and prints a side-by-side comparison of
+throughput, p95 and error rate. Each mode's full load_test JSON is kept
+as bench_serving_<mode>.json.
+
+Every mode gets the same number of workers; concurrency per worker is
+--threads for gthread and --worker-connections for gevent (sync handles
+one request at a time). The app's connection pool (RMA_DB_POOL_SIZE) is
+passed through unchanged when set; unset, gevent gets one connection per
+worker connection and the other modes the app's default of 20.
+
+Like load_test.py this changes data, so use a throwaway database.
+
+Usage:
+    DATABASE_URL=postgresql://localhost/rma_bench python bench_serving_modes.py
+    python bench_serving_modes.py --modes gthread gevent --users 200 --duration 120
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+MODES = {
+    "sync": lambda a: ["--worker-class", "sync"],
+    "gthread": lambda a: ["--worker-class", "gthread", "--threads", str(a.threads)],
+    "gevent": lambda a: ["--worker-class", "gevent", "--worker-connections", str(a.worker_connections)],
+}
+
+
+def wait_ready(url, proc, timeout):
+    """Poll the login page until the server answers or gives up."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            return False
+        try:
+            urllib.request.urlopen(f"{url}/login", timeout=2).close()
+            return True
+        except urllib.error.HTTPError:
+            return True
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.5)
+    return False
+
+
+def stop(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def run_mode(mode, args):
+    url = f"http://127.0.0.1:{args.port}"
+    cmd = [
+        sys.executable, "-m", "gunicorn", "app:app",
+        "--config", "gunicorn.conf.py",
+        "--bind", f"127.0.0.1:{args.port}",
+        "--workers", str(args.workers),
+        "--timeout", "120",
+        *MODES[mode](args),
+    ]
+    print(f"\n=== {mode}: {' '.join(cmd[3:])}")
+    # gunicorn.conf.py reads the worker class to monkey-patch the preloading master,
+    # and app.py to size the pool for --worker-connections
+    env = dict(os.environ, GUNICORN_WORKER_CLASS=mode, GUNICORN_WORKER_CONNECTIONS=str(args.worker_connections))
+    server = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_ready(url, server, args.startup_timeout):
+            print(f"{mode}: server did not start (is {mode} installed?)")
+            return None
+        output = f"bench_serving_{mode}.json"
+        subprocess.run([
+            sys.executable, "load_test.py",
+            "--url", url,
+            "--users", str(args.users),
+            "--ramp", str(args.ramp),
+            "--duration", str(args.duration),
+            "--think", str(args.think),
+            "--json", output,
+            *args.load_test_args,
+        ], check=True)
+        with open(output) as f:
+            return json.load(f).get("overall")
+    finally:
+        stop(server)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare gunicorn worker classes under the same load.")
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--port", type=int, default=10100)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=32, help="gthread threads per worker")
+    parser.add_argument("--worker-connections", type=int, default=500, help="gevent greenlets per worker")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--ramp", type=float, default=20)
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument("--think", type=float, default=0.5)
+    parser.add_argument("--startup-timeout", type=float, default=30)
+    parser.add_argument("load_test_args", nargs="*", help="passed to load_test.py after --")
+    args = parser.parse_args()
+
+    results = {}
+    for mode in args.modes:
+        results[mode] = run_mode(mode, args)
+
+    print(f"\n{'mode':<10}{'requests':>10}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'err %':>8}")
+    for mode, r in results.items():
+        if not r:
+            print(f"{mode:<10}{'failed':>10}")
+            continue
+        print(f"{mode:<10}{r['requests']:>10}{r['rps']:>9}{r['p50_ms']:>9}"
+              f"{r['p95_ms']:>9}{r['p99_ms']:>9}{r['error_pct']:>8}")
+
+
+if __name__ == "__main__":
+    main()
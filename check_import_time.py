@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Import-time budget
+
+Imports app.py in a fresh interpreter under `python -X importtime` (best
+of --runs, to ride out disk cache noise) and exits 1 when:
+  - importing app takes longer than --budget-ms in total, or
+  - a module that app.py only loads on first use (LAZY_MODULES) was
+    imported eagerly, by app.py or by something it imports.
+
+The slowest imports are listed either way, so a regression points at its
+cause. Importing app must not touch the database (startup work lives in
+run_startup_tasks()), so no DATABASE_URL is needed.
+
+Usage:
+    python check_import_time.py
+    python check_import_time.py --budget-ms 600 --top 25
+"""
+
+import argparse
+import subprocess
+import sys
+
+# Loaded inside the functions that need them (email, profiler, exports,
+# gevent mode, the desktop SQLite backend); seeing one at import means
+# someone hoisted it again.
+LAZY_MODULES = ["smtplib", "email.mime", "cProfile", "pstats", "openpyxl", "gevent", "db_sqlite", "sqlite3"]
+
+
+def measure():
+    """{module: (self_us, cumulative_us)} for one `import app`."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        sys.exit(f"import app failed:\n{proc.stderr[-2000:]}")
+    modules = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fail if importing app.py gets slower than the budget.")
+    parser.add_argument("--budget-ms", type=float, default=1000, help="allowed total import time")
+    parser.add_argument("--runs", type=int, default=5, help="imports to take the best of")
+    parser.add_argument("--top", type=int, default=15, help="slowest imports to list")
+    args = parser.parse_args()
+
+    best = min((measure() for _ in range(args.runs)), key=lambda m: m["app"][1])
+    total_ms = best["app"][1] / 1000
+
+    print(f"{'module':<48}{'self ms':>9}{'cumul ms':>10}")
+    slowest = sorted(best.items(), key=lambda kv: kv[1][0], reverse=True)[:args.top]
+    for name, (self_us, cumulative_us) in slowest:
+        print(f"{name:<48}{self_us / 1000:>9.1f}{cumulative_us / 1000:>10.1f}")
+
+    failures = []
+    eager = sorted(
+        name for name in best
+        if any(name == lazy or name.startswith(lazy + ".") for lazy in LAZY_MODULES)
+    )
+    if eager:
+        failures.append(f"imported eagerly: {', '.join(eager)}")
+    if total_ms > args.budget_ms:
+        failures.append(f"import app took {total_ms:.0f} ms, budget {args.budget_ms:.0f} ms")
+
+    print(f"\nimport app: {total_ms:.0f} ms (best of {args.runs}), budget {args.budget_ms:.0f} ms")
+    if failures:
+        sys.exit("\n".join(f"❌ {f}" for f in failures))
+    print("✅ Within budget")
+
+
+if __name__ == "__main__":
+    main()
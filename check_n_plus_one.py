@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+N+1 query check
+
+Runs the key pages through Flask's test client with the N+1 detector in
+raise mode (N_PLUS_ONE_RAISE, see app.py) and exits 1 if any of them runs
+the same statement more than --threshold times in one request. The report
+names the statement and the app stack that issued it.
+
+Checked: RMA list (unfiltered and filtered), RMA detail, new_rma (POST),
+update_owners (POST, on the RMA new_rma just created) and metrics for
+every week option. The created RMA is deleted again at the end.
+
+Needs a seeded database like bench_routes.py (an admin user and RMAs).
+
+Usage:
+    DATABASE_URL=postgresql://localhost/rma_bench python check_n_plus_one.py
+    python check_n_plus_one.py --threshold 3
+"""
+
+import argparse
+import re
+import sys
+
+from app import app, get_db, EMAIL_CONFIG, NPlusOneError
+from bench_routes import pick_fixtures
+
+
+def build_cases(fx):
+    """(name, method, path, form data); "{new}" is the RMA created by new_rma."""
+    cases = [
+        ("list_rmas", "GET", "/rmas", None),
+        ("list_rmas[status]", "GET", "/rmas?status=In+Progress", None),
+        ("list_rmas[owner]", "GET", f"/rmas?owner_id={fx['owner_id']}", None),
+        ("view_rma", "GET", f"/rmas/{fx['rma_id']}", None),
+        ("new_rma[POST]", "POST", "/rmas/new", {
+            "customer_id": str(fx["customer_id"]),
+            "return_type": "Credit",
+            "complaint": "N+1 check RMA",
+            "owner_ids": [str(fx["owner_id"])],
+        }),
+        ("update_owners[POST]", "POST", "/rmas/{new}/owners/update", {
+            "owner_ids": [str(fx["admin_id"]), str(fx["owner_id"])],
+        }),
+    ]
+    cases += [
+        (f"metrics[{week}]", "GET", f"/metrics?week={week}", None)
+        for week in ("all", "this_week", "last_week", "last_4_weeks")
+    ]
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fail if a key page runs the same statement too often.")
+    parser.add_argument("--threshold", type=int, default=5, help="allowed runs of one statement per request")
+    args = parser.parse_args()
+
+    # Raise at the offending execute() and let it reach us instead of a 500 page
+    app.config.update(N_PLUS_ONE_THRESHOLD=args.threshold, N_PLUS_ONE_RAISE=True, TESTING=True)
+    # Never email real owners from a check
+    EMAIL_CONFIG["enabled"] = False
+
+    conn = get_db()
+    fx = pick_fixtures(conn.cursor())
+    conn.close()
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["user_id"] = fx["admin_id"]
+        sess["username"] = "n_plus_one_check"
+        sess["full_name"] = "N+1 Check"
+
+    created = []
+    failures = []
+    try:
+        for name, method, path, data in build_cases(fx):
+            if "{new}" in path:
+                if not created:
+                    print(f"{name:<28}skipped (new_rma created nothing)")
+                    continue
+                path = path.format(new=created[-1])
+            try:
+                resp = client.open(path, method=method, data=data)
+            except NPlusOneError as e:
+                failures.append(name)
+                print(f"{name:<28}N+1\n{e}\n")
+                continue
+            if resp.status_code >= 400:
+                failures.append(name)
+                print(f"{name:<28}HTTP {resp.status_code}")
+                continue
+            if method == "POST":
+                match = re.search(r"/rmas/(\d+)", resp.headers.get("Location", ""))
+                if match and name.startswith("new_rma"):
+                    created.append(int(match.group(1)))
+            print(f"{name:<28}ok")
+    finally:
+        if created:
+            conn = get_db()
+            cur = conn.cursor()
+            cur.execute("DELETE FROM rmas WHERE rma_id = ANY(%s)", (created,))
+            conn.commit()
+            conn.close()
+
+    if failures:
+        sys.exit(f"\n❌ {len(failures)} page(s) failed: {', '.join(failures)}")
+    print(f"\n✅ No statement ran more than {args.threshold} times per request")
+
+
+if __name__ == "__main__":
+    main()
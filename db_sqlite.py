@@ -0,0 +1,330 @@
+"""
+SQLite backend for the desktop build
+
+app.py is written against psycopg2. With DATABASE_URL=sqlite:///path/to.db,
+get_db() hands out the connection from this module instead. It has the
+same surface the routes use: cursor(), execute() with %s / %(name)s
+placeholders, dict rows, commit/rollback/close, RETURNING, and
+execute_values().
+
+  - One connection per thread, opened once and reused; close() only ends
+    the transaction. WAL mode lets the page reads run while a write commits.
+  - Statements are translated from the Postgres dialect once (lru_cache),
+    and sqlite3 keeps the compiled statements (cached_statements), so a
+    repeated query is neither re-translated nor re-prepared.
+  - translate() covers the constructs the routes share: ILIKE, ::casts,
+    = ANY(array), single-array unnest(), string_agg (DISTINCT), NOW(),
+    FOR UPDATE, IS DISTINCT FROM, UPDATE aliases, json_build_object.
+    Anything else (EXTRACT(EPOCH ...), multi-array unnest, COPY, LISTEN)
+    has a dialect-specific branch in app.py.
+  - List parameters are bound as JSON arrays, which is what the
+    translated ANY/unnest read through json_each().
+
+init_schema() creates the tables from schema.sql on a new database file.
+"""
+
+import functools
+import json
+import re
+import sqlite3
+import threading
+from datetime import date, datetime, time
+from decimal import Decimal
+from time import perf_counter
+
+CACHED_STATEMENTS = 256      # compiled statements kept per connection
+BUSY_TIMEOUT_MS = 5000       # wait this long for another writer before "database is locked"
+MAX_VARIABLES = 999          # SQLite's bind-parameter limit on older builds
+
+_local = threading.local()
+
+
+# ---------- Types ----------
+#
+# Columns come back as the same Python types psycopg2 would return, based on
+# their declared type (PARSE_DECLTYPES). Computed columns stay as stored text.
+
+def _converter(parse):
+    def convert(raw):
+        text = raw.decode("utf-8")
+        try:
+            return parse(text)
+        except ValueError:
+            return text
+    return convert
+
+
+sqlite3.register_converter("TIMESTAMP", _converter(datetime.fromisoformat))
+sqlite3.register_converter("DATE", _converter(lambda s: date.fromisoformat(s[:10])))
+sqlite3.register_converter("TIME", _converter(time.fromisoformat))
+sqlite3.register_converter("NUMERIC", _converter(Decimal))
+sqlite3.register_converter("BOOLEAN", lambda raw: raw not in (b"0", b""))
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date, time)):
+        return _adapt(value)
+    return str(value)
+
+
+def _adapt(value):
+    """Python value -> something sqlite3 binds the way psycopg2 would have."""
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ")
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (list, tuple, dict)):
+        return json.dumps(value, default=_json_default)
+    return value
+
+
+def _adapt_params(params):
+    if params is None:
+        return ()
+    if isinstance(params, dict):
+        return {k: _adapt(v) for k, v in params.items()}
+    return tuple(_adapt(v) for v in params)
+
+
+# ---------- Dialect translation ----------
+
+_CAST = re.compile(r"::\s*[a-z_]+(?:\s*\(\s*\d+(?:\s*,\s*\d+)?\s*\))?(?:\[\])?", re.I)
+_ANY = re.compile(r"=\s*ANY\s*\(\s*(%s|%\(\w+\)s)\s*\)", re.I)
+_UNNEST = re.compile(r"unnest\s*\(\s*(%s|%\(\w+\)s)\s*\)\s+AS\s+(\w+)(?:\s*\(\s*(\w+)\s*\))?", re.I)
+_UPDATE_ALIAS = re.compile(r"\bUPDATE\s+(\w+)\s+(?!SET\b)(\w+)\s+SET\b", re.I)
+_PLACEHOLDER = re.compile(r"%%|%\((\w+)\)s|%s")
+
+
+def _unnest(match):
+    param, alias, column = match.groups()
+    return f"(SELECT value AS {column or alias} FROM json_each({param})) AS {alias}"
+
+
+def _placeholder(match):
+    if match.group(0) == "%%":
+        return "%"
+    if match.group(1):
+        return f":{match.group(1)}"
+    return "?"
+
+
+@functools.lru_cache(maxsize=1024)
+def translate(sql, has_params=True):
+    """
+    Postgres statement -> SQLite statement (see the module docstring).
+    Like psycopg2, %-placeholders and %% are only processed when the
+    statement has parameters.
+    """
+    sql = _CAST.sub("", sql)
+    sql = _ANY.sub(r"IN (SELECT value FROM json_each(\1))", sql)
+    sql = _UNNEST.sub(_unnest, sql)
+    sql = _UPDATE_ALIAS.sub(r"UPDATE \1 AS \2 SET", sql)
+    sql = re.sub(r"\bILIKE\b", "LIKE", sql, flags=re.I)
+    sql = re.sub(r"\bIS\s+NOT\s+DISTINCT\s+FROM\b", "IS", sql, flags=re.I)
+    sql = re.sub(r"\bIS\s+DISTINCT\s+FROM\b", "IS NOT", sql, flags=re.I)
+    sql = re.sub(r"\s+FOR\s+UPDATE\b", "", sql, flags=re.I)
+    sql = re.sub(r"\bNOW\(\)", "datetime('now', 'localtime')", sql, flags=re.I)
+    sql = re.sub(r"\bstring_agg\s*\(\s*DISTINCT\b", "string_agg_distinct(", sql, flags=re.I)
+    sql = re.sub(r"\bjson_build_object\s*\(", "json_object(", sql, flags=re.I)
+    sql = re.sub(r"\bjson_agg\s*\(", "json_group_array(", sql, flags=re.I)
+    return _PLACEHOLDER.sub(_placeholder, sql) if has_params else sql
+
+
+class StringAgg:
+    """string_agg(value, separator); NULLs are skipped, like Postgres."""
+
+    distinct = False
+
+    def __init__(self):
+        self.values = []
+        self.separator = ","
+
+    def step(self, value, separator):
+        if value is None:
+            return
+        self.separator = separator
+        value = str(value)
+        if not (self.distinct and value in self.values):
+            self.values.append(value)
+
+    def finalize(self):
+        return self.separator.join(self.values) if self.values else None
+
+
+class StringAggDistinct(StringAgg):
+    """string_agg(DISTINCT value, separator); first-seen order."""
+
+    distinct = True
+
+
+# ---------- Connection / cursor ----------
+
+class Cursor:
+    """psycopg2-style cursor: dict rows, %s placeholders, list parameters."""
+
+    def __init__(self, conn, on_query=None):
+        self.connection = conn
+        self._cur = conn.raw.cursor()
+        self._on_query = on_query
+        self.itersize = 2000    # accepted for named (server-side) cursor callers
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount
+
+    @property
+    def description(self):
+        return self._cur.description
+
+    @property
+    def lastrowid(self):
+        return self._cur.lastrowid
+
+    def execute(self, query, vars=None):
+        start = perf_counter()
+        try:
+            self._cur.execute(translate(query, vars is not None), _adapt_params(vars))
+            return None
+        finally:
+            if self._on_query:
+                self._on_query(query, vars, perf_counter() - start, self._cur.rowcount)
+
+    def executemany(self, query, vars_list):
+        start = perf_counter()
+        try:
+            self._cur.executemany(translate(query), [_adapt_params(v) for v in vars_list])
+        finally:
+            if self._on_query:
+                self._on_query(query, None, perf_counter() - start, self._cur.rowcount)
+
+    def execute_values(self, sql, argslist, template=None, page_size=100, fetch=False):
+        """psycopg2.extras.execute_values: `VALUES %s` expanded to many rows."""
+        argslist = list(argslist)
+        if not argslist:
+            return [] if fetch else None
+        width = len(argslist[0])
+        template = template or "(" + ", ".join(["%s"] * width) + ")"
+
+        # "(VALUES %s) AS v(a, b)" -> SQLite names VALUES columns column1, column2, ...
+        def name_columns(m):
+            columns = [c.strip() for c in m.group(2).split(",")]
+            select = ", ".join(f"column{i} AS {c}" for i, c in enumerate(columns, 1))
+            return f"(SELECT {select} FROM (VALUES %s)) AS {m.group(1)}"
+
+        sql = re.sub(r"\(\s*VALUES\s+%s\s*\)\s+AS\s+(\w+)\s*\(([^)]*)\)", name_columns, sql, flags=re.I)
+        before, after = re.split(r"(?<!%)%s", sql, maxsplit=1)
+
+        # RETURNING order isn't guaranteed for multi-row VALUES, so rows
+        # that need their results back go one statement each
+        page_size = 1 if fetch else max(1, min(page_size, MAX_VARIABLES // width))
+        results = []
+        for i in range(0, len(argslist), page_size):
+            page = argslist[i:i + page_size]
+            self.execute(
+                before + ", ".join([template] * len(page)) + after,
+                [v for row in page for v in row],
+            )
+            if fetch:
+                results.extend(self.fetchall())
+        return results if fetch else None
+
+    def _row(self, row):
+        if row is None:
+            return None
+        return {d[0]: v for d, v in zip(self._cur.description, row)}
+
+    def fetchone(self):
+        return self._row(self._cur.fetchone())
+
+    def fetchmany(self, size=None):
+        rows = self._cur.fetchmany(size or self.itersize)
+        return [self._row(r) for r in rows]
+
+    def fetchall(self):
+        return [self._row(r) for r in self._cur.fetchall()]
+
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany()
+            if not rows:
+                return
+            yield from rows
+
+    def close(self):
+        self._cur.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Connection:
+    """
+    The thread's SQLite connection behind a psycopg2-like face. close()
+    rolls back anything uncommitted (as closing a psycopg2 connection
+    would) but keeps the file open for the thread's next request.
+    """
+
+    closed = False
+
+    def __init__(self, path, on_query=None):
+        self.raw = sqlite3.connect(
+            path,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            cached_statements=CACHED_STATEMENTS,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+        )
+        self.raw.execute("PRAGMA journal_mode = WAL")
+        self.raw.execute("PRAGMA synchronous = NORMAL")    # safe with WAL; fsync per checkpoint
+        self.raw.execute("PRAGMA foreign_keys = ON")
+        self.raw.create_aggregate("string_agg", 2, StringAgg)
+        self.raw.create_aggregate("string_agg_distinct", 2, StringAggDistinct)
+        self.on_query = on_query
+
+    def cursor(self, name=None, cursor_factory=None):
+        return Cursor(self, self.on_query)
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    def close(self):
+        if self.raw.in_transaction:
+            self.raw.rollback()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+
+def connect(path, on_query=None):
+    """This thread's connection to `path`, opened on first use."""
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(path)
+    if conn is None:
+        conn = conns[path] = Connection(path, on_query)
+    return conn
+
+
+def init_schema(conn, schema_path):
+    """Create any missing tables from schema.sql (Postgres DDL, translated)."""
+    with open(schema_path, encoding="utf-8") as f:
+        ddl = f.read()
+    ddl = re.sub(r"\bSERIAL\s+PRIMARY\s+KEY\b", "INTEGER PRIMARY KEY AUTOINCREMENT", ddl, flags=re.I)
+    ddl = re.sub(r"\bDEFAULT\s+NOW\(\)", "DEFAULT (datetime('now', 'localtime'))", ddl, flags=re.I)
+    ddl = re.sub(r"\bDOUBLE\s+PRECISION\b", "REAL", ddl, flags=re.I)
+    ddl = re.sub(r"\bBYTEA\b", "BLOB", ddl, flags=re.I)
+    conn.raw.executescript(ddl)
@@ -0,0 +1,59 @@
+# Gunicorn config: preloading and hooks (worker settings stay on the command line in startup.sh)
+import os
+import sys
+
+if os.environ.get("GUNICORN_WORKER_CLASS") == "gevent":
+    # The app is imported in the master now (preload_app), so patch before
+    # it creates any locks or sockets, not later in each worker.
+    from gevent import monkey
+    monkey.patch_all()
+
+# Import the app once in the master and fork workers from it, so imports,
+# compiled templates and the startup tasks below aren't paid per worker.
+preload_app = True
+
+
+def on_starting(server):
+    # gthread: every open /events stream holds a worker thread, so the
+    # per-worker stream cap must leave threads for ordinary requests.
+    # Unset, it's half the threads; set at or above the thread count, refuse
+    # to start (gunicorn prints the RuntimeError and exits).
+    threads = server.cfg.threads
+    if server.cfg.worker_class_str not in ("gthread", "sync") or threads < 2:
+        return
+    cap = os.environ.get("LIVE_MAX_CLIENTS")
+    if cap is None:
+        cap = os.environ["LIVE_MAX_CLIENTS"] = str(threads // 2)    # workers that import app later
+        if "app" in sys.modules:    # already imported here by preload_app
+            sys.modules["app"].LIVE_MAX_CLIENTS = int(cap)
+    if int(cap) >= threads:
+        raise RuntimeError(
+            f"LIVE_MAX_CLIENTS={cap} leaves no threads for ordinary requests "
+            f"(--threads {threads}); set it below the thread count"
+        )
+
+
+def when_ready(server):
+    # One-time work (admin seeding, schema check, template warmup). It closes
+    # its pooled connections again, so no worker inherits a Postgres socket.
+    from app import run_startup_tasks
+    run_startup_tasks()
+
+
+def child_exit(server, worker):
+    # Drop a dead worker's live gauges (in-flight requests, open connections)
+    # so /ops/metrics doesn't keep counting them.
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_worker_init(worker):
+    # gevent workers: psycopg2 must yield to the hub while it waits on
+    # Postgres, or one slow query blocks every greenlet in the worker.
+    if "gevent" not in type(worker).__module__:
+        return
+    from app import make_db_green
+    make_db_green()
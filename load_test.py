@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+Multi-user load test
+
+Drives a running instance over HTTP with virtual quality engineers, each
+logged in with its own session and looping through weighted journeys:
+
+  browse   (40)  index -> list_rmas (random filter) -> view_rma x2
+  triage   (25)  list_rmas by status -> view_rma -> change_status -> view_rma
+  notes    (15)  view_rma -> update_notes
+  upload   (10)  view_rma -> add_attachment
+  metrics  (10)  index -> metrics (random week)
+
+Users start one by one over --ramp seconds up to --users, then hold for
+--duration. Every --interval seconds a line shows active users,
+throughput, p95 and error rate; at the end there is a table per step
+(requests, req/s, error %, p50/p95/p99/max). --json writes it all out.
+
+Logins and target RMAs come from DATABASE_URL: the users that
+seed_synthetic_data.py created (shared --password), or one --username
+for everybody. The run changes statuses and notes and uploads files, so
+point it at a throwaway database, never production.
+
+Usage:
+    gunicorn app:app --workers 2 ...   # or python app.py
+    python load_test.py --url http://127.0.0.1:10000 --users 40 --ramp 60 --duration 300
+"""
+
+import argparse
+import http.cookiejar
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+DATABASE_URL = os.environ.get("DATABASE_URL")
+
+JOURNEYS = {"browse": 40, "triage": 25, "notes": 15, "upload": 10, "metrics": 10}
+
+LIST_FILTERS = [
+    {},
+    {"status": "In Progress"},
+    {"status": "Acknowledged"},
+    {"return_type": "Credit"},
+    {"credit_approved": "pending"},
+    {"search": "crack"},
+]
+OPEN_STATUSES = ["Acknowledged", "In Progress", "Disposition"]
+WEEKS = ["all", "this_week", "last_week", "last_4_weeks"]
+NOTES = [
+    "Load test: samples requested.",
+    "Load test: containment confirmed.",
+    "Load test: waiting on customer reply.",
+]
+
+
+def load_fixtures(database_url, username, rma_sample):
+    """Logins and RMA ids to work on."""
+    conn = psycopg2.connect(database_url)
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    if username:
+        logins = [username]
+    else:
+        cur.execute("SELECT username FROM users WHERE username LIKE 'synth%' ORDER BY user_id")
+        logins = [r["username"] for r in cur.fetchall()]
+    cur.execute("""
+        SELECT rma_id FROM rmas
+        WHERE status NOT IN ('Closed', 'Rejected')
+        ORDER BY random()
+        LIMIT %s
+    """, (rma_sample,))
+    rma_ids = [r["rma_id"] for r in cur.fetchall()]
+    conn.close()
+    if not logins or not rma_ids:
+        sys.exit("No users/open RMAs found; run seed_synthetic_data.py or pass --username.")
+    return logins, rma_ids
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0
+    k = math.ceil(pct / 100 * len(sorted_values)) - 1
+    return sorted_values[max(0, min(k, len(sorted_values) - 1))]
+
+
+def multipart(fields, filename, content):
+    """multipart/form-data body with one file field named 'file'."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        )
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f"Content-Type: application/octet-stream\r\n\r\n".encode()
+        + content + b"\r\n"
+    )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Report redirects instead of following them, so each step is one request."""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class Stats:
+    """Every request's (time, step, ms, ok), shared by all virtual users."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = []
+        self.active = 0
+
+    def record(self, step, ms, ok):
+        with self.lock:
+            self.records.append((time.time(), step, ms, ok))
+
+    def since(self, start_index):
+        with self.lock:
+            return self.records[start_index:], len(self.records)
+
+
+class VirtualUser(threading.Thread):
+    def __init__(self, n, args, login, rma_ids, stats, stop):
+        super().__init__(name=f"vu-{n}", daemon=True)
+        self.args = args
+        self.login = login
+        self.rma_ids = rma_ids
+        self.stats = stats
+        self.stop = stop
+        self.rng = random.Random(args.seed + n)
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect()
+        )
+
+    def request(self, step, method, path, form=None, body=None, content_type=None):
+        """One timed request. Returns True on success (2xx/3xx, not bounced to /login)."""
+        url = self.args.url.rstrip("/") + path
+        if form is not None:
+            body = urllib.parse.urlencode(form).encode()
+            content_type = "application/x-www-form-urlencoded"
+        req = urllib.request.Request(url, data=body, method=method)
+        if content_type:
+            req.add_header("Content-Type", content_type)
+
+        start = time.perf_counter()
+        ok = True
+        try:
+            with self.opener.open(req, timeout=self.args.timeout) as resp:
+                resp.read()
+        except urllib.error.HTTPError as e:
+            e.read()
+            location = e.headers.get("Location", "")
+            ok = e.code < 400 and "/login" not in location
+        except (urllib.error.URLError, OSError):
+            ok = False
+        self.stats.record(step, (time.perf_counter() - start) * 1000, ok)
+        return ok
+
+    def think(self):
+        self.stop.wait(self.rng.expovariate(1 / self.args.think) if self.args.think else 0)
+
+    def run(self):
+        with self.stats.lock:
+            self.stats.active += 1
+        try:
+            if not self.request("login", "POST", "/login",
+                                form={"username": self.login, "password": self.args.password}):
+                return
+            journeys, weights = list(JOURNEYS), list(JOURNEYS.values())
+            while not self.stop.is_set():
+                getattr(self, "journey_" + self.rng.choices(journeys, weights)[0])()
+        finally:
+            with self.stats.lock:
+                self.stats.active -= 1
+
+    def view(self, rma_id):
+        self.request("view_rma", "GET", f"/rmas/{rma_id}")
+        self.think()
+
+    def journey_browse(self):
+        self.request("index", "GET", "/")
+        self.think()
+        qs = urllib.parse.urlencode(self.rng.choice(LIST_FILTERS))
+        self.request("list_rmas", "GET", f"/rmas?{qs}")
+        self.think()
+        for rma_id in self.rng.choices(self.rma_ids, k=2):
+            self.view(rma_id)
+
+    def journey_triage(self):
+        qs = urllib.parse.urlencode({"status": self.rng.choice(OPEN_STATUSES)})
+        self.request("list_rmas", "GET", f"/rmas?{qs}")
+        self.think()
+        rma_id = self.rng.choice(self.rma_ids)
+        self.view(rma_id)
+        self.request("change_status", "POST", f"/rmas/{rma_id}/status", form={
+            "status": self.rng.choice(OPEN_STATUSES),
+            "comment": "load test",
+        })
+        self.think()
+        self.view(rma_id)
+
+    def journey_notes(self):
+        rma_id = self.rng.choice(self.rma_ids)
+        self.view(rma_id)
+        self.request("update_notes", "POST", f"/rmas/{rma_id}/notes",
+                     form={"internal_notes": self.rng.choice(NOTES)})
+        self.think()
+
+    def journey_upload(self):
+        rma_id = self.rng.choice(self.rma_ids)
+        self.view(rma_id)
+        content = self.rng.randbytes(self.args.upload_kb * 1024)
+        body, content_type = multipart({}, f"loadtest_{uuid.uuid4().hex[:8]}.bin", content)
+        self.request("add_attachment", "POST", f"/rmas/{rma_id}/attachments/add",
+                     body=body, content_type=content_type)
+        self.think()
+
+    def journey_metrics(self):
+        self.request("index", "GET", "/")
+        self.think()
+        self.request("metrics", "GET", f"/metrics?week={self.rng.choice(WEEKS)}")
+        self.think()
+
+
+def summarize(records, seconds):
+    """Per-step table rows from a list of records."""
+    steps = {}
+    for _, step, ms, ok in records:
+        s = steps.setdefault(step, {"ms": [], "errors": 0})
+        s["ms"].append(ms)
+        s["errors"] += not ok
+    out = {}
+    for step, s in sorted(steps.items()):
+        ms = sorted(s["ms"])
+        out[step] = {
+            "requests": len(ms),
+            "rps": round(len(ms) / seconds, 2) if seconds else 0,
+            "error_pct": round(100 * s["errors"] / len(ms), 2),
+            "p50_ms": round(percentile(ms, 50), 1),
+            "p95_ms": round(percentile(ms, 95), 1),
+            "p99_ms": round(percentile(ms, 99), 1),
+            "max_ms": round(ms[-1], 1),
+        }
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a running RMA instance with weighted user journeys.")
+    parser.add_argument("--url", default="http://127.0.0.1:10000", help="base URL of the running app")
+    parser.add_argument("--users", type=int, default=40, help="concurrent virtual users at full load")
+    parser.add_argument("--ramp", type=float, default=60, help="seconds to start all users")
+    parser.add_argument("--duration", type=float, default=300, help="seconds to hold full load")
+    parser.add_argument("--think", type=float, default=1.0, help="mean think time between steps (s)")
+    parser.add_argument("--interval", type=float, default=10, help="seconds between progress lines")
+    parser.add_argument("--timeout", type=float, default=30, help="per-request timeout (s)")
+    parser.add_argument("--upload-kb", type=int, default=200, help="size of uploaded files")
+    parser.add_argument("--username", help="log every virtual user in as this account")
+    parser.add_argument("--password", default="Synthetic123!")
+    parser.add_argument("--rma-sample", type=int, default=2000, help="open RMAs to spread work over")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--database-url", default=DATABASE_URL, help="for logins/RMA ids (default: $DATABASE_URL)")
+    parser.add_argument("--json", metavar="PATH", help="write the results here")
+    args = parser.parse_args()
+
+    if not args.database_url:
+        sys.exit("DATABASE_URL is not set.")
+    logins, rma_ids = load_fixtures(args.database_url, args.username, args.rma_sample)
+
+    stats = Stats()
+    stop = threading.Event()
+    users = []
+    started = time.time()
+    full_load_at = started + args.ramp
+    ends_at = full_load_at + args.duration
+    seen = 0
+    timeline = []
+    next_report = started + args.interval
+
+    print(f"{args.users} users over {args.ramp:.0f}s, then {args.duration:.0f}s at full load -> {args.url}\n")
+    print(f"{'t (s)':>7}{'users':>7}{'req/s':>9}{'p95 ms':>9}{'err %':>8}")
+    try:
+        while time.time() < ends_at:
+            # Start users on a straight line up to --users at --ramp seconds
+            due = args.users if args.ramp <= 0 else min(
+                args.users, int(args.users * (time.time() - started) / args.ramp) + 1
+            )
+            while len(users) < due:
+                vu = VirtualUser(len(users), args, logins[len(users) % len(logins)], rma_ids, stats, stop)
+                vu.start()
+                users.append(vu)
+
+            if time.time() >= next_report:
+                recent, seen = stats.since(seen)
+                ms = sorted(r[2] for r in recent)
+                errors = sum(not r[3] for r in recent)
+                line = {
+                    "t": round(time.time() - started),
+                    "users": stats.active,
+                    "rps": round(len(recent) / args.interval, 1),
+                    "p95_ms": round(percentile(ms, 95), 1),
+                    "error_pct": round(100 * errors / len(recent), 2) if recent else 0,
+                }
+                timeline.append(line)
+                print(f"{line['t']:>7}{line['users']:>7}{line['rps']:>9}{line['p95_ms']:>9}{line['error_pct']:>8}")
+                next_report += args.interval
+            time.sleep(0.1)
+    except KeyboardInterrupt:
+        print("\nStopping early...")
+    finally:
+        stop.set()
+        for vu in users:
+            vu.join(timeout=args.timeout)
+
+    # The per-step table covers the full-load window only, not the ramp
+    elapsed = time.time() - started
+    steady = [r for r in stats.records if r[0] >= full_load_at]
+    steady_seconds = max(0.001, min(time.time(), ends_at) - full_load_at)
+    window = steady or stats.records
+    seconds = steady_seconds if steady else elapsed
+    steps = summarize(window, seconds)
+    overall = summarize([(t, "all", ms, ok) for t, _, ms, ok in window], seconds).get("all")
+
+    print(f"\n{'step':<16}{'requests':>10}{'req/s':>9}{'err %':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for step, s in steps.items():
+        print(f"{step:<16}{s['requests']:>10}{s['rps']:>9}{s['error_pct']:>8}"
+              f"{s['p50_ms']:>9}{s['p95_ms']:>9}{s['p99_ms']:>9}{s['max_ms']:>9}")
+    if overall:
+        print(f"\n{overall['requests']} requests, {overall['rps']} req/s, "
+              f"p95 {overall['p95_ms']} ms, {overall['error_pct']:.2f}% errors")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            settings = {k: v for k, v in vars(args).items() if k not in ("password", "database_url")}
+            json.dump({"settings": settings, "timeline": timeline, "steps": steps, "overall": overall},
+                      f, indent=2)
+        print(f"Wrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Migration script to:
+1. Remove duplicate dispositions (keep the newest per line)
+2. Add a UNIQUE constraint on dispositions.rma_line_id so the app can
+   upsert with INSERT ... ON CONFLICT (rma_line_id)
+"""
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+import os
+
+DATABASE_URL = os.environ.get("DATABASE_URL")
+
+def migrate():
+    conn = psycopg2.connect(DATABASE_URL)
+    conn.autocommit = False
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    
+    try:
+        print("Starting migration...")
+        
+        # 1. Keep only the most recent disposition for each line
+        print("Removing duplicate dispositions...")
+        cur.execute("""
+            DELETE FROM dispositions d
+            USING dispositions newer
+            WHERE newer.rma_line_id = d.rma_line_id
+              AND newer.disposition_id > d.disposition_id;
+        """)
+        print(f"  removed {cur.rowcount} duplicate row(s)")
+        
+        # 2. Add the unique constraint (skip if it already exists)
+        print("Adding uq_dispositions_line constraint...")
+        cur.execute("""
+            SELECT 1 FROM pg_constraint WHERE conname = 'uq_dispositions_line';
+        """)
+        if not cur.fetchone():
+            cur.execute("""
+                ALTER TABLE dispositions
+                ADD CONSTRAINT uq_dispositions_line UNIQUE (rma_line_id);
+            """)
+        
+        conn.commit()
+        print("Migration completed successfully!")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"Migration failed: {e}")
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,60 @@
+"""
+Migration script to:
+1. Create the request_profiles table (filled by the request profiler in
+   app.py, shown on /admin/profiles)
+"""
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+import os
+
+DATABASE_URL = os.environ.get("DATABASE_URL")
+
+def migrate():
+    conn = psycopg2.connect(DATABASE_URL)
+    conn.autocommit = False
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    
+    try:
+        print("Starting migration...")
+        
+        print("Creating request_profiles table...")
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS request_profiles (
+                profile_id      SERIAL PRIMARY KEY,
+                captured_at     TIMESTAMP NOT NULL DEFAULT NOW(),
+                mode            TEXT NOT NULL,
+                trigger         TEXT NOT NULL,
+                requested_by    TEXT,
+                method          TEXT,
+                path            TEXT,
+                route           TEXT,
+                endpoint        TEXT,
+                status          INTEGER,
+                duration_ms     DOUBLE PRECISION,
+                samples         INTEGER,
+                folded          TEXT,
+                stats           TEXT,
+                raw             BYTEA
+            );
+        """)
+        
+        print("Creating indexes...")
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_request_profiles_captured_at
+            ON request_profiles (captured_at);
+        """)
+        
+        conn.commit()
+        print("Migration completed successfully!")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"Migration failed: {e}")
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,45 @@
+"""
+Migration script to:
+1. Add row_version and updated_at to the rmas table
+   (bumped by every mutating route; used for ETag caching)
+"""
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+import os
+
+DATABASE_URL = os.environ.get("DATABASE_URL")
+
+def migrate():
+    conn = psycopg2.connect(DATABASE_URL)
+    conn.autocommit = False
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    
+    try:
+        print("Starting migration...")
+        
+        print("Adding row_version column to rmas table...")
+        cur.execute("""
+            ALTER TABLE rmas 
+            ADD COLUMN IF NOT EXISTS row_version INTEGER NOT NULL DEFAULT 1;
+        """)
+        
+        print("Adding updated_at column to rmas table...")
+        cur.execute("""
+            ALTER TABLE rmas 
+            ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT NOW();
+        """)
+        
+        conn.commit()
+        print("Migration completed successfully!")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"Migration failed: {e}")
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,59 @@
+"""
+Migration script to:
+1. Create the slow_queries table (filled by the slow query log in app.py,
+   shown on /admin/slow-queries)
+"""
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+import os
+
+DATABASE_URL = os.environ.get("DATABASE_URL")
+
+def migrate():
+    conn = psycopg2.connect(DATABASE_URL)
+    conn.autocommit = False
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    
+    try:
+        print("Starting migration...")
+        
+        print("Creating slow_queries table...")
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS slow_queries (
+                slow_query_id   SERIAL PRIMARY KEY,
+                fingerprint     TEXT NOT NULL,
+                normalized_sql  TEXT NOT NULL,
+                params          TEXT,
+                duration_ms     DOUBLE PRECISION NOT NULL,
+                row_count       INTEGER,
+                route           TEXT,
+                endpoint        TEXT,
+                captured_at     TIMESTAMP NOT NULL DEFAULT NOW(),
+                plan            TEXT
+            );
+        """)
+        
+        print("Creating indexes...")
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_slow_queries_captured_at
+            ON slow_queries (captured_at);
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_slow_queries_fingerprint
+            ON slow_queries (fingerprint, captured_at DESC);
+        """)
+        
+        conn.commit()
+        print("Migration completed successfully!")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"Migration failed: {e}")
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+if __name__ == "__main__":
+    migrate()
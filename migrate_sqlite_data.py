@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+"""
+SQLite -> Postgres data migrator
+
+Moves the legacy records in rma_system.db (CamelCase columns such as
+RMAID, DateOpened, OwnerID) into the Postgres tables from schema.sql.
+convert_sqlite_to_postgres.py only rewrites source code; this moves the data.
+
+- Each SQLite table is read in chunks and streamed into Postgres with
+  COPY FROM STDIN (no per-row INSERTs).
+- Tables that don't reference each other load in parallel, one level of
+  the foreign-key graph at a time.
+- Every table loads in its own transaction and is recorded in
+  sqlite_migration_state, so re-running skips tables that already finished.
+- Serial sequences are bumped past the copied ids afterwards.
+- Row counts and a checksum over each table's key and text columns are
+  compared between SQLite and Postgres.
+
+Usage:
+    python migrate_sqlite_data.py [--sqlite rma_system.db] [--workers 4]
+    python migrate_sqlite_data.py --verify-only
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import RealDictCursor
+
+from convert_sqlite_to_postgres import REPLACEMENTS
+
+DATABASE_URL = os.environ.get("DATABASE_URL")
+DEFAULT_SQLITE_PATH = "rma_system.db"
+
+# Rows pulled from SQLite per fetchmany()
+CHUNK_SIZE = 5000
+
+# Every table in a level only references tables in earlier levels,
+# so the tables inside one level can be copied at the same time.
+LOAD_LEVELS = [
+    ["users", "customers"],
+    ["rmas", "notification_preferences"],
+    ["rma_lines", "status_history", "notes_history", "rma_owners", "credit_history"],
+    ["dispositions", "attachments"],
+]
+
+PRIMARY_KEYS = {
+    "users": "user_id",
+    "customers": "customer_id",
+    "rmas": "rma_id",
+    "notification_preferences": "preference_id",
+    "rma_lines": "rma_line_id",
+    "status_history": "status_hist_id",
+    "notes_history": "note_hist_id",
+    "rma_owners": "assignment_id",
+    "credit_history": "credit_hist_id",
+    "dispositions": "disposition_id",
+    "attachments": "attachment_id",
+}
+
+# Legacy SQLite table names to try, in order, for each Postgres table
+SOURCE_TABLES = {
+    "rma_lines": ["rma_lines", "line_items"],
+    "notification_preferences": ["notification_preferences", "owner_notification_preferences"],
+}
+
+# Per-table renames that differ from the global REPLACEMENTS map
+COLUMN_OVERRIDES = {
+    "rma_owners": {"RMAOwnerID": "assignment_id", "OwnerID": "user_id"},
+    "rma_lines": {"LineItemID": "rma_line_id"},
+    "dispositions": {"LineItemID": "rma_line_id"},
+    "attachments": {"LineItemID": "rma_line_id"},
+    "notification_preferences": {"OwnerID": "user_id"},
+}
+
+STATE_TABLE = "sqlite_migration_state"
+
+# Stand-in for NULL when hashing rows (must match the SQL in pg_checksum)
+NULL_MARK = "<NULL>"
+
+
+# ============ COLUMN MAPPING ============
+
+def target_column(table, legacy_name):
+    """Map a legacy SQLite column name to its schema.sql name."""
+    overrides = COLUMN_OVERRIDES.get(table, {})
+    if legacy_name in overrides:
+        return overrides[legacy_name]
+    if legacy_name in REPLACEMENTS:
+        return REPLACEMENTS[legacy_name]
+    # Fallback: CamelCase -> snake_case (already-snake names pass through)
+    return re.sub(r"(?<=[a-z0-9])(?=[A-Z])", "_", legacy_name).lower()
+
+
+def make_converter(data_type):
+    """Return a function that coerces a SQLite value for a Postgres column type."""
+    def convert(value):
+        if value is None:
+            return None
+        if isinstance(value, str) and value.strip() == "" and data_type != "text":
+            return None
+        if data_type == "boolean":
+            if isinstance(value, (int, float)):
+                return bool(value)
+            return str(value).strip().lower() in ("1", "t", "true", "y", "yes")
+        if data_type in ("integer", "bigint", "smallint"):
+            if isinstance(value, float) and value.is_integer():
+                return int(value)
+            return value
+        if data_type == "date":
+            # Legacy rows sometimes hold a full timestamp in date columns
+            return str(value).strip()[:10]
+        return value
+    return convert
+
+
+def copy_text(value):
+    """Render one value in COPY text format."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def row_checksum(values):
+    """Order-independent per-row hash; summed per table."""
+    text = "|".join(NULL_MARK if v is None else str(v) for v in values)
+    return int(hashlib.md5(text.encode("utf-8")).hexdigest()[:7], 16)
+
+
+class CopyStream:
+    """
+    File-like object for copy_expert(): pulls SQLite rows a chunk at a time,
+    converts them and hands back COPY text. Counts rows and accumulates the
+    checksum on the way through so SQLite is only read once.
+    """
+
+    def __init__(self, cursor, converters, checksum_idx, chunk_size):
+        self.cursor = cursor
+        self.converters = converters
+        self.checksum_idx = checksum_idx
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.done = False
+        self.rows = 0
+        self.checksum = 0
+
+    def _fill(self):
+        rows = self.cursor.fetchmany(self.chunk_size)
+        if not rows:
+            self.done = True
+            return
+        lines = []
+        for raw in rows:
+            values = [conv(v) for conv, v in zip(self.converters, raw)]
+            self.checksum += row_checksum([values[i] for i in self.checksum_idx])
+            lines.append("\t".join(copy_text(v) for v in values))
+        self.rows += len(rows)
+        self.buffer += "\n".join(lines) + "\n"
+
+    def read(self, size=-1):
+        while not self.done and (size is None or size < 0 or len(self.buffer) < size):
+            self._fill()
+        if size is None or size < 0:
+            out, self.buffer = self.buffer, ""
+        else:
+            out, self.buffer = self.buffer[:size], self.buffer[size:]
+        return out
+
+    def readline(self):
+        while not self.done and "\n" not in self.buffer:
+            self._fill()
+        line, sep, rest = self.buffer.partition("\n")
+        self.buffer = rest
+        return line + sep
+
+
+# ============ DB HELPERS ============
+
+def pg_connect(database_url):
+    return psycopg2.connect(database_url, cursor_factory=RealDictCursor)
+
+
+def ensure_state_table(database_url):
+    conn = pg_connect(database_url)
+    cur = conn.cursor()
+    cur.execute(sql.SQL("""
+        CREATE TABLE IF NOT EXISTS {} (
+            table_name   TEXT PRIMARY KEY,
+            source_table TEXT NOT NULL,
+            rows_loaded  INTEGER NOT NULL,
+            checksum     BIGINT NOT NULL,
+            seconds      NUMERIC(10,2),
+            finished_on  TIMESTAMP NOT NULL
+        )
+    """).format(sql.Identifier(STATE_TABLE)))
+    conn.commit()
+    conn.close()
+
+
+def pg_columns(cur, table):
+    """Column name -> data_type for a Postgres table."""
+    cur.execute(
+        """
+        SELECT column_name, data_type
+        FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s
+        """,
+        (table,),
+    )
+    return {r["column_name"]: r["data_type"] for r in cur.fetchall()}
+
+
+def find_source_table(sqlite_conn, table):
+    existing = {
+        r[0] for r in sqlite_conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    }
+    for candidate in SOURCE_TABLES.get(table, [table]):
+        if candidate in existing:
+            return candidate
+    return None
+
+
+def plan_columns(sqlite_conn, source, table, target_types):
+    """
+    Work out which legacy columns to read and where each one goes.
+    Returns (legacy_cols, target_cols, dropped).
+    """
+    legacy_cols, target_cols, dropped = [], [], []
+    for row in sqlite_conn.execute(f'PRAGMA table_info("{source}")'):
+        legacy = row[1]
+        target = target_column(table, legacy)
+        if target in target_types and target not in target_cols:
+            legacy_cols.append(legacy)
+            target_cols.append(target)
+        else:
+            dropped.append(legacy)
+    return legacy_cols, target_cols, dropped
+
+
+def checksum_columns(table, target_cols, target_types):
+    """Primary key plus text columns: these round-trip byte for byte."""
+    pk = PRIMARY_KEYS[table]
+    cols = [pk] if pk in target_cols else []
+    cols += [c for c in target_cols if c != pk and target_types[c] == "text"]
+    return cols
+
+
+def pg_checksum(cur, table, cols):
+    if not cols:
+        return 0
+    row_expr = sql.SQL("concat_ws('|', {})").format(
+        sql.SQL(", ").join(
+            sql.SQL("COALESCE({}::text, {})").format(sql.Identifier(c), sql.Literal(NULL_MARK))
+            for c in cols
+        )
+    )
+    cur.execute(
+        sql.SQL(
+            "SELECT COALESCE(SUM(('x' || substr(md5({}), 1, 7))::bit(28)::bigint), 0) AS checksum FROM {}"
+        ).format(row_expr, sql.Identifier(table))
+    )
+    return int(cur.fetchone()["checksum"])
+
+
+# ============ LOAD ============
+
+def load_table(table, sqlite_path, database_url, chunk_size):
+    """Copy one table inside its own transaction. Returns a status string."""
+    conn = pg_connect(database_url)
+    cur = conn.cursor()
+    sqlite_conn = sqlite3.connect(sqlite_path)
+
+    try:
+        cur.execute(
+            sql.SQL("SELECT rows_loaded FROM {} WHERE table_name = %s").format(sql.Identifier(STATE_TABLE)),
+            (table,),
+        )
+        done = cur.fetchone()
+        if done:
+            return f"{table}: already loaded ({done['rows_loaded']} rows), skipped"
+
+        source = find_source_table(sqlite_conn, table)
+        if not source:
+            return f"{table}: no SQLite source table, skipped"
+
+        target_types = pg_columns(cur, table)
+        legacy_cols, target_cols, dropped = plan_columns(sqlite_conn, source, table, target_types)
+        if not target_cols:
+            return f"{table}: no matching columns in {source}, skipped"
+
+        cur.execute(sql.SQL("SELECT EXISTS (SELECT 1 FROM {}) AS has_rows").format(sql.Identifier(table)))
+        if cur.fetchone()["has_rows"]:
+            raise RuntimeError(
+                f"{table} already has rows in Postgres but no migration record; "
+                "empty it first or mark it done in " + STATE_TABLE
+            )
+
+        pk = PRIMARY_KEYS[table]
+        order_col = legacy_cols[target_cols.index(pk)] if pk in target_cols else "rowid"
+        select = "SELECT {} FROM \"{}\" ORDER BY \"{}\"".format(
+            ", ".join(f'"{c}"' for c in legacy_cols), source, order_col
+        )
+        sqlite_cur = sqlite_conn.execute(select)
+
+        check_cols = checksum_columns(table, target_cols, target_types)
+        stream = CopyStream(
+            sqlite_cur,
+            [make_converter(target_types[c]) for c in target_cols],
+            [target_cols.index(c) for c in check_cols],
+            chunk_size,
+        )
+
+        started = time.time()
+        cur.copy_expert(
+            sql.SQL("COPY {} ({}) FROM STDIN").format(
+                sql.Identifier(table),
+                sql.SQL(", ").join(sql.Identifier(c) for c in target_cols),
+            ),
+            stream,
+        )
+        seconds = time.time() - started
+
+        cur.execute(
+            sql.SQL("""
+                INSERT INTO {} (table_name, source_table, rows_loaded, checksum, seconds, finished_on)
+                VALUES (%s, %s, %s, %s, %s, now())
+            """).format(sql.Identifier(STATE_TABLE)),
+            (table, source, stream.rows, stream.checksum, round(seconds, 2)),
+        )
+        conn.commit()
+
+        note = f" (ignored legacy columns: {', '.join(dropped)})" if dropped else ""
+        return f"{table}: {stream.rows} rows from {source} in {seconds:.1f}s{note}"
+
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        sqlite_conn.close()
+        cur.close()
+        conn.close()
+
+
+def fix_sequences(database_url):
+    """Move every serial sequence past the highest copied id."""
+    conn = pg_connect(database_url)
+    cur = conn.cursor()
+    for table, pk in PRIMARY_KEYS.items():
+        cur.execute(
+            sql.SQL("""
+                SELECT setval(
+                    pg_get_serial_sequence(%s, %s),
+                    COALESCE((SELECT MAX({pk}) FROM {table}), 1),
+                    (SELECT MAX({pk}) FROM {table}) IS NOT NULL
+                )
+            """).format(pk=sql.Identifier(pk), table=sql.Identifier(table)),
+            (table, pk),
+        )
+    conn.commit()
+    conn.close()
+    print("✓ Sequences updated")
+
+
+def verify(sqlite_path, database_url):
+    """Compare row counts and checksums. Returns True if everything matches."""
+    conn = pg_connect(database_url)
+    cur = conn.cursor()
+    sqlite_conn = sqlite3.connect(sqlite_path)
+
+    cur.execute(sql.SQL("SELECT * FROM {} ORDER BY table_name").format(sql.Identifier(STATE_TABLE)))
+    state = {r["table_name"]: r for r in cur.fetchall()}
+
+    ok = True
+    print(f"\n{'table':<26}{'sqlite':>10}{'postgres':>10}  checksum")
+    for level in LOAD_LEVELS:
+        for table in level:
+            rec = state.get(table)
+            if not rec:
+                print(f"{table:<26}{'-':>10}{'-':>10}  not loaded")
+                continue
+
+            sqlite_count = sqlite_conn.execute(
+                f'SELECT COUNT(*) FROM "{rec["source_table"]}"'
+            ).fetchone()[0]
+            cur.execute(sql.SQL("SELECT COUNT(*) AS count FROM {}").format(sql.Identifier(table)))
+            pg_count = cur.fetchone()["count"]
+
+            target_types = pg_columns(cur, table)
+            _, target_cols, _ = plan_columns(sqlite_conn, rec["source_table"], table, target_types)
+            pg_sum = pg_checksum(cur, table, checksum_columns(table, target_cols, target_types))
+
+            counts_ok = sqlite_count == pg_count == rec["rows_loaded"]
+            sum_ok = pg_sum == rec["checksum"]
+            ok = ok and counts_ok and sum_ok
+            print(
+                f"{table:<26}{sqlite_count:>10}{pg_count:>10}  "
+                f"{'ok' if sum_ok else 'MISMATCH'}{'' if counts_ok else '  (row count mismatch)'}"
+            )
+
+    sqlite_conn.close()
+    conn.close()
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy legacy SQLite RMA data into Postgres.")
+    parser.add_argument("--sqlite", default=DEFAULT_SQLITE_PATH, help="path to the SQLite file")
+    parser.add_argument("--database-url", default=DATABASE_URL, help="Postgres URL (default: $DATABASE_URL)")
+    parser.add_argument("--workers", type=int, default=4, help="tables copied in parallel")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="SQLite rows per fetch")
+    parser.add_argument("--verify-only", action="store_true", help="only compare counts/checksums")
+    args = parser.parse_args()
+
+    if not args.database_url:
+        sys.exit("DATABASE_URL is not set.")
+    if not os.path.exists(args.sqlite):
+        sys.exit(f"SQLite file not found: {args.sqlite}")
+
+    ensure_state_table(args.database_url)
+
+    if not args.verify_only:
+        started = time.time()
+        for n, level in enumerate(LOAD_LEVELS, start=1):
+            print(f"\nLevel {n}: {', '.join(level)}")
+            with ThreadPoolExecutor(max_workers=args.workers) as pool:
+                futures = {
+                    table: pool.submit(load_table, table, args.sqlite, args.database_url, args.chunk_size)
+                    for table in level
+                }
+            failed = False
+            for table, future in futures.items():
+                try:
+                    print(f"  ✓ {future.result()}")
+                except Exception as e:
+                    failed = True
+                    print(f"  ❌ {table}: {e}")
+            if failed:
+                # Later levels reference these tables; fix and re-run to resume
+                sys.exit("\nStopped. Re-run after fixing the error; finished tables are skipped.")
+
+        fix_sequences(args.database_url)
+        print(f"\nLoaded in {time.time() - started:.1f}s")
+
+    if not verify(args.sqlite, args.database_url):
+        sys.exit("\n❌ Verification failed")
+    print("\n✅ Verification passed")
+
+
+if __name__ == "__main__":
+    main()
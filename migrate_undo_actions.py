@@ -0,0 +1,50 @@
+"""
+Migration script to:
+1. Create the undo_actions table (undo data for bulk actions on the RMA
+   list; the session only keeps its token)
+"""
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+import os
+
+DATABASE_URL = os.environ.get("DATABASE_URL")
+
+def migrate():
+    conn = psycopg2.connect(DATABASE_URL)
+    conn.autocommit = False
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    
+    try:
+        print("Starting migration...")
+        
+        print("Creating undo_actions table...")
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS undo_actions (
+                token           TEXT PRIMARY KEY,
+                user_id         INTEGER NOT NULL,
+                action          TEXT NOT NULL,
+                data            TEXT NOT NULL,
+                created_at      TIMESTAMP NOT NULL DEFAULT NOW()
+            );
+        """)
+        
+        print("Creating indexes...")
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_undo_actions_user_id
+            ON undo_actions (user_id);
+        """)
+        
+        conn.commit()
+        print("Migration completed successfully!")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"Migration failed: {e}")
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+if __name__ == "__main__":
+    migrate()
@@ -1,21 +1,77 @@
+import os
+import sys
 import threading
+import time
+import urllib.error
+import urllib.request
+
 import webview  # pip install pywebview
-from app import app  # your existing Flask app object
+from waitress.server import create_server  # pip install waitress
+
+# No server configured: run offline on the bundled SQLite file (see db_sqlite.py)
+os.environ.setdefault("DATABASE_URL", "sqlite:///rma_system.db")
+
+from app import app, run_startup_tasks  # your existing Flask app object
+
+# A handful of threads covers one window's page loads plus parallel
+# uploads/XHRs; keep-alive connections are closed after CHANNEL_TIMEOUT so
+# an idle webview doesn't pin threads.
+THREADS = int(os.environ.get("RMA_DESKTOP_THREADS", "8"))
+CHANNEL_TIMEOUT = 120    # seconds; long enough for a slow upload to the share
+READY_TIMEOUT = 30       # seconds to wait for the first page before giving up
+
+
+def start_server():
+    """Bind waitress to a free local port (port 0) and serve in the background."""
+    server = create_server(
+        app,
+        host="127.0.0.1",
+        port=0,
+        threads=THREADS,
+        channel_timeout=CHANNEL_TIMEOUT,
+        connection_limit=100,
+        ident="RMA System",
+    )
+    threading.Thread(target=server.run, name="waitress", daemon=True).start()
+    return server
+
+
+def wait_until_ready(url, timeout=READY_TIMEOUT):
+    """Poll the login page so the window never opens on a blank page."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"{url}/login", timeout=2).close()
+            return True
+        except urllib.error.HTTPError:
+            return True    # any HTTP answer means Flask is serving
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.1)
+    return False
+
+
+def stop_server(server):
+    """Let in-flight requests finish (up to a few seconds), then close the socket."""
+    server.task_dispatcher.shutdown(timeout=5)
+    server.close()
 
-def start_flask():
-    # debug=False so it doesn't try to reload itself
-    app.run(host="127.0.0.1", port=5000, debug=False)
 
 if __name__ == "__main__":
-    # Start Flask in the background
-    t = threading.Thread(target=start_flask, daemon=True)
-    t.start()
+    # Admin seeding, schema check, template warmup - once, before serving
+    run_startup_tasks()
+
+    server = start_server()
+    url = f"http://127.0.0.1:{server.effective_port}"
+    if not wait_until_ready(url):
+        stop_server(server)
+        sys.exit(f"RMA System did not start within {READY_TIMEOUT}s")
 
-    # Open it in a desktop window
+    # Open it in a desktop window; start() returns once the window is closed
     webview.create_window(
         "RMA System",
-        "http://127.0.0.1:5000",
+        url,
         width=1200,
         height=800,
     )
     webview.start()
+    stop_server(server)
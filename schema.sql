@@ -65,6 +65,9 @@ CREATE TABLE IF NOT EXISTS rmas (
     credit_rejected_by     INTEGER,
     credit_rejection_reason TEXT,
     credit_issued_on       TIMESTAMP,
+    -- Bumped by every change to the RMA or its child rows (page/API ETags)
+    row_version            INTEGER NOT NULL DEFAULT 1,
+    updated_at             TIMESTAMP DEFAULT NOW(),
     CONSTRAINT fk_rmas_customer
       FOREIGN KEY (customer_id) REFERENCES customers(customer_id),
     CONSTRAINT fk_rmas_assigned_to
@@ -154,6 +157,8 @@ CREATE TABLE IF NOT EXISTS dispositions (
     qty_replace         INTEGER,
     date_dispositioned  TIMESTAMP,
     disposition_by      INTEGER,
+    CONSTRAINT uq_dispositions_line
+      UNIQUE (rma_line_id),
     CONSTRAINT fk_dispositions_line
       FOREIGN KEY (rma_line_id) REFERENCES rma_lines(rma_line_id) ON DELETE CASCADE,
     CONSTRAINT fk_dispositions_by
@@ -210,3 +215,53 @@ CREATE TABLE IF NOT EXISTS credit_history (
     CONSTRAINT fk_credit_hist_action_by
       FOREIGN KEY (action_by) REFERENCES users(user_id)
 );
+
+-- Slow query log (written by app.py when a statement exceeds SLOW_QUERY_MS)
+CREATE TABLE IF NOT EXISTS slow_queries (
+    slow_query_id    SERIAL PRIMARY KEY,
+    fingerprint      TEXT NOT NULL,
+    normalized_sql   TEXT NOT NULL,
+    params           TEXT,
+    duration_ms      DOUBLE PRECISION NOT NULL,
+    row_count        INTEGER,
+    route            TEXT,
+    endpoint         TEXT,
+    captured_at      TIMESTAMP NOT NULL DEFAULT NOW(),
+    plan             TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_slow_queries_captured_at ON slow_queries (captured_at);
+CREATE INDEX IF NOT EXISTS idx_slow_queries_fingerprint ON slow_queries (fingerprint, captured_at DESC);
+
+-- Request profiles (on-demand / background profiler in app.py, shown on /admin/profiles)
+CREATE TABLE IF NOT EXISTS request_profiles (
+    profile_id       SERIAL PRIMARY KEY,
+    captured_at      TIMESTAMP NOT NULL DEFAULT NOW(),
+    mode             TEXT NOT NULL,
+    trigger          TEXT NOT NULL,
+    requested_by     TEXT,
+    method           TEXT,
+    path             TEXT,
+    route            TEXT,
+    endpoint         TEXT,
+    status           INTEGER,
+    duration_ms      DOUBLE PRECISION,
+    samples          INTEGER,
+    folded           TEXT,
+    stats            TEXT,
+    raw              BYTEA
+);
+
+CREATE INDEX IF NOT EXISTS idx_request_profiles_captured_at ON request_profiles (captured_at);
+
+-- Undo data for bulk actions on the RMA list (too big for the session cookie,
+-- which keeps only the token); one row per user, replaced by their next bulk action
+CREATE TABLE IF NOT EXISTS undo_actions (
+    token            TEXT PRIMARY KEY,
+    user_id          INTEGER NOT NULL,
+    action           TEXT NOT NULL,
+    data             TEXT NOT NULL,
+    created_at       TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_undo_actions_user_id ON undo_actions (user_id);
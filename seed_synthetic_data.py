@@ -0,0 +1,512 @@
+#!/usr/bin/env python3
+"""
+Synthetic data generator
+
+Fills Postgres with production-like volume for performance work:
+customers, users, RMAs with realistic status and age mixes, multi-owner
+assignments, lines, dispositions, status/notes/credit history and
+attachment rows (metadata only, no files on disk).
+
+- Deterministic: the same --seed, --as-of and counts give the same rows
+  (only the password hash differs, it is salted).
+- RMAs are generated a batch at a time and every table is streamed in
+  with COPY FROM STDIN, one transaction per batch.
+- Ids are assigned here, continuing after any existing rows; serial
+  sequences are moved past them at the end and the tables are ANALYZEd.
+- Customer volume is skewed (a few big accounts), RMA age is skewed
+  towards recent, and old RMAs are mostly Closed.
+
+Every generated user logs in with --password. --truncate empties all RMA
+tables and users first (ensure_admin_user() re-creates admin on next start).
+
+Usage:
+    python seed_synthetic_data.py --rmas 100000 [--seed 42] [--truncate]
+    python seed_synthetic_data.py --rmas 1000000 --customers 5000 --users 200
+"""
+
+import argparse
+import io
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+import psycopg2
+from psycopg2 import sql
+from werkzeug.security import generate_password_hash
+
+DATABASE_URL = os.environ.get("DATABASE_URL")
+
+# RMAs generated and copied per transaction
+BATCH_SIZE = 20000
+
+# Column order for COPY; the first column is the id assigned here
+TABLES = {
+    "customers": ["customer_id", "customer_name", "contact_name", "contact_email", "contact_address"],
+    "users": [
+        "user_id", "username", "password_hash", "full_name", "email", "role",
+        "is_owner", "is_admin", "created_on", "last_login",
+    ],
+    "rmas": [
+        "rma_id", "customer_id", "created_by_user_id", "date_opened", "customer_date_opened",
+        "date_closed", "closed_by", "status", "return_type", "assigned_to_user_id",
+        "acknowledged", "acknowledged_on", "acknowledged_by", "customer_complaint_desc",
+        "internal_notes", "notes_last_modified", "notes_modified_by", "credit_memo_number",
+        "credit_amount", "credit_approved", "credit_approved_on", "credit_approved_by",
+        "credit_rejected", "credit_rejected_on", "credit_rejected_by", "credit_rejection_reason",
+        "credit_issued_on", "row_version", "updated_at",
+    ],
+    "rma_owners": ["assignment_id", "rma_id", "user_id", "is_primary", "assigned_on", "assigned_by"],
+    "rma_lines": [
+        "rma_line_id", "rma_id", "part_number", "tool_number", "item_description",
+        "qty_affected", "po_lot_number", "total_cost",
+    ],
+    "dispositions": [
+        "disposition_id", "rma_line_id", "disposition", "failure_code", "failure_description",
+        "root_cause", "corrective_action", "qty_scrap", "qty_rework", "qty_replace",
+        "date_dispositioned", "disposition_by",
+    ],
+    "status_history": ["status_hist_id", "rma_id", "status", "changed_by", "changed_on", "comment"],
+    "notes_history": ["note_hist_id", "rma_id", "notes_content", "modified_by", "modified_on"],
+    "credit_history": [
+        "credit_hist_id", "rma_id", "action", "amount", "memo_number", "action_by", "action_on", "comment",
+    ],
+    "attachments": [
+        "attachment_id", "rma_id", "rma_line_id", "file_path", "filename", "attachment_type",
+        "added_by", "uploaded_by", "date_added", "uploaded_on",
+    ],
+}
+
+# Parents before children, so each batch satisfies the foreign keys as it goes
+RMA_TABLES = [
+    "rmas", "rma_owners", "rma_lines", "dispositions",
+    "status_history", "notes_history", "credit_history", "attachments",
+]
+
+STATUS_FLOW = ["Draft", "Acknowledged", "In Progress", "Disposition", "Closed"]
+
+# (max age in days, {final status: weight}); young RMAs are still open,
+# old ones are mostly closed
+STATUS_BY_AGE = [
+    (14, {"Draft": 30, "Acknowledged": 35, "In Progress": 25, "Disposition": 5, "Closed": 4, "Rejected": 1}),
+    (60, {"Draft": 5, "Acknowledged": 15, "In Progress": 35, "Disposition": 20, "Closed": 20, "Rejected": 5}),
+    (None, {"Draft": 1, "Acknowledged": 2, "In Progress": 6, "Disposition": 6, "Closed": 77, "Rejected": 8}),
+]
+
+RETURN_TYPES = {"Credit": 40, "Replacement": 30, "Repair and Return": 20, "TBD": 10}
+OWNER_COUNTS = {1: 60, 2: 30, 3: 10}
+LINE_COUNTS = {1: 50, 2: 25, 3: 12, 4: 8, 6: 5}
+ATTACHMENT_COUNTS = {0: 35, 1: 35, 2: 20, 3: 10}
+DISPOSITIONS = {
+    "Scrap": 30, "Rework": 25, "Replace": 20, "Return to Customer": 8, "No Fault Found": 12, "Credit": 5,
+}
+
+FIRST_NAMES = [
+    "Alex", "Jordan", "Sam", "Taylor", "Morgan", "Casey", "Jamie", "Riley", "Avery", "Quinn",
+    "Drew", "Reese", "Cameron", "Dana", "Emerson", "Harper", "Kendall", "Logan", "Parker", "Rowan",
+]
+LAST_NAMES = [
+    "Nguyen", "Garcia", "Smith", "Patel", "Kowalski", "Okafor", "Schmidt", "Rossi", "Kim", "Silva",
+    "Murphy", "Haddad", "Larsen", "Novak", "Tanaka", "Moreau", "Fischer", "Santos", "Ivanova", "Brown",
+]
+COMPANY_WORDS = [
+    "Apex", "Summit", "Precision", "Northern", "Allied", "Pioneer", "Keystone", "Vertex", "Harbor",
+    "Granite", "Cascade", "Liberty", "Meridian", "Frontier", "Sterling", "Atlas", "Beacon", "Titan",
+]
+COMPANY_KINDS = ["Molding", "Medical", "Automotive", "Plastics", "Devices", "Components", "Industries"]
+COMPANY_SUFFIXES = ["Inc.", "LLC", "Corp.", "Co.", "Ltd."]
+CITIES = ["Erie, PA", "Dayton, OH", "Grand Rapids, MI", "Rockford, IL", "Akron, OH", "Nashua, NH"]
+
+PART_PREFIXES = ["HSG", "CVR", "BZL", "CLP", "KNB", "LNS", "CAP", "BRK"]
+PART_DESCRIPTIONS = [
+    "Housing, upper", "Housing, lower", "Battery cover", "Front bezel", "Retaining clip",
+    "Control knob", "Light pipe", "End cap", "Mounting bracket", "Connector shroud",
+]
+COMPLAINTS = [
+    "Short shots on parts received in last shipment",
+    "Flash on parting line exceeds spec",
+    "Parts out of dimensional tolerance on critical feature",
+    "Color mismatch compared to approved master",
+    "Sink marks visible on cosmetic surface",
+    "Cracked bosses found during customer assembly",
+    "Wrong quantity in cartons, short by one layer",
+    "Contamination / black specks in parts",
+    "Warpage causing fit issues at assembly",
+    "Damaged in transit, crushed cartons",
+]
+NOTES = [
+    "Requested samples from customer for evaluation.",
+    "Samples received, sent to QC lab.",
+    "Reviewed with process engineering, adjusting pack/hold.",
+    "Customer confirmed lot numbers affected.",
+    "Sort in progress at customer site.",
+    "Waiting on customer photos.",
+    "Containment in place, inventory quarantined.",
+]
+FAILURES = [
+    ("DIM", "Dimensional out of tolerance", "Tool wear on cavity 3", "Tool repaired, first article re-run"),
+    ("COS", "Cosmetic defect", "Mold temperature drift", "Added temperature alarm to process sheet"),
+    ("SS", "Short shot", "Blocked vent", "Vent cleaning added to PM schedule"),
+    ("CON", "Contamination", "Regrind handling", "Segregated regrind bins"),
+    ("PKG", "Packaging / count", "Operator counting error", "Scale-count verification at pack-out"),
+    ("NFF", "No fault found", "Parts within specification", "None required"),
+]
+ATTACHMENT_NAMES = [
+    "photo_{n}.jpg", "inspection_report_{n}.pdf", "packing_slip.pdf", "measurements_{n}.xlsx",
+    "customer_email_{n}.msg",
+]
+REJECTION_REASONS = ["Outside warranty period", "Customer-caused damage", "Duplicate of existing RMA"]
+
+
+def copy_text(value):
+    """One value in COPY text format."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, str):
+        return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ")
+    return str(value)
+
+
+class TableBuffer:
+    """COPY text for one table, and the next id to hand out."""
+
+    def __init__(self, table, next_id):
+        self.table = table
+        self.columns = TABLES[table]
+        self.next_id = next_id
+        self.rows = 0
+        self.buf = io.StringIO()
+
+    def add(self, *values):
+        row_id = self.next_id
+        self.next_id += 1
+        self.buf.write("\t".join(map(copy_text, (row_id,) + values)))
+        self.buf.write("\n")
+        self.rows += 1
+        return row_id
+
+    def flush(self, cur):
+        if not self.buf.tell():
+            return
+        self.buf.seek(0)
+        cur.copy_expert(
+            sql.SQL("COPY {} ({}) FROM STDIN").format(
+                sql.Identifier(self.table),
+                sql.SQL(", ").join(sql.Identifier(c) for c in self.columns),
+            ),
+            self.buf,
+        )
+        self.buf = io.StringIO()
+
+
+def weighted(rng, weights):
+    """rng.choices over a {value: weight} dict."""
+    return rng.choices(list(weights), list(weights.values()))[0]
+
+
+def between(rng, start, end):
+    """Random datetime in [start, end], to the second."""
+    seconds = max(0, int((end - start).total_seconds()))
+    return start + timedelta(seconds=rng.randint(0, seconds))
+
+
+class Generator:
+    def __init__(self, rng, as_of, buffers, mean_age_days, max_age_days):
+        self.rng = rng
+        self.as_of = as_of
+        self.t = buffers
+        self.mean_age_days = mean_age_days
+        self.max_age_days = max_age_days
+        self.customer_ids = []
+        self.users = []       # (user_id, username)
+        self.owners = []      # owner user_ids
+        self.admins = []
+
+    def add_customers(self, count):
+        rng = self.rng
+        for _ in range(count):
+            name = f"{rng.choice(COMPANY_WORDS)} {rng.choice(COMPANY_KINDS)} {rng.choice(COMPANY_SUFFIXES)}"
+            contact = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+            customer_id = self.t["customers"].next_id
+            self.t["customers"].add(
+                name,
+                contact,
+                f"{contact.split()[0].lower()}.{customer_id}@customer.example.com",
+                f"{rng.randint(100, 9999)} Industrial Pkwy, {rng.choice(CITIES)}",
+            )
+            self.customer_ids.append(customer_id)
+
+    def add_users(self, count, password_hash):
+        rng = self.rng
+        for n in range(count):
+            user_id = self.t["users"].next_id
+            username = f"synth{user_id:05d}"
+            is_admin = n < 2
+            is_owner = is_admin or rng.random() < 0.6
+            created_on = self.as_of - timedelta(days=rng.randint(self.max_age_days, self.max_age_days + 365))
+            self.t["users"].add(
+                username,
+                password_hash,
+                f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                f"{username}@example.com",
+                "admin" if is_admin else "user",
+                int(is_owner),
+                int(is_admin),
+                created_on,
+                between(rng, self.as_of - timedelta(days=30), self.as_of),
+            )
+            self.users.append((user_id, username))
+            if is_owner:
+                self.owners.append(user_id)
+            if is_admin:
+                self.admins.append(user_id)
+
+    def customer(self):
+        # A few large accounts get most of the returns
+        return self.customer_ids[int(len(self.customer_ids) * self.rng.random() ** 2.5)]
+
+    def final_status(self, age_days):
+        for max_age, weights in STATUS_BY_AGE:
+            if max_age is None or age_days <= max_age:
+                return weighted(self.rng, weights)
+
+    def rma(self):
+        rng, t = self.rng, self.t
+        age = min(int(rng.expovariate(1 / self.mean_age_days)), self.max_age_days)
+        opened = self.as_of - timedelta(days=age, seconds=rng.randint(0, 86399))
+        final = self.final_status(age)
+        if final == "Rejected":
+            path = STATUS_FLOW[:rng.randint(1, 2)] + ["Rejected"]
+        else:
+            path = STATUS_FLOW[:STATUS_FLOW.index(final) + 1]
+
+        # Closed work finishes within weeks; open work has moved at some point since opening
+        if final in ("Closed", "Rejected"):
+            end = min(self.as_of, opened + timedelta(days=rng.expovariate(1 / 25) + 1))
+        else:
+            end = self.as_of
+        step_times = [opened] + sorted(between(rng, opened, end) for _ in path[1:])
+
+        creator, creator_name = rng.choice(self.users)
+        owners = rng.sample(self.owners, min(weighted(rng, OWNER_COUNTS), len(self.owners)))
+        primary = owners[0]
+        return_type = weighted(rng, RETURN_TYPES)
+        status_times = dict(zip(path, step_times))
+        rma_id = t["rmas"].next_id
+
+        for n, owner_id in enumerate(owners):
+            t["rma_owners"].add(rma_id, owner_id, int(n == 0), opened, creator)
+
+        for status, changed_on in status_times.items():
+            t["status_history"].add(
+                rma_id, status, creator if status == "Draft" else primary, changed_on,
+                "RMA created" if status == "Draft" else None,
+            )
+
+        total_cost = 0
+        dispositioned = final in ("Disposition", "Closed")
+        for _ in range(weighted(rng, LINE_COUNTS)):
+            qty = rng.choice([1, 2, 5, 10, 25, 50, 100, 250, 500, 1000])
+            cost = round(qty * rng.uniform(0.35, 18.0), 2)
+            total_cost += cost
+            line_id = t["rma_lines"].add(
+                rma_id,
+                f"{rng.choice(PART_PREFIXES)}-{rng.randint(10000, 99999)}",
+                f"T{rng.randint(100, 999)}" if rng.random() < 0.7 else None,
+                rng.choice(PART_DESCRIPTIONS),
+                qty,
+                f"PO{rng.randint(400000, 499999)}",
+                cost,
+            )
+            if dispositioned and rng.random() < 0.9:
+                disposition = weighted(rng, DISPOSITIONS)
+                code, description, root_cause, action = rng.choice(FAILURES)
+                scrap = qty if disposition == "Scrap" else 0
+                rework = qty if disposition == "Rework" else 0
+                t["dispositions"].add(
+                    line_id, disposition, code, description, root_cause, action,
+                    scrap, rework, qty - scrap - rework if disposition == "Replace" else 0,
+                    between(rng, status_times["Disposition"], end), rng.choice(owners),
+                )
+
+        notes = None
+        notes_at = notes_by = None
+        if rng.random() < 0.5:
+            for _ in range(rng.randint(1, 3)):
+                notes = rng.choice(NOTES)
+                notes_at = between(rng, opened, end)
+                notes_by = rng.choice(self.users)[1]
+                t["notes_history"].add(rma_id, notes, notes_by, notes_at)
+
+        memo = amount = approved_on = rejected_on = issued_on = reason = None
+        approver = None
+        if return_type == "Credit" and final != "Draft" and rng.random() < 0.8:
+            memo = f"CM-{opened.year}-{rma_id:06d}"
+            amount = round(total_cost * rng.uniform(0.5, 1.0), 2)
+            entered = between(rng, step_times[1], end)
+            t["credit_history"].add(rma_id, "entered", amount, memo, primary, entered, None)
+            approver = rng.choice(self.admins)
+            roll = rng.random()
+            if final == "Rejected" or (final == "Closed" and roll < 0.05):
+                rejected_on = between(rng, entered, end)
+                reason = rng.choice(REJECTION_REASONS)
+                t["credit_history"].add(rma_id, "rejected", amount, memo, approver, rejected_on, reason)
+            elif final == "Closed" and roll < 0.9:
+                approved_on = between(rng, entered, end)
+                t["credit_history"].add(rma_id, "approved", amount, memo, approver, approved_on, None)
+                if rng.random() < 0.9:
+                    issued_on = between(rng, approved_on, end)
+                    t["credit_history"].add(rma_id, "issued", amount, memo, approver, issued_on, None)
+
+        for n in range(weighted(rng, ATTACHMENT_COUNTS)):
+            filename = rng.choice(ATTACHMENT_NAMES).format(n=n + 1)
+            uploader = rng.choice(owners)
+            added = between(rng, opened, end)
+            t["attachments"].add(
+                rma_id, None, f"synthetic/RMA-{rma_id:04d}/{filename}", filename, "File",
+                str(uploader), uploader, added, added,
+            )
+
+        closed = final in ("Closed", "Rejected")
+        acknowledged = "Acknowledged" in status_times
+        t["rmas"].add(
+            self.customer(),
+            creator,
+            opened,
+            (opened - timedelta(days=rng.randint(0, 5))).date(),
+            step_times[-1] if closed else None,
+            primary if closed else None,
+            final,
+            return_type,
+            primary,
+            int(acknowledged),
+            status_times.get("Acknowledged"),
+            primary if acknowledged else None,
+            rng.choice(COMPLAINTS),
+            notes,
+            notes_at,
+            notes_by,
+            memo,
+            amount,
+            int(approved_on is not None),
+            approved_on,
+            approver if approved_on else None,
+            int(rejected_on is not None),
+            rejected_on,
+            approver if rejected_on else None,
+            reason,
+            issued_on,
+            len(path),
+            max(d for d in (step_times[-1], notes_at, approved_on, rejected_on, issued_on) if d),
+        )
+
+
+def next_ids(cur):
+    """First free id per table, so a run can add to existing data."""
+    ids = {}
+    for table, columns in TABLES.items():
+        cur.execute(
+            sql.SQL("SELECT COALESCE(MAX({}), 0) + 1 AS next_id FROM {}").format(
+                sql.Identifier(columns[0]), sql.Identifier(table)
+            )
+        )
+        ids[table] = cur.fetchone()[0]
+    return ids
+
+
+def fix_sequences(cur):
+    """Move every serial sequence past the highest generated id."""
+    for table, columns in TABLES.items():
+        pk = columns[0]
+        cur.execute(
+            sql.SQL("""
+                SELECT setval(
+                    pg_get_serial_sequence(%s, %s),
+                    COALESCE((SELECT MAX({pk}) FROM {table}), 1),
+                    (SELECT MAX({pk}) FROM {table}) IS NOT NULL
+                )
+            """).format(pk=sql.Identifier(pk), table=sql.Identifier(table)),
+            (table, pk),
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load deterministic synthetic RMA data into Postgres.")
+    parser.add_argument("--rmas", type=int, default=10000, help="RMAs to generate")
+    parser.add_argument("--customers", type=int, default=500)
+    parser.add_argument("--users", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--as-of", type=date.fromisoformat, default=date.today(),
+                        help="date the data is 'current' at (YYYY-MM-DD, default today)")
+    parser.add_argument("--mean-age-days", type=float, default=120, help="average RMA age")
+    parser.add_argument("--max-age-days", type=int, default=3 * 365, help="oldest RMA")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="RMAs per transaction")
+    parser.add_argument("--password", default="Synthetic123!", help="password for every generated user")
+    parser.add_argument("--truncate", action="store_true", help="empty the RMA tables and users first")
+    parser.add_argument("--database-url", default=DATABASE_URL, help="Postgres URL (default: $DATABASE_URL)")
+    args = parser.parse_args()
+
+    if not args.database_url:
+        sys.exit("DATABASE_URL is not set.")
+    if args.customers < 1 or args.users < 2:
+        sys.exit("Need at least 1 customer and 2 users.")
+
+    conn = psycopg2.connect(args.database_url)
+    cur = conn.cursor()
+    # Losing the tail of a bulk load on a crash is fine; re-run it
+    cur.execute("SET synchronous_commit = off")
+
+    if args.truncate:
+        print("Truncating RMA tables and users...")
+        cur.execute(
+            sql.SQL("TRUNCATE {} RESTART IDENTITY CASCADE").format(
+                sql.SQL(", ").join(sql.Identifier(table) for table in TABLES)
+            )
+        )
+        conn.commit()
+
+    started = time.time()
+    rng = random.Random(args.seed)
+    as_of = datetime.combine(args.as_of, datetime.min.time()) + timedelta(hours=17)
+    buffers = {table: TableBuffer(table, next_id) for table, next_id in next_ids(cur).items()}
+    gen = Generator(rng, as_of, buffers, args.mean_age_days, args.max_age_days)
+
+    gen.add_customers(args.customers)
+    gen.add_users(args.users, generate_password_hash(args.password))
+    buffers["customers"].flush(cur)
+    buffers["users"].flush(cur)
+    conn.commit()
+    print(f"✓ {args.customers} customers, {args.users} users ({len(gen.owners)} owners)")
+
+    done = 0
+    while done < args.rmas:
+        count = min(args.batch_size, args.rmas - done)
+        for _ in range(count):
+            gen.rma()
+        for table in RMA_TABLES:
+            buffers[table].flush(cur)
+        conn.commit()
+        done += count
+        elapsed = time.time() - started
+        print(f"  {done:>10,} RMAs  {elapsed:7.1f}s  ({done / elapsed:,.0f}/s)")
+
+    fix_sequences(cur)
+    conn.commit()
+
+    print("Analyzing...")
+    conn.autocommit = True
+    for table in TABLES:
+        cur.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(table)))
+    conn.close()
+
+    print()
+    for table in TABLES:
+        print(f"{table:<18}{buffers[table].rows:>12,} rows")
+    print(f"\n✅ Loaded in {time.time() - started:.1f}s (seed {args.seed}, as of {args.as_of})")
+
+
+if __name__ == "__main__":
+    main()
@@ -73,37 +73,36 @@ def should_send_reminder(owner_prefs):
         return days_since_last >= 1  # Default to daily
 
 
-def get_rmas_for_reminder(owner_id, age_threshold):
+def get_rmas_for_reminders():
     """
-    Get RMAs assigned to owner that meet the age threshold
-    
-    Args:
-        owner_id: int
-        age_threshold: int (days)
+    Get open RMAs for every owner in one query, each owner's list already
+    filtered by their own age threshold (RMAAge, default 3 days)
     
     Returns:
-        list of RMA dicts
+        dict of OwnerID -> list of RMA rows (oldest first)
     """
     conn = get_db()
     cur = conn.cursor()
     
     query = """
-        SELECT DISTINCT r.RMAID, r.DateOpened, r.Status, r.CustomerComplaintDesc,
-               c.CustomerName
+        SELECT DISTINCT ro.OwnerID, r.RMAID, r.DateOpened, r.Status,
+               r.CustomerComplaintDesc, c.CustomerName
         FROM rmas r
         JOIN rma_owners ro ON r.RMAID = ro.RMAID
         JOIN customers c ON r.CustomerID = c.CustomerID
-        WHERE ro.OwnerID = ?
-          AND r.Status NOT IN ('Closed', 'Rejected')
-          AND DATE(r.DateOpened) <= DATE('now', '-' || ? || ' days')
-        ORDER BY r.DateOpened ASC
+        LEFT JOIN owner_notification_preferences p ON p.OwnerID = ro.OwnerID
+        WHERE r.Status NOT IN ('Closed', 'Rejected')
+          AND DATE(r.DateOpened) <= DATE('now', '-' || COALESCE(p.RMAAge, 3) || ' days')
+        ORDER BY ro.OwnerID, r.DateOpened ASC
     """
     
-    cur.execute(query, (owner_id, age_threshold))
-    rmas = cur.fetchall()
+    cur.execute(query)
+    rmas_by_owner = {}
+    for row in cur.fetchall():
+        rmas_by_owner.setdefault(row['OwnerID'], []).append(row)
     conn.close()
     
-    return rmas
+    return rmas_by_owner
 
 
 def calculate_days_open(date_opened):
@@ -274,17 +273,20 @@ Update your preferences: """ + EMAIL_CONFIG['base_url'] + "/profile"
         return False
 
 
-def update_last_sent(owner_id):
-    """Update the LastSent timestamp for an owner"""
+def update_last_sent(owner_ids):
+    """Update the LastSent timestamp for the owners that were emailed"""
+    if not owner_ids:
+        return
+    
     conn = get_db()
     cur = conn.cursor()
     
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    cur.execute("""
+    cur.executemany("""
         UPDATE owner_notification_preferences
         SET LastSent = ?
         WHERE OwnerID = ?
-    """, (now, owner_id))
+    """, [(now, owner_id) for owner_id in owner_ids])
     
     conn.commit()
     conn.close()
@@ -323,7 +325,8 @@ def main():
     print(f"Processing {len(owners)} owners...")
     print()
     
-    sent_count = 0
+    rmas_by_owner = get_rmas_for_reminders()
+    sent_owner_ids = []
     skipped_count = 0
     
     for owner in owners:
@@ -345,7 +348,7 @@ def main():
         
         # Get RMAs for this owner
         age_threshold = owner_dict.get('RMAAge', 3)
-        rmas = get_rmas_for_reminder(owner_dict['OwnerID'], age_threshold)
+        rmas = rmas_by_owner.get(owner_dict['OwnerID'], [])
         
         if not rmas:
             print(f"  ℹ No RMAs meet criteria (Age threshold: {age_threshold} days)")
@@ -354,11 +357,13 @@ def main():
         
         # Send email
         if send_reminder_email(owner_dict, rmas):
-            update_last_sent(owner_dict['OwnerID'])
-            sent_count += 1
+            sent_owner_ids.append(owner_dict['OwnerID'])
         else:
             skipped_count += 1
     
+    update_last_sent(sent_owner_ids)
+    sent_count = len(sent_owner_ids)
+    
     print()
     print("="*70)
     print(f"Summary:")
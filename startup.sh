@@ -10,6 +10,20 @@ echo "🔄 Skipping migrate_consolidate_users.py (legacy SQLite migration)..."
 
 echo "✅ Database assumed ready (tables managed via Neon SQL script)"
 
+# Per-worker Prometheus files for /ops/metrics; stale ones from the last run
+# would be summed into the new totals, so start from an empty directory.
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/rma-prometheus}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
 # Start the application
 echo "🌐 Starting web server on port ${PORT:-10000}..."
-exec gunicorn app:app --bind 0.0.0.0:$PORT --workers 2 --timeout 120
+# gthread: live-update streams (/events) hold a thread, not a whole worker.
+# LIVE_MAX_CLIENTS defaults to half of GUNICORN_THREADS, so ordinary requests
+# always have threads left; gunicorn.conf.py refuses a cap at or above it.
+# GUNICORN_WORKER_CLASS=gevent: hundreds of requests per worker on greenlets;
+# the DB pool (RMA_DB_POOL_SIZE) then defaults to one connection per greenlet,
+# so point DATABASE_URL at Neon's pooled endpoint.
+WORKER_ARGS="--worker-class gthread --threads ${GUNICORN_THREADS:-32}" # default
+[ "$GUNICORN_WORKER_CLASS" = "gevent" ] && WORKER_ARGS="--worker-class gevent --worker-connections ${GUNICORN_WORKER_CONNECTIONS:-500}" # greenlets
+exec gunicorn app:app --config gunicorn.conf.py --bind 0.0.0.0:$PORT --workers 2 $WORKER_ARGS --timeout 120